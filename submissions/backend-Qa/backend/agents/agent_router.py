@@ -1,17 +1,120 @@
+import asyncio
+import importlib
+import os
 import re
-from .qa_agent import QAAgent
-from .test_generator_agent import TestGeneratorAgent
-from .selenium_generator_agent import SeleniumGeneratorAgent
-from .chat_agent import ChatAgent
-from .manual_testcase_agent import ManualTestCaseGenerator
+import threading
+import time
+from typing import Optional
+from utils.cancellation import CancellationToken, Cancelled, current_token
+from utils.circuit_breaker import CircuitOpen, mark_degraded_result
+from utils.metrics import metrics
+from utils.model_calls import arun_pipeline, run_pipeline
+from utils.request_context import request_scope
+from utils.rate_limiter import CallTooLarge, RateLimitExceeded
+from utils.singleflight import SingleFlight, make_request_key
+
+# Agents are built on first use so a process only pays for the agents (and the
+# agno / openai / tiktoken imports behind them) it actually serves.
+# Router attribute -> (agent module, agent class)
+AGENT_CLASSES = {
+    'qa_agent': ('.qa_agent', 'QAAgent'),
+    'test_generator': ('.test_generator_agent', 'TestGeneratorAgent'),
+    'selenium_generator': ('.selenium_generator_agent', 'SeleniumGeneratorAgent'),
+    'chat_agent': ('.chat_agent', 'ChatAgent'),
+    'manual_testcase_generator': ('.manual_testcase_agent', 'ManualTestCaseGenerator')
+}
+
+# Request agentType -> router attribute of the agent that serves it
+AGENT_TYPES = {
+    'test_generator': 'test_generator',
+    'gherkin': 'test_generator',
+    'selenium_generator': 'selenium_generator',
+    'selenium': 'selenium_generator',
+    'playwright': 'selenium_generator',
+    'cypress': 'selenium_generator',
+    'behave': 'selenium_generator',
+    'chat': 'chat_agent',
+    'manual_testcases': 'manual_testcase_generator',
+    'manual_planning': 'manual_testcase_generator'
+}
 
 class AgentRouter:
-    def __init__(self):
-        self.qa_agent = QAAgent()
-        self.test_generator = TestGeneratorAgent()
-        self.selenium_generator = SeleniumGeneratorAgent()
-        self.chat_agent = ChatAgent()
-        self.manual_testcase_generator = ManualTestCaseGenerator()
+    def __init__(self, prewarm=None):
+        """
+        Args:
+            prewarm: Agent types (or agent attribute names) to build right away,
+                     as a list or comma-separated string; 'all' builds every agent
+        """
+        self._agent_lock = threading.Lock()
+        self.load_times = {}
+        # Identical requests arriving while one is being generated share its result
+        coalesce = os.getenv('REQUEST_COALESCING', 'true').lower() not in ('0', 'false', 'no')
+        self.singleflight = SingleFlight() if coalesce else None
+        if prewarm:
+            self.prewarm(prewarm)
+
+    def __getattr__(self, name):
+        # Only called when the attribute is not set yet, i.e. before first use
+        if name in AGENT_CLASSES:
+            return self.get_agent(name)
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def get_agent(self, name: str):
+        """Return the agent stored under name, importing and building it on first use"""
+        agent = self.__dict__.get(name)
+        if agent is not None:
+            return agent
+
+        with self._agent_lock:
+            agent = self.__dict__.get(name)
+            if agent is None:
+                module_name, class_name = AGENT_CLASSES[name]
+                start_time = time.time()
+                agent_class = getattr(importlib.import_module(module_name, __package__), class_name)
+                agent = agent_class()
+                self.load_times[name] = round(time.time() - start_time, 3)
+                print(f"Loaded {class_name} in {self.load_times[name]:.2f}s")
+                setattr(self, name, agent)
+        return agent
+
+    def prewarm(self, agent_types) -> list:
+        """
+        Build agents ahead of their first request
+
+        Args:
+            agent_types: List or comma-separated string of agent types or agent
+                         attribute names; 'all' builds every agent
+
+        Returns:
+            The attribute names of the agents that were built
+        """
+        if isinstance(agent_types, str):
+            agent_types = agent_types.split(',')
+        names = []
+        for agent_type in (t.strip().lower() for t in agent_types):
+            if not agent_type:
+                continue
+            if agent_type == 'all':
+                candidates = list(AGENT_CLASSES)
+            elif agent_type in AGENT_CLASSES:
+                candidates = [agent_type]
+            elif agent_type in AGENT_TYPES:
+                candidates = [AGENT_TYPES[agent_type]]
+            else:
+                print(f"Unknown agent type in prewarm list: {agent_type}")
+                continue
+            names.extend(name for name in candidates if name not in names)
+
+        for name in names:
+            try:
+                self.get_agent(name)
+            except Exception as e:
+                print(f"Error prewarming {name}: {str(e)}")
+        return names
+
+    def loaded_agents(self) -> dict:
+        """Return the agents built so far with their construction time in seconds"""
+        return dict(self.load_times)
 
     def is_valid_request(self, text):
         """Validates if the request text is meaningful enough to process."""
@@ -46,7 +149,81 @@ class AgentRouter:
         # If we get here, do a final length check - longer texts are more likely to be valid
         return len(text.strip()) > 15
     
-    def route_request(self, request_data: dict) -> dict:
+    def route_request(self, request_data: dict, cancel_token: Optional[CancellationToken] = None) -> dict:
+        """
+        Route a request to its agent and return the agent's response
+
+        Args:
+            request_data: Generation request
+            cancel_token: Token that stops the agent between model calls once
+                          cancelled (defaults to the token of the request scope)
+        """
+        try:
+            with request_scope(cancel_token=cancel_token or current_token()):
+                # Concurrent requests with the same normalized key run once; the key is
+                # taken before _route_pipeline adds chunk markers to the requirement
+                if self.singleflight is not None and isinstance(request_data, dict):
+                    key = make_request_key(request_data)
+                    return self.singleflight.do(key, lambda: run_pipeline(self._scoped_pipeline(request_data)))
+                return run_pipeline(self._scoped_pipeline(request_data))
+        except Cancelled as e:
+            print(str(e))
+            return {'status': 'error', 'message': str(e), 'cancelled': True}
+
+    async def aroute_request(self, request_data: dict, cancel_token: Optional[CancellationToken] = None) -> dict:
+        """
+        Async counterpart of route_request.
+
+        The agents run the same steps, but their model calls are awaited on the
+        event loop with agent.arun instead of blocking a worker thread, so a
+        waiting request costs a task rather than a thread.
+        """
+        try:
+            with request_scope(cancel_token=cancel_token or current_token()):
+                return await self._aroute(request_data)
+        except Cancelled as e:
+            print(str(e))
+            return {'status': 'error', 'message': str(e), 'cancelled': True}
+
+    async def _aroute(self, request_data: dict) -> dict:
+        # Building an agent imports its model libraries: keep that off the event loop
+        agent_type = request_data.get('agentType', '') if isinstance(request_data, dict) else ''
+        name = AGENT_TYPES.get(agent_type.lower()) if isinstance(agent_type, str) else None
+        if name is not None and name not in self.__dict__:
+            await asyncio.to_thread(self.get_agent, name)
+
+        if self.singleflight is not None and isinstance(request_data, dict):
+            key = make_request_key(request_data)
+            return await self.singleflight.ado(key, lambda: arun_pipeline(self._scoped_pipeline(request_data)))
+        return await arun_pipeline(self._scoped_pipeline(request_data))
+
+    def _scoped_pipeline(self, request_data: dict):
+        """Pipeline of a router request (see utils.model_calls), run inside its request scope"""
+        # Per-request options are read by the model-call layer through the request context
+        options = request_data if isinstance(request_data, dict) else {}
+        # Model calls that fail or hit an open circuit breaker add their model here
+        degraded_models = {}
+        with request_scope(bypass_cache=bool(options.get('bypassCache', False)),
+                           structured_output=options.get('structuredOutput'),
+                           degraded_models=degraded_models):
+            try:
+                result = yield from self._route_pipeline(request_data)
+            except CallTooLarge as e:
+                # Retrying cannot help: the request has to get smaller
+                print(f"Request too large: {str(e)}")
+                return {'status': 'error', 'message': str(e), 'too_large': True}
+            except RateLimitExceeded as e:
+                print(f"Rate limit: {str(e)}")
+                return {'status': 'error', 'message': str(e), 'rate_limited': True, 'retry_after': e.retry_after}
+            except CircuitOpen as e:
+                print(f"Circuit open: {str(e)}")
+                return mark_degraded_result(
+                    {'status': 'error', 'message': str(e), 'circuit_open': True, 'retry_after': e.retry_after},
+                    degraded_models
+                )
+        return mark_degraded_result(result, degraded_models)
+
+    def _route_pipeline(self, request_data: dict):
         try:
             print(f"Received request data: {request_data}")
 
@@ -89,22 +266,24 @@ class AgentRouter:
 
             if agent_type == 'test_generator' or agent_type == 'gherkin':
                 print("Routing to test generator agent")
-                return self.test_generator.generate_gherkin(request_data)
+                return (yield from self.test_generator.gherkin_pipeline(request_data))
 
             elif agent_type == 'selenium_generator' or agent_type == 'selenium':
                 print("Routing to selenium generator agent")
                 try:
                     # Check language parameter
-                    language = request_data.get('language', 'python').lower()
+                    language = (request_data.get('language') or 'python').lower()
                     if language == 'java':
                         return {
                             'status': 'error',
                             'message': 'Java Selenium Script Generator is currently under development. Please use Python for Selenium scripts for now.'
                         }
                     
-                    result = self.selenium_generator.generate_selenium_script(request_data)
+                    result = yield from self.selenium_generator.script_pipeline(request_data)
                     print(f"Selenium generator result: {result['status']}")
                     return result
+                except (RateLimitExceeded, CircuitOpen, Cancelled):
+                    raise
                 except Exception as e:
                     print(f"Error in selenium generator: {str(e)}")
                     import traceback
@@ -118,9 +297,11 @@ class AgentRouter:
                     # Assuming we have a playwright generator agent
                     # For now, we'll use the selenium generator with a note
                     request_data['note'] = 'Using Selenium format as a base for Playwright'
-                    result = self.selenium_generator.generate_selenium_script(request_data)
+                    result = yield from self.selenium_generator.script_pipeline(request_data)
                     print(f"Playwright generator result: {result['status']}")
                     return result
+                except (RateLimitExceeded, CircuitOpen, Cancelled):
+                    raise
                 except Exception as e:
                     print(f"Error in playwright generator: {str(e)}")
                     import traceback
@@ -133,9 +314,11 @@ class AgentRouter:
                     # Assuming we have a cypress generator agent
                     # For now, we'll use the selenium generator with a note
                     request_data['note'] = 'Using Selenium format as a base for Cypress'
-                    result = self.selenium_generator.generate_selenium_script(request_data)
+                    result = yield from self.selenium_generator.script_pipeline(request_data)
                     print(f"Cypress generator result: {result['status']}")
                     return result
+                except (RateLimitExceeded, CircuitOpen, Cancelled):
+                    raise
                 except Exception as e:
                     print(f"Error in cypress generator: {str(e)}")
                     import traceback
@@ -148,9 +331,11 @@ class AgentRouter:
                     # Assuming we have a behave generator agent
                     # For now, we'll use the selenium generator with a note
                     request_data['note'] = 'Using Selenium format as a base for Behave'
-                    result = self.selenium_generator.generate_selenium_script(request_data)
+                    result = yield from self.selenium_generator.script_pipeline(request_data)
                     print(f"Behave generator result: {result['status']}")
                     return result
+                except (RateLimitExceeded, CircuitOpen, Cancelled):
+                    raise
                 except Exception as e:
                     print(f"Error in behave generator: {str(e)}")
                     import traceback
@@ -160,9 +345,11 @@ class AgentRouter:
             elif agent_type == 'chat':
                 print("Routing to chat agent")
                 try:
-                    result = self.chat_agent.generate_response(request_data)
+                    result = yield from self.chat_agent.response_pipeline(request_data)
                     print(f"Chat agent result: {result['status']}")
                     return result
+                except (RateLimitExceeded, CircuitOpen, Cancelled):
+                    raise
                 except Exception as e:
                     print(f"Error in chat agent: {str(e)}")
                     import traceback
@@ -188,7 +375,7 @@ class AgentRouter:
                         }
                     
                     # Call the new method with just the user story string
-                    result = self.manual_testcase_generator.generate_from_user_story(user_story)
+                    result = yield from self.manual_testcase_generator.user_story_pipeline(user_story)
                     
                     # Format the response to match the expected format by frontend
                     if 'status' in result and result['status'] == 'success':
@@ -207,6 +394,8 @@ class AgentRouter:
                     
                     print(f"Manual test case generator result: {result['status']}")
                     return result
+                except (RateLimitExceeded, CircuitOpen, Cancelled):
+                    raise
                 except Exception as e:
                     print(f"Error in manual test case generator: {str(e)}")
                     import traceback
@@ -235,7 +424,7 @@ class AgentRouter:
                     user_story = "Test Plan: " + user_story
                     
                     # Call the new method with just the user story string
-                    result = self.manual_testcase_generator.generate_from_user_story(user_story)
+                    result = yield from self.manual_testcase_generator.user_story_pipeline(user_story)
                     
                     # Format the response to match the expected format by frontend
                     if 'status' in result and result['status'] == 'success':
@@ -254,6 +443,8 @@ class AgentRouter:
                     
                     print(f"Manual test planning result: {result['status']}")
                     return result
+                except (RateLimitExceeded, CircuitOpen, Cancelled):
+                    raise
                 except Exception as e:
                     print(f"Error in manual test planning: {str(e)}")
                     import traceback
@@ -266,10 +457,95 @@ class AgentRouter:
                     'message': f'Unknown agent type: {agent_type}. Supported types: gherkin, selenium, playwright, cypress, behave, chat, manual_testcases, manual_planning'
                 }
 
+        except (RateLimitExceeded, CircuitOpen, Cancelled):
+
+            raise
+
         except Exception as e:
             print(f"Error in router: {str(e)}")
             return {'status': 'error', 'message': f'Internal error: {str(e)}'}
             
+    def stream_request(self, request_data: dict, cancel_token: Optional[CancellationToken] = None):
+        """
+        Route a request to an agent that streams its output
+        
+        Supported agent types are gherkin and the Selenium-based script generators.
+        
+        Args:
+            request_data: Generation request
+            cancel_token: Token that stops the stream at the next event once cancelled,
+                          e.g. when the client disconnected (defaults to the token of the request scope)
+        
+        Yields:
+            (event, data) tuples produced by the agent
+        """
+        if not isinstance(request_data, dict):
+            yield 'error', {'message': 'Invalid request format'}
+            return
+        
+        cancel_token = cancel_token or current_token()
+        degraded_models = {}
+        with request_scope(bypass_cache=bool(request_data.get('bypassCache', False)),
+                           structured_output=request_data.get('structuredOutput'),
+                           degraded_models=degraded_models,
+                           cancel_token=cancel_token):
+            events = self._stream_in_scope(request_data)
+            try:
+                for event, data in events:
+                    if cancel_token is not None and cancel_token.cancelled:
+                        # Closing the agent's generator closes its model stream
+                        print(f"Stopping abandoned stream: {cancel_token.reason}")
+                        metrics.increment('cancelled_streams')
+                        return
+                    if event == 'done':
+                        data = mark_degraded_result(data, degraded_models)
+                    yield event, data
+            except Cancelled as e:
+                yield 'error', {'message': str(e), 'cancelled': True}
+            finally:
+                events.close()
+    
+    def _stream_in_scope(self, request_data: dict):
+        """Stream the request from its agent inside the request scope set by stream_request"""
+        agent_type = (request_data.get('agentType') or '').lower()
+        input_text = request_data.get('requirement', '') or request_data.get('text', '')
+        if not input_text:
+            yield 'error', {'message': 'No requirement or text provided'}
+            return
+        
+        if not self.is_valid_request(input_text):
+            yield 'error', {'message': 'Please provide a meaningful request related to testing. Your input appears to be random text or too short.'}
+            return
+        
+        if agent_type == 'test_generator' or agent_type == 'gherkin':
+            print("Streaming from test generator agent")
+            yield from self.test_generator.stream_gherkin(request_data)
+        
+        elif agent_type in ('selenium_generator', 'selenium', 'playwright', 'cypress', 'behave'):
+            print(f"Streaming from selenium generator agent ({agent_type})")
+            language = (request_data.get('language') or 'python').lower()
+            if language == 'java':
+                yield 'error', {'message': 'Java Selenium Script Generator is currently under development. Please use Python for Selenium scripts for now.'}
+                return
+            
+            if agent_type in ('playwright', 'cypress', 'behave'):
+                request_data['note'] = f'Using Selenium format as a base for {agent_type.capitalize()}'
+            yield from self.selenium_generator.stream_selenium_script(request_data)
+        
+        elif agent_type in ('manual_testcases', 'manual_planning'):
+            print(f"Streaming from manual test case generator agent ({agent_type})")
+            user_story = input_text if agent_type == 'manual_testcases' else "Test Plan: " + input_text
+            for event, data in self.manual_testcase_generator.stream_test_cases(user_story):
+                if event == 'done':
+                    # Same response shape as route_request
+                    data['content'] = self._format_test_cases_for_display(data['test_cases'])
+                    data['message'] = 'Manual test cases generated successfully' if agent_type == 'manual_testcases' else 'Test plan generated successfully'
+                    data['feature_file'] = data['file_path']
+                yield event, data
+        
+        else:
+            yield 'error', {'message': f'Streaming is not supported for agent type: {agent_type}. Supported types: gherkin, selenium, playwright, cypress, behave, manual_testcases, manual_planning'}
+        
     def _format_test_cases_for_display(self, test_cases):
         """Format test cases for display in the frontend"""
         if not test_cases:
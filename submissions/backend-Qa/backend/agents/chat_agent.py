@@ -1,22 +1,14 @@
 import os
-import openai
 from dotenv import load_dotenv
+from utils.model_calls import ModelCall, arun_pipeline, run_pipeline
+from utils.model_provider import create_agent
 
 # Load environment variables
 load_dotenv()
 
 class ChatAgent:
     def __init__(self):
-        # Get API key from environment
-        self.api_key = os.getenv("OPENAI_API_KEY")
-        if not self.api_key:
-            print("Warning: OPENAI_API_KEY not found in environment variables")
-            self.api_key = "dummy_key"  # Placeholder for testing
-            
-        # Set the API key for OpenAI
-        openai.api_key = self.api_key
-        
-        # Default model to use
+        # Default model to use; the OpenAI API key is read by the model provider
         self.model = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
         
     def generate_response(self, request_data):
@@ -31,6 +23,14 @@ class ChatAgent:
         Returns:
             dict: Response containing status, content, and message
         """
+        return run_pipeline(self.response_pipeline(request_data))
+
+    async def agenerate_response(self, request_data):
+        """Async counterpart of generate_response, using the async OpenAI client"""
+        return await arun_pipeline(self.response_pipeline(request_data))
+
+    def response_pipeline(self, request_data):
+        """Pipeline of generate_response (see utils.model_calls)"""
         try:
             # Extract data from request
             user_message = request_data.get('requirement', '')
@@ -47,18 +47,18 @@ class ChatAgent:
             
             # Call OpenAI API
             try:
-                response = openai.ChatCompletion.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_message},
-                        {"role": "user", "content": user_message}
-                    ],
+                # The system message depends on the request, so the (lightweight) agent is built per call
+                agent = create_agent(
+                    model_id=self.model,
+                    instructions=system_message,
+                    provider='openai',
                     max_tokens=500,
                     temperature=0.7
                 )
+                response = yield ModelCall(agent, user_message)
                 
                 # Extract response content
-                response_content = response.choices[0].message.content.strip()
+                response_content = response.content.strip()
                 
                 return {
                     'status': 'success',
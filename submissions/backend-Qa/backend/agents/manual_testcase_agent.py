@@ -1,13 +1,21 @@
 import os
 import re
 import csv
+import json
 import random
 import string
 import time
-import pandas as pd
-from agno.agent import Agent
-from agno.models.groq import Groq
 from dotenv import load_dotenv
+from utils.model_provider import create_agent
+from utils.cancellation import Cancelled, checkpoint
+from utils.metrics import metrics
+from utils.model_calls import ModelCall, arun_pipeline, run_events, run_pipeline
+from utils.quality_gate import quality_gate, score_test_cases
+from utils.rate_limiter import RateLimitExceeded
+from utils.request_context import get_request_option
+from utils.test_case_parser import TEST_CASE_FIELDS, TestCaseStreamParser, parse_test_cases
+from utils.test_case_schema import TEST_CASES_JSON_SCHEMA, coerce_test_case, validate_test_cases
+from utils.token_counter import get_token_counter
 
 load_dotenv()
 
@@ -15,15 +23,13 @@ class ManualTestCaseGenerator:
     def __init__(self):
         """Initialize the Manual Test Case Generator with automatic settings"""
         # Optimized model configuration for better performance
-        self.agent = Agent(
-            model=Groq(
-                id="deepseek-r1-distill-llama-70b",  # Keep the same model for output consistency
-                temperature=0.7,
-                max_tokens=2048,  # Increased max tokens to accommodate larger responses
-                top_p=0.9,
-                presence_penalty=0.1,
-                frequency_penalty=0.1
-            ),
+        self.agent = create_agent(
+            model_id="deepseek-r1-distill-llama-70b",  # Keep the same model for output consistency
+            temperature=0.7,
+            max_tokens=2048,  # Increased max tokens to accommodate larger responses
+            top_p=0.9,
+            presence_penalty=0.1,
+            frequency_penalty=0.1,
             instructions="""You are a QA expert specializing in manual test case creation. Generate comprehensive manual test cases from user stories.
             Rules:
             1. Create detailed test cases with clear steps
@@ -34,9 +40,32 @@ class ManualTestCaseGenerator:
             markdown=False
         )
         
+        # Same model in JSON mode for structured output; the schema is sent with the prompt
+        self.json_agent = create_agent(
+            model_id="deepseek-r1-distill-llama-70b",
+            temperature=0.7,
+            max_tokens=2048,
+            top_p=0.9,
+            presence_penalty=0.1,
+            frequency_penalty=0.1,
+            response_format={"type": "json_object"},
+            instructions="""You are a QA expert specializing in manual test case creation. Generate comprehensive manual test cases from user stories.
+            Rules:
+            1. Create detailed test cases with clear steps
+            2. Include positive, negative, and edge cases
+            3. Every test data set holds concrete values that can be typed in as they are
+            4. Respond with a single JSON object matching the given schema, nothing else""",
+            markdown=False
+        )
+        
         # Default timeout for API calls (in seconds)
         self.default_timeout = 60
         
+        # Structured output mode: JSON validated per test case instead of free text
+        self.structured_output = os.getenv('MANUAL_TESTCASE_STRUCTURED_OUTPUT', 'false').lower() in ('1', 'true', 'yes')
+        # Follow-up requests for the test cases that fail validation
+        self.repair_rounds = int(os.getenv('MANUAL_TESTCASE_REPAIR_ROUNDS', 2))
+        
         # Create base directories
         self.base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.test_cases_dir = os.path.join(self.base_dir, 'test_cases')
@@ -57,6 +86,10 @@ class ManualTestCaseGenerator:
             - file_path: Full path to the generated CSV file
             - count: Number of test cases generated
         """
+        return run_pipeline(self.user_story_pipeline(user_story))
+
+    def user_story_pipeline(self, user_story: str):
+        """Pipeline of _generate_from_user_story (see utils.model_calls)"""
         try:
             # Validate input
             if not user_story or not isinstance(user_story, str):
@@ -66,26 +99,49 @@ class ManualTestCaseGenerator:
             iterations = self._determine_iterations(user_story)
             feature_name = self._generate_feature_name(user_story)
             
+            if self._use_structured_output():
+                print("Generating test cases for user story (structured output)...")
+                test_cases, structured_stats = yield from self._run_structured(user_story)
+                return self._build_result(test_cases, feature_name, structured_stats=structured_stats)
+            
             print(f"Generating test cases for user story (iterations: {iterations})...")
             
             # Generate test cases
-            test_cases = self._generate_test_cases(user_story, iterations)
+            test_cases, parse_stats, quality = yield from self._generate_test_cases(user_story, iterations)
             
-            # Create output file
-            output_file = os.path.join(self.test_cases_dir, f"{feature_name}.csv")
-            saved_file = self._save_to_csv(test_cases, output_file)
-            
-            return {
-                'status': 'success',
-                'test_cases': test_cases,
-                'filename': os.path.basename(saved_file),
-                'file_path': saved_file,
-                'count': len(test_cases)
-            }
+            return self._build_result(test_cases, feature_name, parse_stats, quality=quality)
             
+        except (RateLimitExceeded, Cancelled):
+            raise
         except Exception as e:
             return self._error_response(f"Error generating test cases: {str(e)}")
 
+    def _build_result(self, test_cases: list, feature_name: str, parse_stats: dict = None,
+                      structured_stats: dict = None, quality: dict = None) -> dict:
+        """Save the test cases to CSV and build the success response"""
+        # Nobody downloads the CSV of an abandoned request
+        checkpoint()
+        output_file = os.path.join(self.test_cases_dir, f"{feature_name}.csv")
+        saved_file = self._save_to_csv(test_cases, output_file)
+        
+        result = {
+            'status': 'success',
+            'test_cases': test_cases,
+            'filename': os.path.basename(saved_file),
+            'file_path': saved_file,
+            'count': len(test_cases)
+        }
+        token_debug = {}
+        if parse_stats is not None:
+            token_debug['parse_stats'] = parse_stats
+        if structured_stats is not None:
+            token_debug['structured_output'] = structured_stats
+        if quality is not None:
+            token_debug['quality'] = quality
+        if token_debug:
+            result['token_debug'] = token_debug
+        return result
+
     def generate_from_user_story(self, user_story: str) -> dict:
         """
         Generate manual test cases from a user story with automatic settings
@@ -98,7 +154,258 @@ class ManualTestCaseGenerator:
             Dictionary containing test case generation results
         """
         return self._generate_from_user_story(user_story)
+
+    async def agenerate_from_user_story(self, user_story: str) -> dict:
+        """Async counterpart of generate_from_user_story: model calls wait on the event loop"""
+        return await arun_pipeline(self.user_story_pipeline(user_story))
+        
+    def _stream_stage(self, stage: str, prompt: str):
+        """
+        Stream one model call, emitting each test case as soon as it is complete
         
+        Yields:
+            ('test_case', data) events
+            
+        Returns:
+            Tuple of (raw content, parsed test cases, parse recovery stats)
+        """
+        parser = TestCaseStreamParser()
+        parts = []
+        test_cases = []
+        for delta in self.agent.stream(prompt):
+            parts.append(delta)
+            for test_case in parser.feed(delta):
+                test_cases.append(test_case)
+                yield 'test_case', {'stage': stage, 'test_case': test_case}
+        for test_case in parser.close():
+            test_cases.append(test_case)
+            yield 'test_case', {'stage': stage, 'test_case': test_case}
+        return ''.join(parts).strip(), test_cases, dict(parser.stats)
+
+    def stream_test_cases(self, user_story: str):
+        """
+        Generate manual test cases while streaming each case as soon as it is parsed
+        
+        Runs the same steps as generate_from_user_story. When an improvement
+        pass runs, its cases replace those of the draft.
+        
+        Yields:
+            (event, data) tuples: 'start', 'stage' (stage boundaries), 'test_case'
+            (one parsed test case), then 'done' with the final result or 'error'
+        """
+        if not user_story or not isinstance(user_story, str):
+            yield 'error', {'message': 'Invalid user story provided'}
+            return
+        
+        iterations = self._determine_iterations(user_story)
+        feature_name = self._generate_feature_name(user_story)
+        if self._use_structured_output():
+            stages = ['generate'] + ['repair'] * self.repair_rounds
+            yield 'start', {'agent': 'manual_testcases', 'stages': stages, 'filename': f"{feature_name}.csv",
+                            'structured_output': True}
+            try:
+                test_cases, structured_stats = yield from run_events(self._run_structured(user_story))
+                yield 'done', self._build_result(test_cases, feature_name, structured_stats=structured_stats)
+            except Cancelled:
+                raise
+            except Exception as e:
+                print(f"Error streaming test cases: {str(e)}")
+                yield 'error', {'message': f"Error generating test cases: {str(e)}"}
+            return
+        
+        stages = ['generate'] + ['improve'] * (iterations - 1)
+        yield 'start', {'agent': 'manual_testcases', 'stages': stages, 'filename': f"{feature_name}.csv"}
+        
+        try:
+            yield 'stage', {'stage': 'generate', 'status': 'started'}
+            start_time = time.perf_counter()
+            content, test_cases, parse_stats = yield from self._stream_stage(
+                'generate', self._build_initial_prompt(user_story))
+            yield 'stage', {'stage': 'generate', 'status': 'completed', 'count': len(test_cases),
+                            'seconds': round(time.perf_counter() - start_time, 3)}
+            
+            quality = None
+            for _ in range(iterations - 1):
+                if not content:
+                    break
+                quality = quality_gate(score_test_cases(test_cases))
+                if quality['decision'] == 'skip_improve':
+                    yield 'stage', {'stage': 'improve', 'status': 'skipped', 'quality': quality}
+                    break
+                yield 'stage', {'stage': 'improve', 'status': 'started', 'replaces_previous': True}
+                start_time = time.perf_counter()
+                try:
+                    improved, improved_cases, improved_stats = yield from self._stream_stage(
+                        'improve', self._build_improve_prompt(content))
+                except Cancelled:
+                    raise
+                except Exception as e:
+                    print(f"Error during test case improvement: {str(e)}")
+                    yield 'stage', {'stage': 'improve', 'status': 'failed', 'message': str(e)}
+                    break
+                
+                # Same fallback as _improve_test_cases: keep the draft if the improvement looks broken
+                if not improved_cases or len(improved) < len(content) * 0.5:
+                    yield 'stage', {'stage': 'improve', 'status': 'discarded',
+                                    'message': 'Improvement returned suspiciously short content, keeping the draft'}
+                    break
+                content, test_cases, parse_stats = improved, improved_cases, improved_stats
+                yield 'stage', {'stage': 'improve', 'status': 'completed', 'count': len(test_cases),
+                                'seconds': round(time.perf_counter() - start_time, 3)}
+            
+            self._record_parse_stats(parse_stats)
+            yield 'done', self._build_result(test_cases or self._default_test_case(), feature_name, parse_stats,
+                                             quality=quality)
+        
+        except Cancelled:
+            # Abandoned: the router reports the cancellation
+            raise
+        except Exception as e:
+            print(f"Error streaming test cases: {str(e)}")
+            yield 'error', {'message': f"Error generating test cases: {str(e)}"}
+
+    def _use_structured_output(self) -> bool:
+        """Whether this request uses structured output; the request option overrides the environment"""
+        option = get_request_option('structured_output')
+        return self.structured_output if option is None else bool(option)
+
+    def _run_structured(self, user_story: str):
+        """
+        Generate test cases as JSON, re-requesting only the cases that fail validation
+        
+        Each case is validated against the CSV schema on its own. Invalid cases
+        are sent back with their validation errors, up to repair_rounds times;
+        cases that are still invalid afterwards are kept with placeholders. This
+        replaces the improvement passes, which re-sent and re-generated every case.
+        
+        Args:
+            user_story: The user story to generate test cases from
+            
+        Yields:
+            'stage' (generate / repair boundaries) and 'test_case' (one validated case)
+            events, and the ModelCall of each request (see utils.model_calls)
+            
+        Returns:
+            Tuple of (test cases in the order the model wrote them, structured output stats)
+        """
+        counter = get_token_counter()
+        stats = {'mode': 'json', 'cases': 0, 'invalid_cases': 0, 'repair_requests': 0,
+                 'repaired_cases': 0, 'unrepaired_cases': 0, 'output_tokens': 0}
+        
+        yield 'stage', {'stage': 'generate', 'status': 'started'}
+        start_time = time.perf_counter()
+        response = yield ModelCall(self.json_agent, self._build_structured_prompt(user_story), timeout=self.default_timeout)
+        content = response.content.strip() if response and response.content else ""
+        stats['output_tokens'] += counter.count(content)
+        result = validate_test_cases(content)
+        
+        if result.error:
+            # No JSON at all: read whatever test cases were written as text instead of asking again
+            print(f"Structured output could not be read ({result.error}), parsing it as text")
+            test_cases, parse_stats = parse_test_cases(content)
+            self._record_parse_stats(parse_stats)
+            stats.update({'json_error': result.error, 'parse_stats': parse_stats})
+            for test_case in test_cases:
+                yield 'test_case', {'stage': 'generate', 'test_case': test_case}
+            yield 'stage', {'stage': 'generate', 'status': 'completed', 'count': len(test_cases),
+                            'seconds': round(time.perf_counter() - start_time, 3)}
+            stats['cases'] = len(test_cases)
+            self._record_structured_stats(stats)
+            return test_cases or self._default_test_case(), stats
+        
+        rows = dict(result.valid)
+        for index in sorted(rows):
+            yield 'test_case', {'stage': 'generate', 'test_case': rows[index]}
+        invalid = result.invalid
+        stats['invalid_cases'] = len(invalid)
+        yield 'stage', {'stage': 'generate', 'status': 'completed', 'count': len(rows), 'invalid': len(invalid),
+                        'seconds': round(time.perf_counter() - start_time, 3)}
+        
+        for _ in range(self.repair_rounds):
+            if not invalid:
+                break
+            yield 'stage', {'stage': 'repair', 'status': 'started', 'cases': len(invalid)}
+            start_time = time.perf_counter()
+            try:
+                response = yield ModelCall(self.json_agent, self._build_repair_prompt(invalid), timeout=self.default_timeout)
+            except Exception as e:
+                print(f"Error during test case repair: {str(e)}")
+                yield 'stage', {'stage': 'repair', 'status': 'failed', 'message': str(e)}
+                break
+            stats['repair_requests'] += 1
+            content = response.content.strip() if response and response.content else ""
+            stats['output_tokens'] += counter.count(content)
+            repaired = validate_test_cases(content)
+            
+            # Repaired cases come back in the order they were sent
+            retried = {case.index: case for case in repaired.invalid}
+            remaining = []
+            for position, case in enumerate(invalid):
+                if position in repaired.valid:
+                    rows[case.index] = repaired.valid[position]
+                    stats['repaired_cases'] += 1
+                    yield 'test_case', {'stage': 'repair', 'test_case': rows[case.index]}
+                elif position in retried:
+                    case.data, case.errors = retried[position].data, retried[position].errors
+                    remaining.append(case)
+                else:
+                    remaining.append(case)
+            yield 'stage', {'stage': 'repair', 'status': 'completed', 'count': len(invalid) - len(remaining),
+                            'invalid': len(remaining), 'seconds': round(time.perf_counter() - start_time, 3)}
+            invalid = remaining
+        
+        for case in invalid:
+            print(f"Test case {case.index + 1} still invalid: {'; '.join(case.errors)}")
+            rows[case.index] = coerce_test_case(case.data, case.index + 1)
+            yield 'test_case', {'stage': 'repair', 'test_case': rows[case.index]}
+        stats['unrepaired_cases'] = len(invalid)
+        
+        test_cases = [rows[index] for index in sorted(rows)]
+        stats['cases'] = len(test_cases)
+        self._record_structured_stats(stats)
+        print(f"Successfully generated {len(test_cases)} test cases ({stats['repaired_cases']} repaired)")
+        return test_cases or self._default_test_case(), stats
+
+    def _build_structured_prompt(self, user_story: str) -> str:
+        """Build the prompt asking for all test cases as one JSON object"""
+        return f"""Convert this user story into detailed manual test cases with CONCRETE, SPECIFIC test data values:
+
+{user_story}
+
+Respond with ONLY a JSON object matching this JSON schema:
+{json.dumps(TEST_CASES_JSON_SCHEMA, separators=(',', ':'))}
+
+For each test case:
+- "Test Case ID" is TC_[number]
+- "Test Steps" lists the numbered steps
+- "Test Data Set 1" to "Test Data Set 5" are 5 DIFFERENT data sets: typical, edge case, invalid,
+  special characters and empty/null values
+- "Expected Result" gives the expected result for each data set
+
+Every test data set must contain ACTUAL VALUES that can be used in testing directly,
+e.g. "Username: admin@example.com, Password: Admin123!" or "Age: 17 (below minimum allowed)",
+never descriptions like "Valid credentials", "Invalid data" or "Special characters"."""
+
+    def _build_repair_prompt(self, invalid: list) -> str:
+        """Build the prompt re-requesting the test cases that failed validation"""
+        problems = '\n'.join(
+            f"- Test case {position}: {'; '.join(case.errors)}"
+            for position, case in enumerate(invalid, 1)
+        )
+        cases = json.dumps([case.data for case in invalid], ensure_ascii=False)
+        return f"""These manual test cases failed validation:
+<test_cases>
+{cases}
+</test_cases>
+
+Problems:
+{problems}
+
+Fix the problems and return ONLY a JSON object {{"test_cases": [...]}} with the {len(invalid)} corrected
+test cases in the same order, keeping their Test Case IDs. Every test data set must contain ACTUAL VALUES.
+The test cases must match this JSON schema:
+{json.dumps(TEST_CASES_JSON_SCHEMA, separators=(',', ':'))}"""
+
     def _determine_iterations(self, user_story: str) -> int:
         """
         Automatically determine number of improvement iterations based on user story complexity
@@ -132,19 +439,8 @@ class ManualTestCaseGenerator:
         name = re.sub(r'[^\w\-]', '_', name)
         return name[:50]
 
-    def _generate_test_cases(self, user_story: str, iterations: int) -> list:
-        """
-        Generate and iteratively improve test cases with timeout handling
-        
-        Args:
-            user_story: The user story to generate from
-            iterations: Number of improvement iterations
-            
-        Returns:
-            List of parsed test cases
-        """
-        print(f"Starting test case generation for user story...")
-        
+    def _build_initial_prompt(self, user_story: str) -> str:
+        """Build the prompt generating the first draft of the test cases"""
         # Enhanced initial prompt with more specific requirements
         initial_prompt = f"""Convert this user story into detailed manual test cases with CONCRETE, SPECIFIC test data values:
 
@@ -190,27 +486,56 @@ Test Data Set 3: [CONCRETE INVALID VALUES - e.g., "Username: <script>, Password:
 Test Data Set 4: [CONCRETE SPECIAL CHARACTER VALUES - e.g., "Username: jöhn.dœ@例.com, Password: P@$$wörd"]
 Test Data Set 5: [CONCRETE EMPTY/NULL VALUES - e.g., "Username: (empty), Password: (empty)"]
 Expected Result: [detailed expected result for each data set]"""
+        return initial_prompt
 
+    def _generate_test_cases(self, user_story: str, iterations: int):
+        """
+        Generate and iteratively improve test cases with timeout handling
+        
+        Args:
+            user_story: The user story to generate from
+            iterations: Number of improvement iterations
+            
+        Yields:
+            The ModelCall of each request (see utils.model_calls)
+            
+        Returns:
+            Tuple of (list of parsed test cases, parse recovery stats or None,
+            quality gate result of the last draft checked or None)
+        """
+        print(f"Starting test case generation for user story...")
+        initial_prompt = self._build_initial_prompt(user_story)
+        
         # Initial generation with timeout handling
         try:
             print("Generating initial test cases...")
-            response = self.agent.run(initial_prompt, timeout=self.default_timeout)
+            response = yield ModelCall(self.agent, initial_prompt, timeout=self.default_timeout)
             content = response.content.strip() if response and response.content else ""
             
             if not content:
                 print("Initial generation failed or returned empty content")
-                return self._default_test_case()
+                return self._default_test_case(), None, None
                 
             print(f"Initial test cases generated successfully")
+        except (RateLimitExceeded, Cancelled):
+            # Rejected for lack of rate limit budget or abandoned: no default test case
+            raise
         except Exception as e:
             print(f"Error during initial test case generation: {str(e)}")
-            return self._default_test_case()
+            return self._default_test_case(), None, None
         
-        # Enhanced iterative improvement with timeout handling
+        # Enhanced iterative improvement with timeout handling; iterations is an
+        # upper bound, a draft meeting the quality thresholds is not improved further
+        quality = None
         for i in range(iterations - 1):
+            draft_cases, _ = parse_test_cases(content)
+            quality = quality_gate(score_test_cases(draft_cases))
+            if quality['decision'] == 'skip_improve':
+                print(f"Draft quality score {quality['score']} meets the thresholds, skipping improvement")
+                break
             try:
                 print(f"Starting improvement iteration {i+1}...")
-                content = self._improve_test_cases(content)
+                content = yield from self._improve_test_cases(content)
                 print(f"Improvement iteration {i+1} completed")
             except Exception as e:
                 print(f"Error during improvement iteration {i+1}: {str(e)}")
@@ -219,26 +544,18 @@ Expected Result: [detailed expected result for each data set]"""
         
         # Parse and return
         print("Parsing final test cases...")
-        parsed_cases = self._parse_test_cases(content)
+        parsed_cases, parse_stats = parse_test_cases(content)
+        self._record_parse_stats(parse_stats)
         
         if not parsed_cases:
             print("Parsing failed, returning default test case")
-            return self._default_test_case()
+            return self._default_test_case(), parse_stats, quality
             
         print(f"Successfully generated {len(parsed_cases)} test cases")
-        return parsed_cases
+        return parsed_cases, parse_stats, quality
 
-    def _improve_test_cases(self, content: str) -> str:
-        """
-        Improve existing test cases with focus on concrete test data
-        Includes timeout handling and fallback mechanism
-        
-        Args:
-            content: Current test cases content
-            
-        Returns:
-            Improved test cases content
-        """
+    def _build_improve_prompt(self, content: str) -> str:
+        """Build the prompt asking the model to improve a draft of the test cases"""
         # Simplified prompt to reduce processing time while maintaining quality
         prompt = f"""Review and improve these test cases with STRICT FOCUS on making test data CONCRETE and SPECIFIC:
 {content}
@@ -259,10 +576,27 @@ BAD: "Special characters"
 GOOD: "Search term: 'café@123_テスト' (mixed special chars)"
 
 Output ONLY the improved test cases in the same format, with ALL test data sets containing CONCRETE VALUES."""
+        return prompt
+
+    def _improve_test_cases(self, content: str):
+        """
+        Improve existing test cases with focus on concrete test data
+        Includes timeout handling and fallback mechanism
+        
+        Args:
+            content: Current test cases content
+            
+        Yields:
+            The ModelCall of the request (see utils.model_calls)
+            
+        Returns:
+            Improved test cases content
+        """
+        prompt = self._build_improve_prompt(content)
 
         try:
             # Add timeout to prevent indefinite waiting
-            response = self.agent.run(prompt, timeout=self.default_timeout)
+            response = yield ModelCall(self.agent, prompt, timeout=self.default_timeout)
             improved_content = response.content.strip() if response and response.content else content
             
             # Fallback mechanism: if improved content is empty or much shorter than original,
@@ -279,7 +613,7 @@ Output ONLY the improved test cases in the same format, with ALL test data sets
 
     def _parse_test_cases(self, content: str) -> list:
         """
-        Parse generated text into structured test cases with strict validation
+        Parse generated text into structured test cases
         
         Args:
             content: Generated test cases text
@@ -289,77 +623,25 @@ Output ONLY the improved test cases in the same format, with ALL test data sets
         """
         if not content:
             return []
-            
-        test_case_blocks = re.split(r'\n\s*\n', content.strip())
-        parsed_cases = []
-        
-        for block in test_case_blocks:
-            case = {
-                'Test Case ID': '',
-                'Description': '',
-                'Test Steps': '',
-                'Test Data Set 1': '',
-                'Test Data Set 2': '',
-                'Test Data Set 3': '',
-                'Test Data Set 4': '',
-                'Test Data Set 5': '',
-                'Expected Result': ''
-            }
-            
-            current_field = None
-            data_set_count = 0
-            
-            for line in block.split('\n'):
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                # Field detection with strict validation
-                if line.startswith('Test Case ID:'):
-                    case['Test Case ID'] = line[13:].strip()
-                elif line.startswith('Description:'):
-                    case['Description'] = line[12:].strip()
-                elif line.startswith('Test Steps:'):
-                    current_field = 'Test Steps'
-                elif line.startswith('Test Data Set 1:'):
-                    current_field = 'Test Data Set 1'
-                    data_set_count += 1
-                    line = line[16:].strip()  # Remove the prefix
-                elif line.startswith('Test Data Set 2:'):
-                    current_field = 'Test Data Set 2'
-                    data_set_count += 1
-                    line = line[16:].strip()
-                elif line.startswith('Test Data Set 3:'):
-                    current_field = 'Test Data Set 3'
-                    data_set_count += 1
-                    line = line[16:].strip()
-                elif line.startswith('Test Data Set 4:'):
-                    current_field = 'Test Data Set 4'
-                    data_set_count += 1
-                    line = line[16:].strip()
-                elif line.startswith('Test Data Set 5:'):
-                    current_field = 'Test Data Set 5'
-                    data_set_count += 1
-                    line = line[16:].strip()
-                elif line.startswith('Expected Result:'):
-                    current_field = 'Expected Result'
-                elif current_field:
-                    if case[current_field]:
-                        case[current_field] += '\n' + line
-                    else:
-                        case[current_field] = line
-            
-            # Validate that we got concrete test data
-            if data_set_count < 5:
-                for i in range(1, 6):
-                    if f'Test Data Set {i}' not in case or not case[f'Test Data Set {i}']:
-                        case[f'Test Data Set {i}'] = f"Missing concrete test data set {i}"
-            
-            if case['Test Case ID']:
-                parsed_cases.append(case)
-            
+        
+        parsed_cases, _ = parse_test_cases(content)
         return parsed_cases or self._default_test_case()
     
+    def _record_parse_stats(self, parse_stats: dict) -> None:
+        """Add the recovery counts of one parse to the service metrics"""
+        for name, value in parse_stats.items():
+            if value:
+                metrics.increment(f'manual_parse_{name}', value)
+    
+    def _record_structured_stats(self, stats: dict) -> None:
+        """Add the validation and repair counts of one structured generation to the service metrics"""
+        metrics.increment('manual_structured_generations')
+        for name in ('invalid_cases', 'repair_requests', 'repaired_cases', 'unrepaired_cases', 'output_tokens'):
+            if stats.get(name):
+                metrics.increment(f'manual_structured_{name}', stats[name])
+        if 'json_error' in stats:
+            metrics.increment('manual_structured_json_errors')
+    
     def _default_test_case(self) -> list:
         """Return a default test case when generation fails"""
         print("Returning default test case due to generation failure")
@@ -397,14 +679,8 @@ Output ONLY the improved test cases in the same format, with ALL test data sets
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
         
         # Write CSV
-        fieldnames = [
-            'Test Case ID', 'Description', 'Test Steps',
-            'Test Data Set 1', 'Test Data Set 2', 'Test Data Set 3',
-            'Test Data Set 4', 'Test Data Set 5', 'Expected Result'
-        ]
-        
         with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer = csv.DictWriter(csvfile, fieldnames=TEST_CASE_FIELDS)
             writer.writeheader()
             writer.writerows(test_cases)
             
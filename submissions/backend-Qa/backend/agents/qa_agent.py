@@ -1,21 +1,18 @@
 import os
 import re
-from agno.agent import Agent
-from agno.models.groq import Groq
 from dotenv import load_dotenv
+from utils.model_provider import create_agent
 
 load_dotenv()
 
 class QAAgent:
     def __init__(self):
         try:
-            self.agent = Agent(
-                model=Groq(
-                    id="mixtral-8x7b-32768",  # Using the same model as before
-                    temperature=0.7,
-                    max_tokens=4000,
-                    top_p=0.95
-                ),
+            self.agent = create_agent(
+                model_id="mixtral-8x7b-32768",  # Using the same model as before
+                temperature=0.7,
+                max_tokens=4000,
+                top_p=0.95,
                 instructions="""You are a QA automation expert. Generate Selenium test scripts.
                 Follow these rules:
                 1. Use Python with Selenium WebDriver
@@ -2,24 +2,111 @@ import os
 import re
 import time
 import traceback
-from agno.agent import Agent
-from agno.models.groq import Groq
 from dotenv import load_dotenv
+from utils.cancellation import Cancelled, checkpoint
+from utils.model_calls import ModelCall, arun_pipeline, run_pipeline
+from utils.model_provider import create_agent
+from utils.rate_limiter import RateLimitExceeded
+from utils.gherkin_parser import format_feature, parse_gherkin
 
 load_dotenv()
 
+DEFAULT_IMPORTS = """from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+import pytest
+
+"""
+
+
+class ScriptStreamCleaner:
+    """
+    Incremental counterpart of the script clean-up in generate_selenium_script.
+    
+    Streamed text is split into lines. If the model wraps the script in a
+    ```python block only the block is kept; otherwise every line is kept with
+    code fences removed. Default imports are emitted first when the script does
+    not start with an import.
+    """
+    
+    def __init__(self):
+        self.buffer = ''
+        self.mode = None  # None until decided, then 'fenced', 'plain' or 'done'
+        self.pending = []
+        self.blank_lines = []
+        self.emitted = False
+    
+    def feed(self, text: str) -> list:
+        """Add streamed text and return the script lines completed by it"""
+        self.buffer += text
+        *complete, self.buffer = self.buffer.split('\n')
+        script_lines = []
+        for line in complete:
+            script_lines.extend(self._clean_line(line))
+        return script_lines
+    
+    def flush(self) -> list:
+        """Return the remaining script lines once the stream has ended"""
+        script_lines = self._clean_line(self.buffer) if self.buffer else []
+        self.buffer = ''
+        if self.mode is None:
+            # No ```python block was found, so keep everything
+            self.mode = 'plain'
+            pending, self.pending = self.pending, []
+            for line in pending:
+                script_lines.extend(self._emit(line))
+        self.blank_lines = []
+        return script_lines
+    
+    def _clean_line(self, line: str) -> list:
+        line = line.replace('<think>', '').replace('</think>', '')
+        
+        if self.mode == 'done':
+            return []
+        if self.mode == 'fenced':
+            if line.strip().startswith('```'):
+                self.mode = 'done'
+                return []
+            return self._emit(line)
+        if self.mode == 'plain':
+            return self._emit(line.replace('```', ''))
+        
+        # Undecided: a ```python block wins over anything before it
+        if line.strip().startswith('```python'):
+            self.mode = 'fenced'
+            self.pending = []
+            return []
+        self.pending.append(line.replace('```', ''))
+        return []
+    
+    def _emit(self, line: str) -> list:
+        # The batch clean-up strips the script, so drop leading and hold trailing blank lines
+        if not line.strip():
+            if self.emitted:
+                self.blank_lines.append(line)
+            return []
+        
+        script_lines = []
+        if not self.emitted:
+            self.emitted = True
+            if not line.startswith('import ') and not line.startswith('from '):
+                script_lines.extend(DEFAULT_IMPORTS.rstrip('\n').split('\n') + [''])
+        script_lines.extend(self.blank_lines + [line])
+        self.blank_lines = []
+        return script_lines
+
+
 class SeleniumGeneratorAgent:
     def __init__(self):
         try:
-            self.agent = Agent(
-                model=Groq(
-                    id="llama-3.3-70b-versatile",
-                    temperature=0.7,
-                    max_tokens=1024,
-                    top_p=0.9,
-                    presence_penalty=0.1,
-                    frequency_penalty=0.1
-                ),
+            self.agent = create_agent(
+                model_id="llama-3.3-70b-versatile",
+                temperature=0.7,
+                max_tokens=1024,
+                top_p=0.9,
+                presence_penalty=0.1,
+                frequency_penalty=0.1,
                 instructions="""Generate a complete Selenium test script based on Gherkin scenarios. Follow these guidelines:
                 1. Include proper imports (selenium webdriver, pytest, etc.)
                 2. Use explicit waits with WebDriverWait
@@ -33,7 +120,48 @@ class SeleniumGeneratorAgent:
             print(f"Error initializing agent: {str(e)}")
             self.agent = None
 
+    def _normalize_scenarios(self, prompt: str) -> str:
+        """Return a feature file given as input in canonical form; other input is returned unchanged"""
+        feature = parse_gherkin(prompt)
+        if not feature.keyword and not any(scenario.keyword for scenario in feature.scenarios()):
+            return prompt
+        return format_feature(feature)
+
+    def _build_prompt(self, prompt: str) -> str:
+        """Build the script generation prompt for a scenario"""
+        prompt = self._normalize_scenarios(prompt)
+        return f"""Create a Selenium test script for the following scenario: {prompt}
+
+            Requirements:
+            1. Use pytest with Selenium WebDriver
+            2. Include proper imports and fixtures
+            3. Use explicit waits with WebDriverWait
+            4. Include proper By selectors and assertions
+            5. Handle driver setup and cleanup
+            6. Add proper error handling
+            7. Follow Selenium best practices
+            8. Make sure the code is complete and runnable"""
+
+    def _resolve_test_name(self, request_data: dict) -> str:
+        """Return the requested script file name, or a timestamped default"""
+        test_name_value = request_data.get('testName')
+        if test_name_value:
+            test_name = str(test_name_value).strip()
+        else:
+            test_name = f"test_{int(time.time())}"
+        if not test_name.endswith('.py'):
+            test_name += '.py'
+        return test_name
+
     def generate_selenium_script(self, request_data: dict) -> dict:
+        return run_pipeline(self.script_pipeline(request_data))
+
+    async def agenerate_selenium_script(self, request_data: dict) -> dict:
+        """Async counterpart of generate_selenium_script: the model call waits on the event loop"""
+        return await arun_pipeline(self.script_pipeline(request_data))
+
+    def script_pipeline(self, request_data: dict):
+        """Pipeline of generate_selenium_script (see utils.model_calls)"""
         if not self.agent:
             return {'status': 'error', 'message': 'Agent not properly initialized'}
 
@@ -44,15 +172,9 @@ class SeleniumGeneratorAgent:
                 return {'status': 'error', 'message': 'No requirement provided'}
 
             # Get test name or use default, ensuring it's a string before calling strip()
-            test_name_value = request_data.get('testName')
-            if test_name_value:
-                test_name = str(test_name_value).strip()
-            else:
-                test_name = f"test_{int(time.time())}"
-            if not test_name.endswith('.py'):
-                test_name += '.py'
+            test_name = self._resolve_test_name(request_data)
 
-            language = request_data.get('language', 'python').lower()
+            language = (request_data.get('language') or 'python').lower()
             
             # Check if the language is supported
             if language != 'python':
@@ -62,19 +184,9 @@ class SeleniumGeneratorAgent:
                 }
 
             print(f"Generating Selenium script for: {prompt}")
-            generation_prompt = f"""Create a Selenium test script for the following scenario: {prompt}
-
-            Requirements:
-            1. Use pytest with Selenium WebDriver
-            2. Include proper imports and fixtures
-            3. Use explicit waits with WebDriverWait
-            4. Include proper By selectors and assertions
-            5. Handle driver setup and cleanup
-            6. Add proper error handling
-            7. Follow Selenium best practices
-            8. Make sure the code is complete and runnable"""
+            generation_prompt = self._build_prompt(prompt)
 
-            response = self.agent.run(generation_prompt)
+            response = yield ModelCall(self.agent, generation_prompt)
             content = response.content.replace('<think>', '').replace('</think>', '')
             
             # Extract code from markdown if present
@@ -87,15 +199,10 @@ class SeleniumGeneratorAgent:
             
             # Add default imports if missing to ensure it's a valid Python script
             if not content.startswith('import ') and not content.startswith('from '):
-                default_imports = """from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-import pytest
-
-"""
-                content = default_imports + content
+                content = DEFAULT_IMPORTS + content
 
+            # Nobody downloads the script of an abandoned request
+            checkpoint()
             os.makedirs('features', exist_ok=True)
             script_file = os.path.join('features', test_name)
             with open(script_file, 'w') as f:
@@ -110,7 +217,72 @@ import pytest
                 'message': 'Selenium script generated successfully'
             }
 
+        except (RateLimitExceeded, Cancelled):
+            raise
         except Exception as e:
             print(f"Error generating Selenium script: {str(e)}")
             traceback.print_exc()
             return {'status': 'error', 'message': f'Failed to generate Selenium script: {str(e)}'}
+
+    def stream_selenium_script(self, request_data: dict):
+        """
+        Generate a Selenium script while streaming the code as it arrives
+        
+        Yields:
+            (event, data) tuples: 'start', 'stage' (stage boundaries), 'delta'
+            (script lines), then 'done' with the final result or 'error'
+        """
+        if not self.agent:
+            yield 'error', {'message': 'Agent not properly initialized'}
+            return
+        
+        prompt = request_data.get('requirement', '')
+        if not prompt:
+            yield 'error', {'message': 'No requirement provided'}
+            return
+        
+        language = (request_data.get('language') or 'python').lower()
+        if language != 'python':
+            yield 'error', {'message': f'Language "{language}" is not currently supported for Selenium scripts. Only Python is supported at this time.'}
+            return
+        
+        test_name = self._resolve_test_name(request_data)
+        yield 'start', {'agent': 'selenium', 'stages': ['script'], 'filename': test_name}
+        yield 'stage', {'stage': 'script', 'status': 'started'}
+        
+        try:
+            start_time = time.perf_counter()
+            cleaner = ScriptStreamCleaner()
+            script_lines = []
+            for delta in self.agent.stream(self._build_prompt(prompt)):
+                lines = cleaner.feed(delta)
+                if lines:
+                    script_lines.extend(lines)
+                    yield 'delta', {'stage': 'script', 'text': '\n'.join(lines) + '\n'}
+            
+            lines = cleaner.flush()
+            if lines:
+                script_lines.extend(lines)
+                yield 'delta', {'stage': 'script', 'text': '\n'.join(lines) + '\n'}
+            
+            yield 'stage', {'stage': 'script', 'status': 'completed',
+                            'seconds': round(time.perf_counter() - start_time, 3)}
+            
+            content = '\n'.join(script_lines)
+            os.makedirs('features', exist_ok=True)
+            script_file = os.path.join('features', test_name)
+            with open(script_file, 'w') as f:
+                f.write(content)
+            
+            yield 'done', {
+                'status': 'success',
+                'content': content,
+                'feature_file': script_file,
+                'filename': test_name,
+                'message': 'Selenium script generated successfully'
+            }
+        
+        except Exception as e:
+            print(f"Error streaming Selenium script: {str(e)}")
+            traceback.print_exc()
+            yield 'error', {'message': f'Failed to generate Selenium script: {str(e)}'}
@@ -1,29 +1,246 @@
 import os
 import time
-import tiktoken
 import json
-from agno.agent import Agent
-from agno.models.groq import Groq
+import queue
+import threading
+import contextvars
 from dotenv import load_dotenv
+from utils.cancellation import Cancelled, checkpoint, current_token
+from utils.model_calls import CallResult, ConcurrentCalls, ModelCall, arun_pipeline, run_pipeline
+from utils.llm_cache import CachedAgent
+from utils.model_provider import create_agent
+from utils.rate_limiter import RateLimitExceeded
+from utils.token_counter import get_token_counter, load_encoding
+from utils.gherkin_parser import INDENT, classify_line, format_feature, format_table, parse_gherkin, parse_table_row
+from utils.quality_gate import quality_gate, score_gherkin
 
 load_dotenv()
 
+class GherkinLineFormatter:
+    """
+    Re-indent Gherkin output one line at a time, as format_feature does.
+    
+    Keeps the state needed between lines, so it works on lines arriving from a
+    streamed response. Table rows are held back until the table ends so their
+    columns can be aligned; call flush() once the stream has ended.
+    """
+    
+    def __init__(self):
+        self.in_header = True
+        self.in_rule = False
+        self.after_tags = False
+        self.table = []
+        self.doc_string = None
+        self.last_line = None
+    
+    def _block_indent(self) -> str:
+        return INDENT * (2 if self.in_rule else 1)
+    
+    def format_line(self, line: str) -> list:
+        """Return the formatted line(s) for one input line, including separator blank lines"""
+        formatted_lines = []
+        if self.doc_string is not None:
+            delimiter, indent, source_indent = self.doc_string
+            if line.strip().startswith(delimiter):
+                self.doc_string = None
+                formatted_lines.append(indent + delimiter)
+            else:
+                # Keep the content's indentation relative to its opening delimiter
+                content = line[source_indent:] if not line[:source_indent].strip() else line.lstrip()
+                formatted_lines.append((indent + content).rstrip() if content.strip() else '')
+            return self._emit(formatted_lines)
+        
+        token = classify_line(line)
+        if token.kind == 'table_row':
+            self.table.append(parse_table_row(token.text))
+            return []
+        formatted_lines.extend(self.flush())
+        
+        block = self._block_indent()
+        body = block + INDENT
+        if token.kind == 'empty':
+            if self.last_line != '' and not (formatted_lines and formatted_lines[-1] == ''):
+                formatted_lines.append('')
+        elif token.kind == 'feature':
+            formatted_lines.append(f"{token.keyword}: {token.text}".rstrip())
+            self.in_header = True
+        elif token.kind in ('rule', 'background', 'scenario') or token.kind == 'tag':
+            if token.kind == 'rule':
+                self.in_rule = True
+                block = INDENT
+            if not self.after_tags:
+                self._add_separator(formatted_lines)
+            text = token.text if token.kind == 'tag' else f"{token.keyword}: {token.text}".rstrip()
+            formatted_lines.append(block + text)
+            self.after_tags = token.kind == 'tag'
+            self.in_header = False
+            return self._emit(formatted_lines)
+        elif token.kind == 'doc_string':
+            self.doc_string = (token.keyword, body + INDENT, token.indent)
+            formatted_lines.append(body + INDENT + token.keyword + token.text)
+        elif token.kind in ('step', 'examples'):
+            separator = ' ' if token.kind == 'step' else ': '
+            formatted_lines.append(f"{body}{token.keyword}{separator}{token.text}".rstrip())
+            self.in_header = False
+        elif self.in_header:
+            formatted_lines.append(token.text)
+        else:
+            formatted_lines.append(body + token.text)
+        self.after_tags = False
+        return self._emit(formatted_lines)
+    
+    def flush(self) -> list:
+        """Return the held back table rows, aligned"""
+        if not self.table:
+            return []
+        rows, self.table = self.table, []
+        return self._emit(format_table(rows, self._block_indent() + INDENT * 2))
+    
+    def _emit(self, formatted_lines: list) -> list:
+        if formatted_lines:
+            self.last_line = formatted_lines[-1]
+        return formatted_lines
+    
+    def _add_separator(self, formatted_lines: list) -> None:
+        """Start a new block with a blank line unless one was just written"""
+        previous = formatted_lines[-1] if formatted_lines else self.last_line
+        if previous is not None and previous != '':
+            formatted_lines.append('')
+
+
+class GherkinStreamCleaner:
+    """
+    Incremental counterpart of TestGeneratorAgent.clean_gherkin_content.
+    
+    Text is fed as it streams in and complete, cleaned lines are returned.
+    Lines before the first Gherkin keyword are held back: they are dropped if
+    a 'Feature:' line follows (as the batch cleaner does) and released otherwise.
+    """
+    
+    MARKERS = ('```gherkin', '```', '<think>', '</think>', '<div class="think">', '</div>')
+    KEYWORDS = ('Feature:', 'Background:', 'Scenario', 'Rule:', 'Examples:', '@',
+                'Given', 'When', 'Then', 'And', 'But', '|')
+    
+    def __init__(self):
+        self.buffer = ''
+        self.pending = []
+        self.blank_lines = []
+        self.started = False
+    
+    def feed(self, text: str) -> list:
+        """Add streamed text and return the cleaned lines completed by it"""
+        self.buffer += text
+        *complete, self.buffer = self.buffer.split('\n')
+        cleaned_lines = []
+        for line in complete:
+            cleaned_lines.extend(self._clean_line(line))
+        return cleaned_lines
+    
+    def flush(self) -> list:
+        """Return the remaining cleaned lines once the stream has ended"""
+        cleaned_lines = self._clean_line(self.buffer) if self.buffer else []
+        self.buffer = ''
+        if not self.started:
+            cleaned_lines = self.pending + cleaned_lines
+            self.pending = []
+            while cleaned_lines and not cleaned_lines[0].strip():
+                cleaned_lines.pop(0)
+        # Blank lines still held back are trailing whitespace, which the batch cleaner strips
+        self.blank_lines = []
+        return cleaned_lines
+    
+    def _clean_line(self, line: str) -> list:
+        for marker in self.MARKERS:
+            line = line.replace(marker, '')
+        
+        if 'Feature:' in line:
+            # Only keep content from 'Feature:' onwards
+            self.pending = []
+            self.blank_lines = []
+            self.started = True
+            return [line[line.find('Feature:'):]]
+        
+        if not self.started:
+            self.pending.append(line)
+            if not line.strip().startswith(self.KEYWORDS):
+                return []
+            # No Feature header before the first keyword, so nothing gets trimmed
+            self.started = True
+            released, self.pending = self.pending, []
+            while released and not released[0].strip():
+                released.pop(0)
+            return released
+        
+        # Hold blank lines until more content follows them
+        if not line.strip():
+            self.blank_lines.append(line)
+            return []
+        released, self.blank_lines = self.blank_lines + [line], []
+        return released
+
+
 class TestGeneratorAgent:
+    # Stages that only depend on the requirement and can run side by side
+    PARALLEL_STAGES = ('header', 'scenarios', 'edge_cases')
+    
+    # Model of every stage not listed in STAGE_MODELS or GHERKIN_STAGE_MODELS
+    DEFAULT_MODEL = "deepseek-r1-distill-llama-70b"
+    
+    # The header is a few lines of boilerplate, so a small fast model writes it;
+    # scenarios, edge cases and the improve pass keep the large reasoning model
+    STAGE_MODELS = {'header': "llama-3.1-8b-instant"}
+
     def __init__(self):
         try:
             # Initialize token counter for debugging
-            self.tokenizer = tiktoken.get_encoding("cl100k_base")  # Using OpenAI's encoding as an approximation
+            self.tokenizer = load_encoding("cl100k_base")  # Using OpenAI's encoding as an approximation
+            # Shared memoizing counter: prompts embed the same requirement several times
+            self.token_counter = get_token_counter("cl100k_base", self.tokenizer)
             self.max_input_tokens = 8192  # Default max input tokens
             self.max_output_tokens = 1024  # Default max output tokens
             
-            self.agent = Agent(
-                model=Groq(
-                    id="deepseek-r1-distill-llama-70b",
-                    temperature=0.6,
-                    max_tokens=1024,
-                    top_p=0.95
-                ),
-                instructions='''You are a BDD test expert specializing in automated testing. Generate comprehensive Gherkin feature files for any type of project.
+            # Maximum number of independent stages in flight per request (1 = sequential)
+            self.max_parallel_stages = int(os.getenv('GHERKIN_STAGE_WORKERS', len(self.PARALLEL_STAGES)))
+            
+            self.stage_models = self._resolve_stage_models()
+            self.agent = self._create_agent(self.stage_models['improve'])
+            
+            # Agno agents keep per-run state, so each concurrent stage gets its own instance
+            self.stage_agents = {name: self._create_agent(self.stage_models[name]) for name in self.PARALLEL_STAGES}
+        except Exception as e:
+            print(f"Error initializing agent: {str(e)}")
+            self.agent = None
+
+    def _resolve_stage_models(self) -> dict:
+        """
+        Return the model of each stage (PARALLEL_STAGES and 'improve')
+        
+        GHERKIN_STAGE_MODELS, a JSON object such as {"header": "llama-3.1-8b-instant"},
+        takes precedence over STAGE_MODELS; its "default" key replaces DEFAULT_MODEL.
+        """
+        overrides = {}
+        configured = os.getenv('GHERKIN_STAGE_MODELS')
+        if configured:
+            try:
+                overrides = {str(name): str(model) for name, model in json.loads(configured).items() if model}
+            except (ValueError, AttributeError) as e:
+                print(f"Error parsing GHERKIN_STAGE_MODELS: {str(e)}")
+        
+        default_model = overrides.get('default', self.DEFAULT_MODEL)
+        stage_models = {
+            name: overrides.get(name) or self.STAGE_MODELS.get(name) or default_model
+            for name in self.PARALLEL_STAGES + ('improve',)
+        }
+        return stage_models
+
+    def _create_agent(self, model_id: str = DEFAULT_MODEL) -> CachedAgent:
+        """Create a cached agent configured for Gherkin generation"""
+        return create_agent(
+            model_id=model_id,
+            temperature=0.6,
+            max_tokens=1024,
+            top_p=0.95,
+            instructions='''You are a BDD test expert specializing in automated testing. Generate comprehensive Gherkin feature files for any type of project.
         
         Follow these rules:
         1. Use Feature, Background (if needed), Scenario format
@@ -75,21 +292,26 @@ class TestGeneratorAgent:
         5. Use tags to categorize scenarios (@happy_path, @error_case, etc.)
         6. ALWAYS complete your scenarios - never leave a scenario without proper Given/When/Then steps
         7. NEVER truncate your output in the middle of a scenario''',
-                markdown=False
-            )
-        except Exception as e:
-            print(f"Error initializing agent: {str(e)}")
-            self.agent = None
+            markdown=False
+        )
 
     def count_tokens(self, text: str) -> int:
         """Count the number of tokens in a text string"""
         if not text:
             return 0
-        return len(self.tokenizer.encode(text))
+        return self.token_counter.count(text)
     
-    def is_truncated(self, text: str, max_tokens: int) -> bool:
-        """Check if text is likely truncated based on token count and content"""
-        token_count = self.count_tokens(text)
+    def is_truncated(self, text: str, max_tokens: int, token_count: int = None) -> bool:
+        """
+        Check if text is likely truncated based on token count and content
+        
+        Args:
+            text: Generated text
+            max_tokens: Output token limit of the call that produced the text
+            token_count: Token count of text if already known, to avoid counting again
+        """
+        if token_count is None:
+            token_count = self.count_tokens(text)
         # Check if we're close to the max tokens (within 5%)
         close_to_limit = token_count > max_tokens * 0.95
         
@@ -121,16 +343,16 @@ class TestGeneratorAgent:
         
         return content.strip()
 
-    def evaluate_and_improve(self, content: str, original_prompt: str = "") -> str:
-        """Evaluate and improve the generated test cases"""
-        if not self.agent:
-            return content
+    def format_gherkin(self, content: str) -> str:
+        """Parse a complete Gherkin document and serialize it with canonical formatting"""
+        return format_feature(parse_gherkin(content))
 
-        try:
-            # Add the original prompt to provide context for improvement
-            context = f"Original requirement: {original_prompt}\n\n" if original_prompt else ""
-            
-            eval_prompt = f"""{context}Improve this Gherkin feature file:
+    def _build_improve_prompt(self, content: str, original_prompt: str = "") -> str:
+        """Build the prompt asking the model to improve a draft feature file"""
+        # Add the original prompt to provide context for improvement
+        context = f"Original requirement: {original_prompt}\n\n" if original_prompt else ""
+        
+        return f"""{context}Improve this Gherkin feature file:
 
 {content}
 
@@ -145,7 +367,24 @@ Add scenarios for:
 4. Integration tests with external systems
 5. Concurrent operations and state changes"""
 
-            response = self.agent.run(eval_prompt)
+    def evaluate_and_improve(self, content: str, original_prompt: str = "", eval_prompt: str = None) -> str:
+        """Evaluate and improve the generated test cases"""
+        return run_pipeline(self._improve_pipeline(content, original_prompt, eval_prompt))
+
+    async def aevaluate_and_improve(self, content: str, original_prompt: str = "", eval_prompt: str = None) -> str:
+        """Async counterpart of evaluate_and_improve"""
+        return await arun_pipeline(self._improve_pipeline(content, original_prompt, eval_prompt))
+
+    def _improve_pipeline(self, content: str, original_prompt: str = "", eval_prompt: str = None):
+        """Pipeline of evaluate_and_improve (see utils.model_calls)"""
+        if not self.agent:
+            return content
+
+        try:
+            if eval_prompt is None:
+                eval_prompt = self._build_improve_prompt(content, original_prompt)
+
+            response = yield ModelCall(self.agent, eval_prompt)
             improved_content = response.content
             
             # Clean up the response
@@ -156,7 +395,119 @@ Add scenarios for:
             print(f"Error during improvement: {str(e)}")
             return content
 
+    def _build_stage_prompts(self, prompt: str) -> dict:
+        """Build the prompts of the independent stages, keyed by stage name"""
+        # Step 1: Generate feature header and basic structure
+        header_prompt = f"""Generate ONLY the Feature header and description for: {prompt}
+            Include Feature name, user story (As a, I want to, So that), and Background if needed.
+            Do NOT include any scenarios yet.
+            Example format:
+            Feature: Name
+              As a ...
+              I want to ...
+              So that ...
+
+              Background:
+                Given ...
+            """
+        
+        # Step 2: Generate scenarios in batches to avoid token limits
+        scenarios_prompt = f"""Generate 3-4 essential Gherkin scenarios for: {prompt}
+            Do NOT include the Feature header or description.
+            Start directly with @tags and Scenario: for each scenario.
+            Focus on the most important core functionality and happy paths.
+            Example format:
+              @tag
+              Scenario: Name
+                Given ...
+                When ...
+                Then ...
+            """
+        
+        # Step 3: Generate edge cases and error scenarios
+        edge_cases_prompt = f"""Generate 3-4 additional Gherkin scenarios for: {prompt}
+            Focus ONLY on edge cases, validation errors, and security concerns.
+            Do NOT include the Feature header or description.
+            Start directly with @tags and Scenario: for each scenario.
+            Example format:
+              @tag
+              Scenario: Name
+                Given ...
+                When ...
+                Then ...
+            """
+        
+        return {
+            'header': header_prompt,
+            'scenarios': scenarios_prompt,
+            'edge_cases': edge_cases_prompt
+        }
+
+    def _count_stage_prompts(self, stage_prompts: dict) -> list:
+        """Return the token_debug entries of the stage prompts, counted in one batch"""
+        counts = self.token_counter.count_many(stage_prompts.values())
+        return [
+            {
+                "name": name,
+                "tokens": tokens,
+                "truncated": tokens > self.max_input_tokens
+            }
+            for name, tokens in zip(stage_prompts, counts)
+        ]
+
+    def _stage_result(self, result: CallResult) -> dict:
+        """
+        Turn the model call of an independent generation stage into its output
+        
+        Args:
+            result: Outcome of the stage's model call
+            
+        Returns:
+            Dictionary with the cleaned content, response token count,
+            truncation flag and elapsed seconds for the stage
+        """
+        tokens = self.count_tokens(result.response.content)
+        return {
+            'content': self.clean_gherkin_content(result.response.content),
+            'tokens': tokens,
+            'truncated': self.is_truncated(result.response.content, self.max_output_tokens, tokens),
+            'seconds': result.seconds
+        }
+
+    def _resolve_feature_name(self, request_data: dict) -> str:
+        """Return the requested feature file name, or a timestamped default"""
+        feature_name_value = request_data.get('featureName')
+        if feature_name_value:
+            feature_name = str(feature_name_value).strip()
+        else:
+            feature_name = f"feature_{int(time.time())}"
+            
+        if not feature_name.endswith('.feature'):
+            feature_name += '.feature'
+        return feature_name
+
+    def _basic_feature(self, feature_name: str) -> str:
+        """Minimal feature used when generation fails"""
+        basic_content = f"Feature: {feature_name.replace('.feature', '')}\n\n"
+        basic_content += "  Scenario: Basic functionality\n"
+        basic_content += "    Given the system is ready\n"
+        basic_content += "    When the user performs the requested action\n"
+        basic_content += "    Then the expected result should occur\n\n"
+        basic_content += "  Scenario: Error handling\n"
+        basic_content += "    Given the system is ready\n"
+        basic_content += "    When invalid input is provided\n"
+        basic_content += "    Then an appropriate error message should be displayed"
+        return basic_content
+
     def generate_gherkin(self, request_data: dict) -> dict:
+        return run_pipeline(self.gherkin_pipeline(request_data))
+
+    async def agenerate_gherkin(self, request_data: dict) -> dict:
+        """Async counterpart of generate_gherkin: model calls wait on the event loop"""
+        return await arun_pipeline(self.gherkin_pipeline(request_data))
+
+    def gherkin_pipeline(self, request_data: dict):
+        """Pipeline of generate_gherkin (see utils.model_calls)"""
         if not self.agent:
             return {'status': 'error', 'message': 'Agent not properly initialized'}
 
@@ -179,14 +530,7 @@ Add scenarios for:
                 print(f"WARNING - Input may be truncated! {input_token_count} tokens exceeds limit of {self.max_input_tokens}")
 
             # Get feature name or use default
-            feature_name_value = request_data.get('featureName')
-            if feature_name_value:
-                feature_name = str(feature_name_value).strip()
-            else:
-                feature_name = f"feature_{int(time.time())}"
-                
-            if not feature_name.endswith('.feature'):
-                feature_name += '.feature'
+            feature_name = self._resolve_feature_name(request_data)
 
             print(f"Generating test cases for: {prompt[:100]}...")
             
@@ -214,102 +558,37 @@ Add scenarios for:
                 "responses": []
             }
             
-            # Step 1: Generate feature header and basic structure
-            header_prompt = f"""Generate ONLY the Feature header and description for: {prompt}
-            Include Feature name, user story (As a, I want to, So that), and Background if needed.
-            Do NOT include any scenarios yet.
-            Example format:
-            Feature: Name
-              As a ...
-              I want to ...
-              So that ...
-
-              Background:
-                Given ...
-            """
-            
-            header_prompt_tokens = self.count_tokens(header_prompt)
-            token_debug["prompts"].append({
-                "name": "header",
-                "tokens": header_prompt_tokens,
-                "truncated": header_prompt_tokens > self.max_input_tokens
-            })
-            print(f"DEBUG - Header prompt: {header_prompt_tokens} tokens")
-            
-            response = self.agent.run(header_prompt)
-            feature_header = self.clean_gherkin_content(response.content)
-            header_response_tokens = self.count_tokens(response.content)
-            header_truncated = self.is_truncated(response.content, self.max_output_tokens)
-            token_debug["responses"].append({
-                "name": "header",
-                "tokens": header_response_tokens,
-                "truncated": header_truncated
-            })
-            print(f"DEBUG - Header response: {header_response_tokens} tokens, truncated: {header_truncated}")
-            
-            # Step 2: Generate scenarios in batches to avoid token limits
-            scenarios_prompt = f"""Generate 3-4 essential Gherkin scenarios for: {prompt}
-            Do NOT include the Feature header or description.
-            Start directly with @tags and Scenario: for each scenario.
-            Focus on the most important core functionality and happy paths.
-            Example format:
-              @tag
-              Scenario: Name
-                Given ...
-                When ...
-                Then ...
-            """
-            
-            scenarios_prompt_tokens = self.count_tokens(scenarios_prompt)
-            token_debug["prompts"].append({
-                "name": "scenarios",
-                "tokens": scenarios_prompt_tokens,
-                "truncated": scenarios_prompt_tokens > self.max_input_tokens
-            })
-            print(f"DEBUG - Scenarios prompt: {scenarios_prompt_tokens} tokens")
+            stage_prompts = self._build_stage_prompts(prompt)
             
-            response = self.agent.run(scenarios_prompt)
-            core_scenarios = self.clean_gherkin_content(response.content)
-            scenarios_response_tokens = self.count_tokens(response.content)
-            scenarios_truncated = self.is_truncated(response.content, self.max_output_tokens)
-            token_debug["responses"].append({
-                "name": "scenarios",
-                "tokens": scenarios_response_tokens,
-                "truncated": scenarios_truncated
-            })
-            print(f"DEBUG - Scenarios response: {scenarios_response_tokens} tokens, truncated: {scenarios_truncated}")
+            for entry in self._count_stage_prompts(stage_prompts):
+                token_debug["prompts"].append(entry)
+                print(f"DEBUG - {entry['name']} prompt: {entry['tokens']} tokens")
             
-            # Step 3: Generate edge cases and error scenarios
-            edge_cases_prompt = f"""Generate 3-4 additional Gherkin scenarios for: {prompt}
-            Focus ONLY on edge cases, validation errors, and security concerns.
-            Do NOT include the Feature header or description.
-            Start directly with @tags and Scenario: for each scenario.
-            Example format:
-              @tag
-              Scenario: Name
-                Given ...
-                When ...
-                Then ...
-            """
+            # None of the three stages depends on another's output, so fan them out
+            # and join before the improve pass, which needs all of them
+            stage_results = yield ConcurrentCalls(
+                {name: ModelCall(self.stage_agents[name], stage_prompt) for name, stage_prompt in stage_prompts.items()},
+                max_parallel=self.max_parallel_stages
+            )
             
-            edge_cases_prompt_tokens = self.count_tokens(edge_cases_prompt)
-            token_debug["prompts"].append({
-                "name": "edge_cases",
-                "tokens": edge_cases_prompt_tokens,
-                "truncated": edge_cases_prompt_tokens > self.max_input_tokens
-            })
-            print(f"DEBUG - Edge cases prompt: {edge_cases_prompt_tokens} tokens")
+            stage_outputs = {}
+            for name, call_result in stage_results.items():
+                if call_result.error is not None:
+                    raise call_result.error
+                result = self._stage_result(call_result)
+                stage_outputs[name] = result['content']
+                token_debug["responses"].append({
+                    "name": name,
+                    "model": self.stage_models[name],
+                    "tokens": result['tokens'],
+                    "truncated": result['truncated'],
+                    "seconds": result['seconds']
+                })
+                print(f"DEBUG - {name} response: {result['tokens']} tokens, truncated: {result['truncated']}, {result['seconds']}s")
             
-            response = self.agent.run(edge_cases_prompt)
-            edge_scenarios = self.clean_gherkin_content(response.content)
-            edge_cases_response_tokens = self.count_tokens(response.content)
-            edge_cases_truncated = self.is_truncated(response.content, self.max_output_tokens)
-            token_debug["responses"].append({
-                "name": "edge_cases",
-                "tokens": edge_cases_response_tokens,
-                "truncated": edge_cases_truncated
-            })
-            print(f"DEBUG - Edge cases response: {edge_cases_response_tokens} tokens, truncated: {edge_cases_truncated}")
+            feature_header = stage_outputs['header']
+            core_scenarios = stage_outputs['scenarios']
+            edge_scenarios = stage_outputs['edge_cases']
             
             # Combine all parts
             content = feature_header
@@ -335,10 +614,20 @@ Add scenarios for:
             }
             print(f"DEBUG - Combined content: {combined_content_tokens} tokens")
             
+            # Chunks of a request with improveMerged are improved once, after merging
+            skip_improve = bool(request_data.get('chunkInfo') and request_data.get('improveMerged'))
+            
+            # Skip the improve pass when the draft already meets the quality thresholds
+            if iterations > 0 and not skip_improve:
+                token_debug["quality"] = quality_gate(score_gherkin(content))
+                print(f"DEBUG - Draft quality score: {token_debug['quality']['score']}, "
+                      f"decision: {token_debug['quality']['decision']}")
+                skip_improve = token_debug["quality"]["decision"] == 'skip_improve'
+            
             # Iteratively improve the combined content if needed
-            if iterations > 0:
+            if iterations > 0 and not skip_improve:
                 print(f"Evaluating and improving test cases...")
-                improve_prompt = f"Original requirement: {prompt}\n\nImprove this Gherkin feature file:\n\n{content}"
+                improve_prompt = self._build_improve_prompt(content, prompt)
                 improve_prompt_tokens = self.count_tokens(improve_prompt)
                 token_debug["prompts"].append({
                     "name": "improve",
@@ -347,62 +636,27 @@ Add scenarios for:
                 })
                 print(f"DEBUG - Improvement prompt: {improve_prompt_tokens} tokens")
                 
-                content = self.evaluate_and_improve(content, prompt)
+                start_time = time.perf_counter()
+                content = yield from self._improve_pipeline(content, prompt, improve_prompt)
                 
                 improved_content_tokens = self.count_tokens(content)
-                improved_truncated = self.is_truncated(content, self.max_output_tokens)
+                improved_truncated = self.is_truncated(content, self.max_output_tokens, improved_content_tokens)
                 token_debug["responses"].append({
                     "name": "improve",
+                    "model": self.stage_models['improve'],
                     "tokens": improved_content_tokens,
-                    "truncated": improved_truncated
+                    "truncated": improved_truncated,
+                    "seconds": round(time.perf_counter() - start_time, 3)
                 })
                 token_debug["combined"]["tokens"] = improved_content_tokens
                 token_debug["combined"]["truncated"] = improved_truncated
                 print(f"DEBUG - Improved content: {improved_content_tokens} tokens, truncated: {improved_truncated}")
             
             # Format the content properly
-            lines = content.split('\n')
-            formatted_lines = []
-            current_section = None
-                
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    formatted_lines.append('')
-                    continue
-                    
-                if line.startswith('Feature:'):
-                    formatted_lines.append(line)
-                    current_section = 'feature'
-                elif line.startswith('As a') or line.startswith('I want') or line.startswith('So that'):
-                    formatted_lines.append(line)
-                elif line.startswith('Scenario:') or line.startswith('Scenario Outline:'):
-                    if formatted_lines and formatted_lines[-1] != '':
-                        formatted_lines.append('')
-                    formatted_lines.append('  ' + line)
-                    current_section = 'scenario'
-                elif line.startswith('Given') or line.startswith('When') or line.startswith('Then') or line.startswith('And') or line.startswith('But'):
-                    formatted_lines.append('    ' + line)
-                elif line.startswith('|'):
-                    formatted_lines.append('      ' + line)
-                elif line.startswith('Examples:'):
-                    formatted_lines.append('    ' + line)
-                elif line.startswith('@'):
-                    if formatted_lines and formatted_lines[-1] != '':
-                        formatted_lines.append('')
-                    formatted_lines.append('  ' + line)
-                elif line.startswith('Background:'):
-                    if formatted_lines and formatted_lines[-1] != '':
-                        formatted_lines.append('')
-                    formatted_lines.append('  ' + line)
-                    current_section = 'background'
-                elif line:
-                    if current_section == 'feature':
-                        formatted_lines.append(line)
-                    else:
-                        formatted_lines.append('    ' + line)
-            
-            content = '\n'.join(formatted_lines)
+            content = self.format_gherkin(content)
+            
+            # Nobody downloads the feature of an abandoned request
+            checkpoint()
             
             # Save the feature file
             os.makedirs('features', exist_ok=True)
@@ -415,7 +669,7 @@ Add scenarios for:
                 json.dump(token_debug, f, indent=2)
                 
             # Add token debug info to response
-            return {
+            result = {
                 'status': 'success',
                 'content': content,
                 'feature_file': feature_file,
@@ -426,22 +680,21 @@ Add scenarios for:
                     'output_tokens': token_debug["combined"]["tokens"],
                     'input_truncated': input_truncated,
                     'output_truncated': token_debug["combined"]["truncated"],
+                    'stages': token_debug["responses"],
                     'log_file': log_file
                 }
             }
+            if "quality" in token_debug:
+                result['token_debug']['quality'] = token_debug["quality"]
+            return result
 
+        except (RateLimitExceeded, Cancelled):
+            # Rejected for lack of rate limit budget or abandoned: no fallback feature
+            raise
         except Exception as e:
             print(f"Error during generation: {str(e)}")
             # Fallback to a very simple generation
-            basic_content = f"Feature: {feature_name.replace('.feature', '')}\n\n"
-            basic_content += "  Scenario: Basic functionality\n"
-            basic_content += "    Given the system is ready\n"
-            basic_content += "    When the user performs the requested action\n"
-            basic_content += "    Then the expected result should occur\n\n"
-            basic_content += "  Scenario: Error handling\n"
-            basic_content += "    Given the system is ready\n"
-            basic_content += "    When invalid input is provided\n"
-            basic_content += "    Then an appropriate error message should be displayed"
+            basic_content = self._basic_feature(feature_name)
             
             os.makedirs('features', exist_ok=True)
             feature_file = os.path.join('features', feature_name)
@@ -456,6 +709,272 @@ Add scenarios for:
                 'message': 'Basic test cases generated (fallback mode)'
             }
 
+    def _stream_in_background(self, agent, stage_prompt: str) -> queue.Queue:
+        """
+        Stream a model response on a background thread
+        
+        Returns:
+            Queue receiving ('delta', text) items followed by ('end', None),
+            or ('error', exception) if the call fails
+        """
+        events = queue.Queue()
+        
+        def produce():
+            cancel_token = current_token()
+            deltas = agent.stream(stage_prompt)
+            try:
+                for delta in deltas:
+                    if cancel_token is not None and cancel_token.cancelled:
+                        # Nobody reads this stage any more: closing the stream ends the model call
+                        deltas.close()
+                        cancel_token.raise_if_cancelled()
+                    events.put(('delta', delta))
+                events.put(('end', None))
+            except Exception as e:
+                events.put(('error', e))
+        
+        threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True).start()
+        return events
+
+    def _consume_stream(self, name: str, events: queue.Queue, formatter: GherkinLineFormatter):
+        """
+        Relay one streamed stage as cleaned, formatted text events
+        
+        Yields:
+            ('delta', data) events for the client
+            
+        Returns:
+            Dictionary with the cleaned content, response token count and truncation flag
+        """
+        cleaner = GherkinStreamCleaner()
+        raw_parts = []
+        cleaned_lines = []
+        
+        while True:
+            kind, value = events.get()
+            if kind == 'error':
+                raise value
+            if kind == 'delta':
+                raw_parts.append(value)
+                lines = cleaner.feed(value)
+            else:
+                lines = cleaner.flush()
+            
+            cleaned_lines.extend(lines)
+            formatted = [out for line in lines for out in formatter.format_line(line)]
+            if kind == 'end':
+                formatted.extend(formatter.flush())
+            if formatted:
+                yield 'delta', {'stage': name, 'text': '\n'.join(formatted) + '\n'}
+            
+            if kind == 'end':
+                break
+        
+        raw_content = ''.join(raw_parts)
+        tokens = self.count_tokens(raw_content)
+        return {
+            'content': '\n'.join(cleaned_lines),
+            'tokens': tokens,
+            'truncated': self.is_truncated(raw_content, self.max_output_tokens, tokens)
+        }
+
+    def stream_gherkin(self, request_data: dict):
+        """
+        Generate a feature file while streaming model output as it arrives
+        
+        Runs the same stages as generate_gherkin. The header, scenarios and edge
+        case stages are started together and relayed in order; the improve pass
+        then streams a complete replacement of the draft.
+        
+        Yields:
+            (event, data) tuples: 'start', 'stage' (stage boundaries), 'delta'
+            (formatted text), then 'done' with the final result or 'error'
+        """
+        if not self.agent:
+            yield 'error', {'message': 'Agent not properly initialized'}
+            return
+        
+        prompt = request_data.get('requirement', '') or request_data.get('text', '')
+        if not prompt:
+            yield 'error', {'message': 'No requirement provided'}
+            return
+        
+        feature_name = self._resolve_feature_name(request_data)
+        stage_names = list(self.PARALLEL_STAGES) + ['improve']
+        yield 'start', {'agent': 'gherkin', 'stages': stage_names, 'filename': feature_name}
+        
+        try:
+            input_token_count = self.count_tokens(prompt)
+            input_truncated = input_token_count > self.max_input_tokens
+            token_debug = {
+                "input": {
+                    "total_tokens": input_token_count,
+                    "truncated": input_truncated,
+                    "max_tokens": self.max_input_tokens
+                },
+                "prompts": [],
+                "responses": []
+            }
+            
+            stage_prompts = self._build_stage_prompts(prompt)
+            token_debug["prompts"].extend(self._count_stage_prompts(stage_prompts))
+            
+            # Start up to max_parallel_stages stages now; the rest start as earlier ones finish
+            streams = {}
+            not_started = list(self.PARALLEL_STAGES)
+            
+            def start_next():
+                name = not_started.pop(0)
+                streams[name] = self._stream_in_background(self.stage_agents[name], stage_prompts[name])
+            
+            for _ in range(min(max(1, self.max_parallel_stages), len(not_started))):
+                start_next()
+            
+            draft_formatter = GherkinLineFormatter()
+            draft_parts = []
+            for index, name in enumerate(self.PARALLEL_STAGES):
+                if name not in streams:
+                    start_next()
+                
+                yield 'stage', {'stage': name, 'status': 'started'}
+                start_time = time.perf_counter()
+                result = yield from self._consume_stream(name, streams[name], draft_formatter)
+                if not_started:
+                    start_next()
+                
+                seconds = round(time.perf_counter() - start_time, 3)
+                draft_parts.append(result['content'])
+                token_debug["responses"].append({
+                    "name": name,
+                    "model": self.stage_models[name],
+                    "tokens": result['tokens'],
+                    "truncated": result['truncated'],
+                    "seconds": seconds
+                })
+                yield 'stage', {'stage': name, 'status': 'completed', 'model': self.stage_models[name],
+                                'tokens': result['tokens'], 'truncated': result['truncated'], 'seconds': seconds}
+                
+                # Parts are separated by a blank line, as in generate_gherkin
+                if index < len(self.PARALLEL_STAGES) - 1:
+                    yield 'delta', {'stage': name, 'text': '\n'.join(draft_formatter.format_line('')) + '\n'}
+            
+            content = '\n\n'.join(draft_parts)
+            token_debug["combined"] = {
+                "tokens": self.count_tokens(content),
+                "truncated": False
+            }
+            
+            # The improve pass streams a full replacement of the draft, unless the
+            # draft already meets the quality thresholds
+            token_debug["quality"] = quality_gate(score_gherkin(content))
+            if token_debug["quality"]["decision"] == 'skip_improve':
+                yield 'stage', {'stage': 'improve', 'status': 'skipped', 'quality': token_debug["quality"]}
+            else:
+                content = yield from self._stream_improve(content, prompt, token_debug)
+            
+            content = self.format_gherkin(content)
+            
+            # Nobody downloads the feature of an abandoned stream
+            checkpoint()
+            feature_file, log_file = self._save_outputs(feature_name, content, token_debug)
+            
+            yield 'done', {
+                'status': 'success',
+                'content': content,
+                'feature_file': feature_file,
+                'filename': feature_name,
+                'message': 'Test cases generated successfully',
+                'token_debug': {
+                    'input_tokens': input_token_count,
+                    'output_tokens': token_debug["combined"]["tokens"],
+                    'input_truncated': input_truncated,
+                    'output_truncated': token_debug["combined"]["truncated"],
+                    'quality': token_debug["quality"],
+                    'stages': token_debug["responses"],
+                    'log_file': log_file
+                }
+            }
+        
+        except Cancelled:
+            # Abandoned: no fallback feature, the router reports the cancellation
+            raise
+        except Exception as e:
+            print(f"Error during streamed generation: {str(e)}")
+            basic_content = self._basic_feature(feature_name)
+            feature_file, _ = self._save_outputs(feature_name, basic_content)
+            yield 'done', {
+                'status': 'success',
+                'content': basic_content,
+                'feature_file': feature_file,
+                'filename': feature_name,
+                'message': 'Basic test cases generated (fallback mode)'
+            }
+
+    def _stream_improve(self, content: str, prompt: str, token_debug: dict):
+        """
+        Stream the improve pass over a draft
+        
+        Yields:
+            'stage' and 'delta' events of the improve stage
+            
+        Returns:
+            The improved content, or the draft if the improve pass failed
+        """
+        improve_prompt = self._build_improve_prompt(content, prompt)
+        improve_prompt_tokens = self.count_tokens(improve_prompt)
+        token_debug["prompts"].append({
+            "name": "improve",
+            "tokens": improve_prompt_tokens,
+            "truncated": improve_prompt_tokens > self.max_input_tokens
+        })
+        
+        yield 'stage', {'stage': 'improve', 'status': 'started', 'replaces_previous': True}
+        start_time = time.perf_counter()
+        try:
+            events = self._stream_in_background(self.agent, improve_prompt)
+            result = yield from self._consume_stream('improve', events, GherkinLineFormatter())
+            seconds = round(time.perf_counter() - start_time, 3)
+            token_debug["responses"].append({
+                "name": "improve",
+                "model": self.stage_models['improve'],
+                "tokens": result['tokens'],
+                "truncated": result['truncated'],
+                "seconds": seconds
+            })
+            token_debug["combined"]["tokens"] = result['tokens']
+            token_debug["combined"]["truncated"] = result['truncated']
+            yield 'stage', {'stage': 'improve', 'status': 'completed', 'tokens': result['tokens'],
+                            'truncated': result['truncated'], 'seconds': seconds}
+            return result['content']
+        except Cancelled:
+            raise
+        except Exception as e:
+            # Keep the draft, as evaluate_and_improve does
+            print(f"Error during improvement: {str(e)}")
+            yield 'stage', {'stage': 'improve', 'status': 'failed', 'message': str(e)}
+            return content
+
+    def _save_outputs(self, feature_name: str, content: str, token_debug: dict = None):
+        """
+        Save the feature file and, if given, the token debug log
+        
+        Returns:
+            Tuple of (feature file path, log file path or None)
+        """
+        os.makedirs('features', exist_ok=True)
+        feature_file = os.path.join('features', feature_name)
+        with open(feature_file, 'w') as f:
+            f.write(content)
+        
+        log_file = None
+        if token_debug is not None:
+            log_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs')
+            os.makedirs(log_dir, exist_ok=True)
+            log_file = os.path.join(log_dir, f"token_debug_{int(time.time())}.json")
+            with open(log_file, 'w') as f:
+                json.dump(token_debug, f, indent=2)
+        return feature_file, log_file
+
 # Add this if you want to enable command-line usage
 def main():
     try:
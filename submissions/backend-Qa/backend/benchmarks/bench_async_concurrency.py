@@ -0,0 +1,145 @@
+"""
+Benchmark many concurrent generations through the threaded and the async router path.
+
+The threaded path is how main.py served requests before ASYNC_AGENTS: every
+request runs AgentRouter.route_request on a worker of the default executor,
+so at most THREAD_POOL_WORKERS requests make progress and the rest queue
+for a thread. The async path awaits AgentRouter.aroute_request on the event
+loop, where a request waiting for its model holds a task instead of a thread.
+
+Requests run against the offline model provider with a fixed, remote-like
+latency, all submitted at once; every requirement is distinct so nothing is
+coalesced. For each concurrency level and path the suite reports:
+
+    seconds     wall-clock time until every request finished
+    req/s       completed requests per second
+    p50 / p95   per-request latency in seconds
+    threads     peak number of live threads in the process
+    ok          requests answered with status 'success'
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_async_concurrency
+    python -m benchmarks.bench_async_concurrency --concurrency 100 500 --latency-ms 1000 --agent-type selenium
+    python -m benchmarks.bench_async_concurrency --workers 64 --output results/async.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+# Models are simulated with a fixed latency, responses must not come from the
+# cache and distinct requests must not be coalesced or hedged
+os.environ['MODEL_PROVIDER'] = 'offline'
+os.environ['LLM_CACHE_ENABLED'] = 'false'
+os.environ['REQUEST_COALESCING'] = 'false'
+os.environ['HEDGING_ENABLED'] = 'false'
+os.environ.setdefault('OFFLINE_MODEL_DISTRIBUTION', 'fixed')
+
+from concurrent.futures import ThreadPoolExecutor
+
+from agents.agent_router import AgentRouter
+
+REQUIREMENTS = {
+    'gherkin': 'User {index} can log in with a valid username and password on the login page',
+    'selenium': 'Generate a selenium test where user {index} clicks the login button on the login page',
+    'chat': 'How should user {index} test the password reset page?'
+}
+
+
+def build_requests(agent_type: str, count: int) -> list:
+    return [{'requirement': REQUIREMENTS[agent_type].format(index=index), 'agentType': agent_type, 'iterations': 1}
+            for index in range(count)]
+
+
+async def run_level(router: AgentRouter, requests: list, mode: str, workers: int) -> dict:
+    """Submit all requests at once through one path and measure them"""
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='agent')
+    loop.set_default_executor(executor)
+    peak_threads = threading.active_count()
+    latencies = []
+
+    async def one(request_data: dict) -> dict:
+        start = time.perf_counter()
+        if mode == 'async':
+            result = await router.aroute_request(request_data)
+        else:
+            result = await asyncio.to_thread(router.route_request, request_data)
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    async def sample_threads():
+        nonlocal peak_threads
+        while True:
+            peak_threads = max(peak_threads, threading.active_count())
+            await asyncio.sleep(0.01)
+
+    sampler = asyncio.create_task(sample_threads())
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(dict(request_data)) for request_data in requests))
+    seconds = time.perf_counter() - start
+    sampler.cancel()
+    executor.shutdown(wait=True)
+
+    latencies.sort()
+    return {
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(len(requests) / seconds, 1),
+        'p50': round(statistics.median(latencies), 3),
+        'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+        'peak_threads': peak_threads,
+        'ok': sum(1 for result in results if result.get('status') == 'success')
+    }
+
+
+def print_results(results: dict) -> None:
+    print(f"{'concurrency':>11} {'mode':<8} {'seconds':>8} {'req/s':>8} {'p50':>7} {'p95':>7} {'threads':>8} {'ok':>6}")
+    for concurrency, modes in results.items():
+        for mode, row in modes.items():
+            print(f"{concurrency:>11} {mode:<8} {row['seconds']:>8.2f} {row['requests_per_second']:>8.1f} "
+                  f"{row['p50']:>7.2f} {row['p95']:>7.2f} {row['peak_threads']:>8} {row['ok']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 200],
+                        help='Numbers of requests submitted at once')
+    parser.add_argument('--latency-ms', type=float, default=500, help='Simulated time to first token of every model call')
+    parser.add_argument('--agent-type', choices=sorted(REQUIREMENTS), default='gherkin')
+    parser.add_argument('--workers', type=int, default=min(32, (os.cpu_count() or 1) + 4),
+                        help='Worker threads of the threaded path (main.py THREAD_POOL_WORKERS)')
+    parser.add_argument('--output', help='Write the results as JSON to this path')
+    args = parser.parse_args()
+
+    os.environ['OFFLINE_MODEL_LATENCY_MS'] = str(args.latency_ms)
+    output_path = os.path.abspath(args.output) if args.output else None
+
+    # The agents write generated files relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='bench_async_'))
+    router = AgentRouter(prewarm=args.agent_type)
+
+    results = {}
+    for concurrency in args.concurrency:
+        requests = build_requests(args.agent_type, concurrency)
+        results[concurrency] = {}
+        for mode in ('threads', 'async'):
+            # The agents log every request; keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                results[concurrency][mode] = asyncio.run(run_level(router, requests, mode, args.workers))
+    print_results(results)
+
+    if output_path:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        with open(output_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark end-to-end latency of TestGeneratorAgent.generate_gherkin with
+sequential versus concurrent header / scenarios / edge-case stages.
+
+The Groq model is replaced with a stub that sleeps for a fixed latency, so the
+numbers reflect pipeline structure rather than network variance.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_gherkin_stages --latency 0.5 --runs 5
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from agents.test_generator_agent import TestGeneratorAgent
+
+STUB_FEATURE = """Feature: Login
+  As a registered user
+  I want to log in
+  So that I can reach my dashboard
+
+  @happy_path
+  Scenario: Successful login
+    Given the user is on the login page
+    When the user submits valid credentials
+    Then the dashboard is displayed
+"""
+
+
+class StubResponse:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class StubAgent:
+    """Stand-in for an agno Agent that returns canned Gherkin after a fixed delay"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def run(self, prompt: str, **kwargs) -> StubResponse:
+        time.sleep(self.latency)
+        return StubResponse(STUB_FEATURE)
+
+
+def build_agent(latency: float, workers: int) -> TestGeneratorAgent:
+    """Create a TestGeneratorAgent whose model calls all go to stub agents"""
+    agent = TestGeneratorAgent()
+    agent.agent = StubAgent(latency)
+    agent.stage_agents = {name: StubAgent(latency) for name in TestGeneratorAgent.PARALLEL_STAGES}
+    agent.max_parallel_stages = workers
+    return agent
+
+
+def measure(agent: TestGeneratorAgent, runs: int) -> list:
+    """Return wall-clock seconds for each generate_gherkin run"""
+    timings = []
+    for i in range(runs):
+        start = time.perf_counter()
+        result = agent.generate_gherkin({
+            'requirement': 'As a registered user I want to log in so that I can reach my dashboard',
+            'featureName': f'bench_{i}',
+            'iterations': 1
+        })
+        timings.append(time.perf_counter() - start)
+        if result.get('status') != 'success' or 'token_debug' not in result:
+            raise RuntimeError(f"Unexpected result: {result.get('message')}")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.5, help='Stub model latency per call in seconds')
+    parser.add_argument('--runs', type=int, default=5, help='Number of generate_gherkin runs per mode')
+    args = parser.parse_args()
+
+    # generate_gherkin writes feature files relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='bench_gherkin_'))
+
+    results = {}
+    for label, workers in (('sequential', 1), ('concurrent', len(TestGeneratorAgent.PARALLEL_STAGES))):
+        timings = measure(build_agent(args.latency, workers), args.runs)
+        results[label] = timings
+        print(f"{label:>10}: median {statistics.median(timings):.3f}s  "
+              f"min {min(timings):.3f}s  max {max(timings):.3f}s  ({args.runs} runs, {workers} worker(s))")
+
+    speedup = statistics.median(results['sequential']) / statistics.median(results['concurrent'])
+    print(f"Speedup: {speedup:.2f}x (stub latency {args.latency}s per model call)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Micro-benchmarks of the CPU-bound code that runs on every request.
+
+Each function is run on synthetic inputs from 1 KB to 10 MB. For every
+function and size the suite reports the median wall time over several runs
+and the peak memory allocated during one run (tracemalloc, measured in a
+separate run so it does not slow down the timing).
+
+Results can be stored as a baseline and later runs compared against it: a
+function is flagged when its time or peak memory grows by more than the
+threshold. Baselines are machine specific, so record one on the machine
+that runs the comparison.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_hot_paths --save-baseline
+    python -m benchmarks.bench_hot_paths --fail-on-regression
+    python -m benchmarks.bench_hot_paths --sizes 1KB 100KB --only count_tokens clean_gherkin_content
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# The agents are only used for their text processing, never to call a model
+os.environ.setdefault('MODEL_PROVIDER', 'offline')
+
+from agents.agent_router import AgentRouter
+from agents.manual_testcase_agent import ManualTestCaseGenerator
+from agents.test_generator_agent import TestGeneratorAgent
+from utils.file_processor import extract_text_from_file
+from utils.gherkin_merge import merge_feature_files
+from utils.text_chunker import chunk_text
+from utils.token_counter import TokenCounter
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baselines', 'hot_paths.json')
+
+SIZES = {'1KB': 1024, '10KB': 10 * 1024, '100KB': 100 * 1024, '1MB': 1024 * 1024, '10MB': 10 * 1024 * 1024}
+
+# Stop repeating a measurement once this much time was spent on it
+TIME_BUDGET_SECONDS = 2.0
+
+
+def _fill(size: int, make_block) -> str:
+    """Concatenate generated blocks until the text reaches size characters"""
+    rng = random.Random(size)
+    blocks = []
+    total = 0
+    number = 1
+    while total < size:
+        block = make_block(rng, number)
+        blocks.append(block)
+        total += len(block)
+        number += 1
+    return ''.join(blocks)[:size]
+
+
+def requirements_text(size: int) -> str:
+    """Requirements document mixing markdown headers, numbered sections and user stories"""
+    def block(rng, number):
+        return (
+            f"## Module {number}\n\n"
+            f"{number}. Overview of module {number}\n"
+            f"The system shall handle {rng.choice(['orders', 'payments', 'accounts', 'reports'])} reliably.\n\n"
+            f"As a {rng.choice(['customer', 'admin', 'guest'])}, I want to manage item {number} "
+            f"so that my records stay accurate.\n"
+            f"Acceptance criteria: item {number} is saved, validated and shown in the list.\n\n"
+        )
+    return _fill(size, block)
+
+
+def raw_gherkin(size: int) -> str:
+    """Unformatted model output with thinking and markdown fences around the feature"""
+    def block(rng, number):
+        return (
+            f"@tag{number}\nScenario: Scenario {number}\n"
+            f"Given the user is on page {number}\n"
+            f"When the user {rng.choice(['clicks', 'submits', 'types'])} something\n"
+            f"And waits\nThen the result {number} is shown\n\n"
+        )
+    header = "<think>\nLet me write the feature.\n</think>\n```gherkin\nFeature: Benchmark\nAs a user\nI want things\nSo that it works\n\nBackground:\nGiven the app runs\n\n"
+    return header + _fill(max(size - len(header) - 3, 0), block) + "```"
+
+
+def manual_test_cases(size: int) -> str:
+    """Model output in the manual test case format"""
+    def block(rng, number):
+        return (
+            f"Test Case ID: TC_{number:03d}\n"
+            f"Description: Verify behaviour {number}\n"
+            "Test Steps:\n1. Open the page\n2. Enter the data\n3. Submit\n"
+            + ''.join(f"Test Data Set {i}: Field: value_{number}_{i}\n" for i in range(1, 6))
+            + f"Expected Result: Result {number} is displayed\n\n"
+        )
+    return _fill(size, block)
+
+
+class Benchmarks:
+    """Builds the inputs and the callables to measure"""
+
+    def __init__(self):
+        self.test_generator = TestGeneratorAgent()
+        self.manual_generator = ManualTestCaseGenerator()
+        self.router = AgentRouter()
+        self.tmp_dir = tempfile.mkdtemp(prefix='bench_hot_paths_')
+
+    def cases(self):
+        """Return benchmark name -> (input builder, function taking the input)"""
+        tg = self.test_generator
+        return {
+            'chunk_text': (requirements_text, lambda text: chunk_text(text, 1000, TokenCounter(self.test_generator.tokenizer))),
+            'count_tokens': (requirements_text, tg.count_tokens),
+            'is_truncated': (raw_gherkin, lambda text: tg.is_truncated(text, tg.max_output_tokens)),
+            'clean_gherkin_content': (raw_gherkin, tg.clean_gherkin_content),
+            'format_gherkin': (raw_gherkin, lambda text: tg.format_gherkin(tg.clean_gherkin_content(text))),
+            'merge_feature_files': (raw_gherkin, lambda text: merge_feature_files([tg.clean_gherkin_content(text)] * 2)),
+            'parse_test_cases': (manual_test_cases, self.manual_generator._parse_test_cases),
+            'is_valid_request': (requirements_text, self.router.is_valid_request),
+            'extract_text_from_file': (self.text_file, extract_text_from_file),
+            'token_accounting_plain': (requirements_text, self.token_accounting_plain),
+            'token_accounting_memoized': (requirements_text, self.token_accounting_memoized)
+        }
+
+    def _token_accounting(self, prompt: str, count, count_many) -> list:
+        """Count every text generate_gherkin reports in token_debug for one request"""
+        tg = self.test_generator
+        stage_prompts = tg._build_stage_prompts(prompt)
+        responses = [raw_gherkin(4096) for _ in stage_prompts]
+        content = '\n\n'.join(tg.clean_gherkin_content(response) for response in responses)
+        counts = [count(prompt)] + count_many(list(stage_prompts.values()))
+        for response in responses:
+            tokens = count(response)
+            counts.append(tokens)
+            tg.is_truncated(response, tg.max_output_tokens, tokens)
+        counts.append(count(content))
+        counts.append(count(f"Original requirement: {prompt}\n\nImprove this Gherkin feature file:\n\n{content}"))
+        counts.append(count(content))
+        return counts
+
+    def token_accounting_plain(self, prompt: str) -> list:
+        """The same counts with a plain encode per text"""
+        encoding = self.test_generator.tokenizer
+
+        def count(text):
+            return len(encoding.encode(text))
+
+        return self._token_accounting(prompt, count, lambda texts: [count(text) for text in texts])
+
+    def token_accounting_memoized(self, prompt: str) -> list:
+        # A fresh counter per request: only lines shared within the request are reused
+        counter = TokenCounter(self.test_generator.tokenizer)
+        return self._token_accounting(prompt, counter.count, counter.count_many)
+
+    def text_file(self, size: int) -> str:
+        path = os.path.join(self.tmp_dir, f'requirements_{size}.txt')
+        if not os.path.exists(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(requirements_text(size))
+        return path
+
+    def cleanup(self):
+        for name in os.listdir(self.tmp_dir):
+            os.remove(os.path.join(self.tmp_dir, name))
+        os.rmdir(self.tmp_dir)
+
+
+def measure(func, arg, max_runs: int) -> dict:
+    """Median wall time over up to max_runs runs, then peak traced memory of one run"""
+    times = []
+    budget_end = time.perf_counter() + TIME_BUDGET_SECONDS
+    for _ in range(max_runs):
+        start = time.perf_counter()
+        func(arg)
+        times.append(time.perf_counter() - start)
+        if time.perf_counter() > budget_end:
+            break
+
+    tracemalloc.start()
+    try:
+        func(arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'seconds': statistics.median(times),
+        'min_seconds': min(times),
+        'runs': len(times),
+        'peak_kb': round(peak / 1024, 1)
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Return the measurements that got slower or use more memory than the baseline allows"""
+    regressions = []
+    for name, sizes in results.items():
+        for size, current in sizes.items():
+            previous = baseline.get(name, {}).get(size)
+            if not previous:
+                continue
+            for metric in ('seconds', 'peak_kb'):
+                # Ignore noise on measurements too small to matter
+                floor = 1e-4 if metric == 'seconds' else 16
+                if current[metric] > max(previous[metric], floor) * (1 + threshold):
+                    regressions.append({
+                        'function': name,
+                        'size': size,
+                        'metric': metric,
+                        'baseline': previous[metric],
+                        'current': current[metric],
+                        'change': round(current[metric] / max(previous[metric], floor) - 1, 3)
+                    })
+    return regressions
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.0f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.1f}ms"
+    return f"{seconds:.2f}s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='*', default=list(SIZES), choices=list(SIZES))
+    parser.add_argument('--only', nargs='*', help='Benchmark only these functions')
+    parser.add_argument('--runs', type=int, default=7, help='Maximum timed runs per function and size')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Relative increase over the baseline that counts as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 on regressions')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    benchmarks = Benchmarks()
+    cases = benchmarks.cases()
+    if args.only:
+        unknown = set(args.only) - set(cases)
+        if unknown:
+            parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}. Available: {', '.join(cases)}")
+        cases = {name: case for name, case in cases.items() if name in args.only}
+
+    results = {}
+    print(f"{'function':<26}{'size':>7}{'median':>10}{'runs':>6}{'peak mem':>12}")
+    try:
+        for name, (build_input, func) in cases.items():
+            results[name] = {}
+            for size_name in args.sizes:
+                arg = build_input(SIZES[size_name])
+                result = measure(func, arg, args.runs)
+                results[name][size_name] = result
+                print(f"{name:<26}{size_name:>7}{format_seconds(result['seconds']):>10}{result['runs']:>6}"
+                      f"{result['peak_kb']:>10.0f}KB")
+    finally:
+        benchmarks.cleanup()
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.threshold)
+        if regressions:
+            print(f"\nRegressions against {args.baseline} (threshold {args.threshold:.0%}):")
+            for r in regressions:
+                print(f"  {r['function']} {r['size']} {r['metric']}: {r['baseline']} -> {r['current']} (+{r['change']:.0%})")
+        else:
+            print(f"\nNo regressions against {args.baseline}")
+
+    document = {'timestamp': time.time(), 'python': sys.version.split()[0], 'results': results}
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({**document, 'regressions': regressions}, f, indent=2)
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
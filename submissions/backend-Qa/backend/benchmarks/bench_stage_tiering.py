@@ -0,0 +1,173 @@
+"""
+Offline evaluation of per-stage model assignments in the Gherkin pipeline.
+
+Every configuration maps pipeline stages (header, scenarios, edge_cases,
+improve) to models, in the GHERKIN_STAGE_MODELS format. For each one the
+fixture requirements are run through TestGeneratorAgent.generate_gherkin on
+the offline model provider, with each model's latency and response length
+taken from the fixture profiles, and the suite reports per stage:
+
+    latency    median seconds of the stage's model call
+    tokens     mean output tokens of the stage
+
+and per configuration the median end-to-end latency, the mean output tokens
+of all stages, the structural quality score of the final feature
+(utils.quality_gate.score_gherkin, 0-100), the share of features passing
+every quality check and the share of requests that needed an improve pass.
+
+The offline provider writes synthetic Gherkin, so quality numbers show
+whether a configuration keeps the structure intact (scenario count, step
+completeness, tags, negative scenarios), not how good a hosted model's
+wording is. Profiles in the fixture can be replaced with measured ones.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_stage_tiering
+    python -m benchmarks.bench_stage_tiering --runs 3 --only uniform_70b tiered --output results/tiering.json
+    python -m benchmarks.bench_stage_tiering --fixture my_fixture.json
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+# Models are simulated and responses must not come from the cache of an earlier run
+os.environ['MODEL_PROVIDER'] = 'offline'
+os.environ['LLM_CACHE_ENABLED'] = 'false'
+
+from agents.test_generator_agent import TestGeneratorAgent
+from utils.quality_gate import score_gherkin
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FIXTURE = os.path.join(BENCHMARK_DIR, 'fixtures', 'stage_tiering.json')
+
+STAGES = TestGeneratorAgent.PARALLEL_STAGES + ('improve',)
+
+
+def build_agent(configuration: dict) -> TestGeneratorAgent:
+    """Create a TestGeneratorAgent whose stages use the models of one configuration"""
+    os.environ['GHERKIN_STAGE_MODELS'] = json.dumps(configuration)
+    try:
+        agent = TestGeneratorAgent()
+    finally:
+        del os.environ['GHERKIN_STAGE_MODELS']
+    if not agent.agent:
+        raise RuntimeError('TestGeneratorAgent failed to initialize')
+    return agent
+
+
+def evaluate(agent: TestGeneratorAgent, requirements: list, runs: int) -> dict:
+    """Run every requirement runs times and collect stage timings, tokens and quality"""
+    stage_seconds = {name: [] for name in STAGES}
+    stage_tokens = {name: [] for name in STAGES}
+    totals = []
+    output_tokens = []
+    scores = []
+    passed = 0
+    improved = 0
+    requests = 0
+    for run in range(runs):
+        for number, requirement in enumerate(requirements):
+            start = time.perf_counter()
+            result = agent.generate_gherkin({
+                'requirement': requirement,
+                'featureName': f'tiering_{run}_{number}',
+                'iterations': 1
+            })
+            totals.append(time.perf_counter() - start)
+            if result.get('status') != 'success' or 'token_debug' not in result:
+                raise RuntimeError(f"Unexpected result: {result.get('message')}")
+
+            stages = result['token_debug']['stages']
+            for stage in stages:
+                stage_seconds[stage['name']].append(stage['seconds'])
+                stage_tokens[stage['name']].append(stage['tokens'])
+            output_tokens.append(sum(stage['tokens'] for stage in stages))
+            improved += any(stage['name'] == 'improve' for stage in stages)
+
+            report = score_gherkin(result['content'])
+            scores.append(report.score)
+            passed += report.passed
+            requests += 1
+
+    return {
+        'models': agent.stage_models,
+        'stages': {
+            name: {
+                'model': agent.stage_models[name],
+                'calls': len(stage_seconds[name]),
+                'median_seconds': round(statistics.median(stage_seconds[name]), 3) if stage_seconds[name] else None,
+                'mean_tokens': round(statistics.mean(stage_tokens[name]), 1) if stage_tokens[name] else None
+            }
+            for name in STAGES
+        },
+        'requests': requests,
+        'median_seconds': round(statistics.median(totals), 3),
+        'mean_output_tokens': round(statistics.mean(output_tokens), 1),
+        'mean_quality_score': round(statistics.mean(scores), 1),
+        'quality_pass_rate': round(passed / requests, 3),
+        'improve_rate': round(improved / requests, 3)
+    }
+
+
+def print_results(results: dict) -> None:
+    for label, result in results.items():
+        print(f"\n{label}: median {result['median_seconds']:.3f}s, {result['mean_output_tokens']} output tokens, "
+              f"quality {result['mean_quality_score']} (pass rate {result['quality_pass_rate']:.0%}), "
+              f"improve rate {result['improve_rate']:.0%}")
+        for name, stage in result['stages'].items():
+            if not stage['calls']:
+                print(f"  {name:>10}: {stage['model']} (not run)")
+                continue
+            print(f"  {name:>10}: {stage['model']:<32} median {stage['median_seconds']:.3f}s  "
+                  f"{stage['mean_tokens']} tokens  ({stage['calls']} calls)")
+
+    labels = list(results)
+    if len(labels) > 1:
+        baseline = results[labels[0]]
+        print(f"\nCompared with {labels[0]}:")
+        for label in labels[1:]:
+            result = results[label]
+            print(f"  {label}: latency {result['median_seconds'] / baseline['median_seconds']:.2f}x, "
+                  f"output tokens {result['mean_output_tokens'] / baseline['mean_output_tokens']:.2f}x, "
+                  f"quality {result['mean_quality_score'] - baseline['mean_quality_score']:+.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixture', default=DEFAULT_FIXTURE, help='JSON with profiles, configurations and requirements')
+    parser.add_argument('--runs', type=int, default=1, help='Passes over the fixture requirements per configuration')
+    parser.add_argument('--only', nargs='+', help='Configurations to evaluate (default: all in the fixture)')
+    parser.add_argument('--output', help='Write the results as JSON to this path')
+    args = parser.parse_args()
+
+    with open(args.fixture) as f:
+        fixture = json.load(f)
+    configurations = fixture['configurations']
+    if args.only:
+        unknown = [label for label in args.only if label not in configurations]
+        if unknown:
+            parser.error(f"Unknown configuration(s): {', '.join(unknown)}. Available: {', '.join(configurations)}")
+        configurations = {label: configurations[label] for label in args.only}
+
+    os.environ['OFFLINE_MODEL_PROFILES'] = json.dumps(fixture.get('profiles', {}))
+    output_path = os.path.abspath(args.output) if args.output else None
+
+    # generate_gherkin writes feature files relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='bench_tiering_'))
+
+    results = {}
+    for label, configuration in configurations.items():
+        results[label] = evaluate(build_agent(configuration), fixture['requirements'], args.runs)
+    print_results(results)
+
+    if output_path:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        with open(output_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark cold-start cost of the API: time to import main:app and the
+resident memory of the process afterwards.
+
+Each measurement runs in a fresh interpreter. Two modes are compared:
+
+    lazy   - the default; agents are built on the first request for their agentType
+    eager  - every agent is built at startup (AGENT_PREWARM=all), which is what
+             importing main:app used to cost
+
+For lazy mode the cost of the first request's agent construction is reported
+separately for each agent type given with --first-use.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_startup --runs 3 --first-use chat gherkin
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('agno', 'openai', 'tiktoken', 'pandas', 'groq')
+
+# Runs inside the child interpreter and prints one JSON line
+CHILD_SCRIPT = r'''
+import json, sys, time
+
+def rss_mb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+mode, first_use = sys.argv[1], [t for t in sys.argv[2].split(',') if t]
+result = {'rss_before_mb': rss_mb()}
+
+start = time.perf_counter()
+import main
+if mode == 'eager':
+    main.agent_router.prewarm('all')
+result['import_seconds'] = time.perf_counter() - start
+result['rss_mb'] = rss_mb()
+result['heavy_modules'] = sorted(m for m in HEAVY_MODULES if m in sys.modules)
+
+result['first_use'] = {}
+for agent_type in first_use:
+    start = time.perf_counter()
+    main.agent_router.prewarm([agent_type])
+    result['first_use'][agent_type] = {
+        'seconds': time.perf_counter() - start,
+        'rss_mb': rss_mb()
+    }
+
+print('RESULT ' + json.dumps(result))
+'''
+
+
+def run_child(mode: str, first_use: list) -> dict:
+    """Start a fresh interpreter, import main:app and return its measurements"""
+    env = dict(os.environ, AGENT_PREWARM='')
+    script = f'HEAVY_MODULES = {HEAVY_MODULES!r}\n' + CHILD_SCRIPT
+    output = subprocess.run(
+        [sys.executable, '-c', script, mode, ','.join(first_use)],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True
+    )
+    for line in output.stdout.splitlines():
+        if line.startswith('RESULT '):
+            return json.loads(line[len('RESULT '):])
+    raise RuntimeError(f"Startup run failed:\n{output.stderr[-2000:]}")
+
+
+def summarize(runs: list) -> dict:
+    summary = {
+        'import_seconds': statistics.median(r['import_seconds'] for r in runs),
+        'rss_mb': statistics.median(r['rss_mb'] for r in runs),
+        'heavy_modules': runs[-1]['heavy_modules']
+    }
+    first_use = {}
+    for agent_type in runs[-1]['first_use']:
+        first_use[agent_type] = {
+            'seconds': statistics.median(r['first_use'][agent_type]['seconds'] for r in runs),
+            'rss_mb': statistics.median(r['first_use'][agent_type]['rss_mb'] for r in runs)
+        }
+    if first_use:
+        summary['first_use'] = first_use
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help='Fresh interpreters per mode')
+    parser.add_argument('--first-use', nargs='*', default=['chat', 'gherkin'],
+                        help='Agent types whose first-use construction is timed in lazy mode')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {
+        'lazy': summarize([run_child('lazy', args.first_use) for _ in range(args.runs)]),
+        'eager': summarize([run_child('eager', []) for _ in range(args.runs)])
+    }
+
+    print(f"{'mode':<8}{'import (s)':>12}{'RSS (MB)':>12}  heavy modules loaded")
+    for mode, summary in results.items():
+        print(f"{mode:<8}{summary['import_seconds']:>12.2f}{summary['rss_mb']:>12.1f}  "
+              f"{', '.join(summary['heavy_modules']) or '-'}")
+    for agent_type, cost in results['lazy'].get('first_use', {}).items():
+        print(f"  first {agent_type} request: +{cost['seconds']:.2f}s, RSS {cost['rss_mb']:.1f} MB")
+
+    lazy, eager = results['lazy'], results['eager']
+    print(f"Startup time saved: {eager['import_seconds'] - lazy['import_seconds']:.2f}s, "
+          f"memory saved: {eager['rss_mb'] - lazy['rss_mb']:.1f} MB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,351 @@
+"""
+End-to-end load test of the FastAPI service.
+
+Drives /generate and /generate-with-file across the agent types and reports
+throughput, p50/p95/p99 latency, error and timeout rates, plus thread pool
+saturation and RSS of the server over time (sampled from /metrics).
+
+By default a local server is started with the offline model provider
+(MODEL_PROVIDER=offline) and the response cache disabled, so results
+reflect the service itself rather than network or API quota. Files written
+by the server for load test requests are removed afterwards.
+
+Load models:
+    --concurrency N   closed loop: N clients, each sending its next request as
+                      soon as the previous one finished
+    --rate R          open loop: requests arrive at R per second (Poisson),
+                      regardless of how many are still in flight
+
+Usage (from the backend directory):
+    python -m benchmarks.load_test --concurrency 8 --duration 60 --output results/load.json
+    python -m benchmarks.load_test --rate 2 --duration 120 --agents gherkin chat
+    python -m benchmarks.load_test --url http://localhost:8000 --concurrency 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+AGENT_TYPES = ('gherkin', 'selenium', 'playwright', 'cypress', 'behave', 'chat', 'manual_testcases', 'manual_planning')
+
+# Directories the server writes generated files to, keyed by file extension
+OUTPUT_DIRS = {'.feature': 'features', '.py': 'features', '.csv': 'test_cases'}
+
+USER_STORIES = (
+    "As a shopper I want to apply a discount coupon at checkout so that I pay less for my order",
+    "As a registered user I want to reset my password by email so that I can regain access to my account",
+    "As an administrator I want to deactivate user accounts so that former employees cannot log in",
+    "As a customer I want to track my delivery status so that I know when my package arrives",
+    "As a visitor I want to search products by category and price so that I find items quickly",
+    "As an editor I want to schedule article publication so that content goes live at the right time"
+)
+
+
+def percentile(values: list, pct: float):
+    """Nearest-rank percentile of values, None when there are none"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def build_requirement(agent_type: str, number: int, rng: random.Random) -> str:
+    story = rng.choice(USER_STORIES)
+    if agent_type in ('selenium', 'playwright', 'cypress', 'behave'):
+        return f"Create a test script for this scenario ({number}): {story}"
+    return f"{story} (load test request {number})"
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.results = []
+        self.samples = []
+        self.in_flight = 0
+        self.sent = 0
+        self.generated_files = set()
+        self.started = None
+
+    def next_request(self):
+        """Pick the endpoint, agent type and payload of the next request"""
+        self.sent += 1
+        agent_type = self.rng.choice(self.args.agents)
+        endpoint = '/generate-with-file' if self.rng.random() < self.args.file_ratio else '/generate'
+        payload = {
+            'requirement': build_requirement(agent_type, self.sent, self.rng),
+            'agentType': agent_type,
+            'bypassCache': not self.args.use_cache
+        }
+        return endpoint, agent_type, payload
+
+    async def send(self, client: httpx.AsyncClient):
+        endpoint, agent_type, payload = self.next_request()
+        result = {'endpoint': endpoint, 'agentType': agent_type, 'start': time.perf_counter() - self.started}
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            if endpoint == '/generate':
+                response = await client.post(endpoint, json=payload)
+            else:
+                requirement = payload.pop('requirement')
+                form = {key: str(value).lower() if isinstance(value, bool) else value for key, value in payload.items()}
+                form['chunkInput'] = 'false'
+                files = {'file': (f'stories_{self.sent}.txt', requirement.encode('utf-8'), 'text/plain')}
+                response = await client.post(endpoint, data=form, files=files)
+
+            result['status_code'] = response.status_code
+            result['ok'] = response.status_code == 200
+            result['timeout'] = response.status_code == 408
+            try:
+                filename = response.json().get('filename')
+                if filename:
+                    self.generated_files.add(filename)
+            except ValueError:
+                pass
+        except httpx.TimeoutException:
+            result.update({'status_code': None, 'ok': False, 'timeout': True})
+        except httpx.HTTPError as e:
+            result.update({'status_code': None, 'ok': False, 'timeout': False, 'error': str(e)})
+        finally:
+            self.in_flight -= 1
+        result['latency'] = time.perf_counter() - start
+        self.results.append(result)
+
+    async def closed_loop(self, client: httpx.AsyncClient, deadline: float):
+        async def worker():
+            while time.perf_counter() < deadline and not self.limit_reached():
+                await self.send(client)
+
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+
+    async def open_loop(self, client: httpx.AsyncClient, deadline: float):
+        tasks = []
+        while time.perf_counter() < deadline and not self.limit_reached():
+            tasks.append(asyncio.create_task(self.send(client)))
+            await asyncio.sleep(self.rng.expovariate(self.args.rate))
+        await asyncio.gather(*tasks)
+
+    def limit_reached(self) -> bool:
+        return bool(self.args.requests) and self.sent >= self.args.requests
+
+    async def sample_metrics(self, client: httpx.AsyncClient, stop: asyncio.Event):
+        """Record server thread pool and memory usage every sample interval"""
+        while not stop.is_set():
+            sample = {'t': round(time.perf_counter() - self.started, 2), 'in_flight': self.in_flight}
+            try:
+                snapshot = (await client.get('/metrics', timeout=5)).json()
+                sample['thread_pool'] = snapshot.get('thread_pool')
+                sample['rss_mb'] = (snapshot.get('process') or {}).get('rss_mb')
+            except (httpx.HTTPError, ValueError) as e:
+                sample['error'] = str(e)
+            self.samples.append(sample)
+            try:
+                await asyncio.wait_for(stop.wait(), self.args.sample_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self) -> dict:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(base_url=self.args.url, timeout=self.args.timeout, limits=limits) as client:
+            self.started = time.perf_counter()
+            deadline = self.started + self.args.duration
+            stop = asyncio.Event()
+            sampler = asyncio.create_task(self.sample_metrics(client, stop))
+            if self.args.rate:
+                await self.open_loop(client, deadline)
+            else:
+                await self.closed_loop(client, deadline)
+            elapsed = time.perf_counter() - self.started
+            stop.set()
+            await sampler
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> dict:
+        def summarize(results: list) -> dict:
+            latencies = [r['latency'] for r in results if r['ok']]
+            count = len(results)
+            return {
+                'requests': count,
+                'succeeded': len(latencies),
+                'throughput_rps': round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+                'error_rate': round(1 - len(latencies) / count, 4) if count else 0.0,
+                'timeout_rate': round(sum(1 for r in results if r['timeout']) / count, 4) if count else 0.0,
+                'latency_seconds': {
+                    'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+                    'p50': percentile(latencies, 50),
+                    'p95': percentile(latencies, 95),
+                    'p99': percentile(latencies, 99),
+                    'max': max(latencies) if latencies else None
+                },
+                'status_codes': {
+                    str(code): sum(1 for r in results if r['status_code'] == code)
+                    for code in sorted({r['status_code'] for r in results}, key=str)
+                }
+            }
+
+        by_group = {}
+        for result in self.results:
+            by_group.setdefault(f"{result['endpoint']} {result['agentType']}", []).append(result)
+
+        pools = [s['thread_pool'] for s in self.samples if s.get('thread_pool')]
+        rss = [s['rss_mb'] for s in self.samples if s.get('rss_mb') is not None]
+        return {
+            'duration_seconds': round(elapsed, 2),
+            'overall': summarize(self.results),
+            'by_endpoint_and_agent': {group: summarize(results) for group, results in sorted(by_group.items())},
+            'thread_pool': {
+                'max_workers': pools[-1]['max_workers'] if pools else None,
+                'peak_saturation': max((p['saturation'] for p in pools), default=None),
+                'peak_queued': max((p['peak_queued'] for p in pools), default=None),
+                'mean_saturation': round(sum(p['saturation'] for p in pools) / len(pools), 3) if pools else None
+            },
+            'rss_mb': {
+                'start': rss[0] if rss else None,
+                'end': rss[-1] if rss else None,
+                'peak': max(rss) if rss else None
+            },
+            'timeline': self.samples
+        }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args):
+    """Start uvicorn with main:app on a free port and wait until it answers"""
+    port = free_port()
+    env = dict(os.environ)
+    env.setdefault('MODEL_PROVIDER', args.provider)
+    if not args.use_cache:
+        env['LLM_CACHE_ENABLED'] = 'false'
+    if args.server_env:
+        env.update(dict(item.split('=', 1) for item in args.server_env))
+
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL if not args.server_output else None,
+        stderr=subprocess.DEVNULL if not args.server_output else None
+    )
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('Server exited during startup; rerun with --server-output to see why')
+        try:
+            if httpx.get(url + '/', timeout=1).status_code == 200:
+                return server, url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('Server did not start within 60 seconds')
+
+
+def remove_generated_files(filenames: set) -> int:
+    """Delete the files the server generated for load test requests"""
+    removed = 0
+    for filename in filenames:
+        directory = OUTPUT_DIRS.get(os.path.splitext(filename)[1])
+        path = os.path.join(BACKEND_DIR, directory, os.path.basename(filename)) if directory else None
+        if path and os.path.isfile(path):
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def print_report(report: dict):
+    overall = report['overall']
+    latency = overall['latency_seconds']
+
+    def fmt(value):
+        return f"{value:.2f}s" if value is not None else '-'
+
+    print(f"Requests: {overall['requests']} in {report['duration_seconds']}s, "
+          f"throughput {overall['throughput_rps']} req/s")
+    print(f"Latency p50 {fmt(latency['p50'])}, p95 {fmt(latency['p95'])}, p99 {fmt(latency['p99'])}")
+    print(f"Error rate {overall['error_rate']:.2%}, timeout rate {overall['timeout_rate']:.2%}")
+    pool = report['thread_pool']
+    if pool['max_workers']:
+        print(f"Thread pool: {pool['max_workers']} workers, peak saturation {pool['peak_saturation']:.0%}, "
+              f"peak queued {pool['peak_queued']}")
+    rss = report['rss_mb']
+    if rss['peak'] is not None:
+        print(f"RSS: {rss['start']} MB -> {rss['end']} MB (peak {rss['peak']} MB)")
+
+    print(f"\n{'endpoint / agent':<42}{'reqs':>6}{'ok':>6}{'p50':>8}{'p95':>8}{'p99':>8}")
+    for group, summary in report['by_endpoint_and_agent'].items():
+        latency = summary['latency_seconds']
+        print(f"{group:<42}{summary['requests']:>6}{summary['succeeded']:>6}"
+              f"{fmt(latency['p50']):>8}{fmt(latency['p95']):>8}{fmt(latency['p99']):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Test a running server instead of starting one')
+    parser.add_argument('--provider', default='offline', help='MODEL_PROVIDER for the started server')
+    parser.add_argument('--server-env', nargs='*', metavar='NAME=VALUE', help='Extra environment for the started server')
+    parser.add_argument('--server-output', action='store_true', help='Show the started server\'s output')
+    parser.add_argument('--concurrency', type=int, default=4, help='Clients in the closed-loop model')
+    parser.add_argument('--rate', type=float, help='Arrival rate per second; switches to the open-loop model')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to generate load for')
+    parser.add_argument('--requests', type=int, help='Stop after this many requests')
+    parser.add_argument('--timeout', type=float, default=120, help='Client timeout per request in seconds')
+    parser.add_argument('--agents', nargs='*', default=list(AGENT_TYPES), choices=AGENT_TYPES)
+    parser.add_argument('--file-ratio', type=float, default=0.2, help='Fraction of requests sent to /generate-with-file')
+    parser.add_argument('--use-cache', action='store_true', help='Let the server answer from the LLM response cache')
+    parser.add_argument('--sample-interval', type=float, default=1.0, help='Seconds between /metrics samples')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep-outputs', action='store_true', help='Keep the files the server generated')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    server = None
+    if not args.url:
+        server, args.url = start_server(args)
+        print(f"Started server at {args.url} (MODEL_PROVIDER={os.getenv('MODEL_PROVIDER', args.provider)})")
+
+    load_test = LoadTest(args)
+    try:
+        report = asyncio.run(load_test.run())
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+            if not args.keep_outputs:
+                remove_generated_files(load_test.generated_files)
+
+    print_report(report)
+
+    if args.output:
+        config = {key: value for key, value in vars(args).items() if key != 'output'}
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'commit': git_commit(), 'timestamp': time.time(), 'config': config, 'results': report}, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
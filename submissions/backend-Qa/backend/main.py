@@ -1,17 +1,32 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
 from pydantic import BaseModel
-from agents.agent_router import AgentRouter
+from agents.agent_router import AgentRouter, AGENT_TYPES
 import uvicorn
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Awaitable, Callable, Tuple
 import asyncio
 from concurrent.futures import TimeoutError
 import os
+import json
+import threading
+import time
 import traceback
 import shutil
-import re
 from utils.file_processor import extract_text_from_file
+from utils.chunk_scheduler import process_chunks
+from utils.text_chunker import chunk_text, CHARS_PER_TOKEN
+from utils.gherkin_merge import merge_feature_files
+from utils.chunk_store import get_chunk_store, make_chunk_key
+from utils.request_context import request_scope
+from utils.cancellation import CancellationToken, current_token
+from utils.circuit_breaker import mark_degraded_result
+from utils.quality_gate import quality_gate, score_gherkin
+from utils.llm_cache import get_response_cache
+from utils.metrics import metrics
+from utils.admission import AdmissionRejected, get_admission_controller
+from utils.job_queue import JobManager, JobQueueFullError, FINISHED_STATES
+from utils.thread_pool import InstrumentedThreadPoolExecutor, get_process_stats
 
 app = FastAPI()
 
@@ -35,269 +50,605 @@ class GenerateRequest(BaseModel):
     iterations: Optional[int] = 2
     chunkInput: Optional[bool] = False
     chunkSize: Optional[int] = 4000  # Default chunk size in characters
+    chunkTokens: Optional[int] = None  # Token budget per chunk (defaults to chunkSize / 4)
+    maxConcurrentChunks: Optional[int] = None  # Chunks processed in parallel (defaults to CHUNK_MAX_IN_FLIGHT)
+    requestTimeout: Optional[float] = None  # Overall deadline in seconds for chunked requests
+    bypassCache: Optional[bool] = False  # Skip the LLM response cache lookup for this request
+    incremental: Optional[bool] = True  # Reuse stored results of chunks that did not change since an earlier request
+    sourceFile: Optional[str] = None  # Name of the uploaded file; identifies revisions of the same document
+    improveMerged: Optional[bool] = False  # Gherkin chunks: one improve pass over the merged feature instead of one per chunk
+    structuredOutput: Optional[bool] = None  # Manual test cases: JSON output validated per case (defaults to MANUAL_TESTCASE_STRUCTURED_OUTPUT)
+
+# Chunked generation settings
+CHUNK_MAX_IN_FLIGHT = int(os.getenv('CHUNK_MAX_IN_FLIGHT', 4))
+CHUNK_TIMEOUT_SECONDS = float(os.getenv('CHUNK_TIMEOUT_SECONDS', 60))
+GENERATE_DEADLINE_SECONDS = float(os.getenv('GENERATE_DEADLINE_SECONDS', 300))
+
+# Background job settings
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_MAX_QUEUED = int(os.getenv('JOB_MAX_QUEUED', 100))
+JOB_RETENTION = int(os.getenv('JOB_RETENTION', 500))
+JOB_TIMEOUT_SECONDS = float(os.getenv('JOB_TIMEOUT_SECONDS', 1800))
+
+# Worker threads behind asyncio.to_thread, i.e. agent calls running at the same time
+THREAD_POOL_WORKERS = int(os.getenv('THREAD_POOL_WORKERS', min(32, (os.cpu_count() or 1) + 4)))
+
+# How often a waiting /generate request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = float(os.getenv('DISCONNECT_POLL_SECONDS', 1.0))
+
+# Run router requests natively on the event loop (agent.arun) instead of one worker thread per request
+ASYNC_AGENTS = os.getenv('ASYNC_AGENTS', 'true').lower() not in ('0', 'false', 'no')
+
+# Agents are built on first use; list agent types here (or 'all') to build them at startup instead
+AGENT_PREWARM = os.getenv('AGENT_PREWARM', '')
 
 # Initialize agent router
 agent_router = AgentRouter()
+metrics.register_collector('agents', agent_router.loaded_agents)
+if agent_router.singleflight is not None:
+    metrics.register_collector('request_coalescing', agent_router.singleflight.get_stats)
+metrics.register_collector('process', get_process_stats)
 
-def chunk_text_by_sections(text: str, max_chunk_size: int = 4000) -> List[str]:
-    """Split text into chunks by sections or headers"""
-    # Try to split by common section headers in requirements docs
-    section_patterns = [
-        r'#+\s+[\w\s]+',  # Markdown headers (# Header, ## Subheader)
-        r'\d+\.\s+[\w\s]+',  # Numbered sections (1. Section)
-        r'[A-Z][\w\s]+:',  # Title case sections with colon (Requirements:)
-        r'\*\*[\w\s]+\*\*',  # Bold sections (**Section**)
-        r'\n\n'  # Double newlines as fallback
-    ]
-    
-    # If text is small enough, return as is
-    if len(text) <= max_chunk_size:
-        return [text]
-    
-    chunks = []
-    for pattern in section_patterns:
-        # Try to split by current pattern
-        if re.search(pattern, text):
-            sections = re.split(f'({pattern})', text)
-            current_chunk = ""
-            
-            # Reconstruct sections with their headers
-            i = 0
-            while i < len(sections):
-                section_text = sections[i]
-                
-                # If this is a header pattern match
-                if i + 1 < len(sections) and re.match(pattern, sections[i+1]):
-                    header = sections[i+1]
-                    i += 2  # Skip the header in next iteration
-                    
-                    # If adding this section would exceed chunk size, save current chunk and start new one
-                    if len(current_chunk) + len(section_text) + len(header) > max_chunk_size:
-                        if current_chunk:  # Only add if not empty
-                            chunks.append(current_chunk)
-                        current_chunk = header + section_text
-                    else:
-                        current_chunk += section_text + header
-                else:
-                    # If adding this section would exceed chunk size, save current chunk and start new one
-                    if len(current_chunk) + len(section_text) > max_chunk_size:
-                        if current_chunk:  # Only add if not empty
-                            chunks.append(current_chunk)
-                        
-                        # If the section itself is too large, split it further
-                        if len(section_text) > max_chunk_size:
-                            # Simple character-based chunking as fallback
-                            for j in range(0, len(section_text), max_chunk_size):
-                                chunks.append(section_text[j:j+max_chunk_size])
-                            current_chunk = ""
-                        else:
-                            current_chunk = section_text
-                    else:
-                        current_chunk += section_text
-                    
-                    i += 1
-            
-            # Add the last chunk if not empty
-            if current_chunk:
-                chunks.append(current_chunk)
-                
-            # If we successfully chunked the text, return the chunks
-            if chunks:
-                return chunks
-    
-    # Fallback: simple character-based chunking
-    return [text[i:i+max_chunk_size] for i in range(0, len(text), max_chunk_size)]
+# Open the shared LLM response cache up front so its stats show up in /metrics
+get_response_cache()
 
-@app.post("/generate")
-async def generate(request: GenerateRequest):
+# Bounds the /generate work per agent; None when ADMISSION_CONTROL_ENABLED is false
+admission = get_admission_controller()
+
+def admission_agent(request_data: dict) -> Optional[str]:
+    """Agent whose admission slots a request takes, or None if it is not admission controlled"""
+    if admission is None:
+        return None
+    return AGENT_TYPES.get((request_data.get('agentType') or '').lower())
+
+def rejected_response(error: AdmissionRejected) -> JSONResponse:
+    """429 response for a request turned away by admission control"""
+    print(f"Admission rejected: {str(error)}")
+    return JSONResponse(
+        status_code=429,
+        content={'status': 'error', 'message': str(error), 'retry_after': error.retry_after,
+                 'admission_rejected': True},
+        headers={'Retry-After': str(int(error.retry_after) + 1)}
+    )
+
+async def merge_gherkin_chunks(all_content: List[str], request_data: dict, token_debug_info: dict) -> str:
+    """
+    Merge the feature files of all chunks into one and optionally improve it once.
+    
+    Args:
+        all_content: Gherkin content of the successful chunks, in chunk order
+        request_data: Original request data
+        token_debug_info: Aggregated token debug info; gets a 'merge' entry
+        
+    Returns:
+        The merged (and possibly improved) feature file content
+    """
+    merged = merge_feature_files(all_content)
+    token_debug_info['merge'] = merged.to_dict()
+    print(f"Merged {merged.documents} chunk features into {merged.scenarios} scenarios, "
+          f"dropped {merged.duplicate_scenarios} duplicates")
+    content = merged.content
+    
+    if not request_data.get('improveMerged'):
+        return content
+    
+    # The merged feature may already meet the quality thresholds without another pass
+    token_debug_info['merge']['quality'] = quality_gate(score_gherkin(content))
+    if token_debug_info['merge']['quality']['decision'] == 'skip_improve':
+        token_debug_info['merge']['improved'] = False
+        return content
+    
+    generator = agent_router.test_generator
+    
+    improve_token = CancellationToken(parent=current_token())
+    
+    def improve():
+        with request_scope(bypass_cache=bool(request_data.get('bypassCache', False)), cancel_token=improve_token):
+            # The merged feature already covers the requirement, which may be far
+            # larger than the model's context, so it is not repeated in the prompt
+            return generator.evaluate_and_improve(content)
+    
+    async def aimprove():
+        with request_scope(bypass_cache=bool(request_data.get('bypassCache', False)), cancel_token=improve_token):
+            return await generator.aevaluate_and_improve(content)
+    
+    start_time = time.time()
     try:
-        print(f"Received request: {request}")
-        request_data = request.dict()
+        improved = await asyncio.wait_for(aimprove() if ASYNC_AGENTS else asyncio.to_thread(improve),
+                                          timeout=CHUNK_TIMEOUT_SECONDS)
+    except TimeoutError:
+        improve_token.cancel('improve pass timed out')
+        print("Improve pass over the merged feature timed out, keeping the merged feature")
+        token_debug_info['merge']['improved'] = False
+        return content
+    
+    token_debug_info['merge']['improved'] = improved != content
+    token_debug_info['merge']['improve_seconds'] = round(time.time() - start_time, 3)
+    if improved == content or not improved.strip():
+        return content
+    token_debug_info['merge']['improved_tokens'] = generator.count_tokens(improved)
+    return generator.format_gherkin(improved)
+
+async def run_generation(request_data: dict, timeout: Optional[float] = 60.0,
+                         deadline: Optional[float] = GENERATE_DEADLINE_SECONDS,
+                         on_progress: Optional[Callable[[dict], None]] = None) -> Tuple[int, dict]:
+    """
+    Run a generation request through the agents, chunking large inputs if requested
+    
+    The agents stop between model calls once the request times out or the
+    caller is cancelled (client disconnected, job cancelled), see utils.cancellation.
+    
+    Args:
+        request_data: Generation request (same fields as GenerateRequest)
+        timeout: Timeout in seconds for a non-chunked request (None for no limit)
+        deadline: Overall deadline in seconds for all chunks of a chunked request
+        on_progress: Optional callback receiving {'done', 'failed', 'total'} as work completes
+        
+    Returns:
+        Tuple of (HTTP status code, response payload)
+    """
+    cancel_token = CancellationToken(parent=current_token())
+    with request_scope(cancel_token=cancel_token):
+        try:
+            return await _run_generation(request_data, timeout, deadline, on_progress)
+        except asyncio.CancelledError:
+            # Worker threads are not interrupted by the task's cancellation
+            cancel_token.cancel('request cancelled')
+            raise
+
+async def _run_generation(request_data: dict, timeout: Optional[float], deadline: Optional[float],
+                          on_progress: Optional[Callable[[dict], None]]) -> Tuple[int, dict]:
+    """Body of run_generation, inside the request's cancellation scope"""
+    def report_progress(progress):
+        if on_progress:
+            on_progress(dict(progress))
+    
+    # Check if input should be chunked
+    should_chunk = request_data.get('chunkInput', False)
+    chunk_size = request_data.get('chunkSize') or 4000
+    chunk_tokens = request_data.get('chunkTokens') or max(int(chunk_size) // CHARS_PER_TOKEN, 1)
+    requirement = request_data.get('requirement', '')
+    
+    # Reuse results of chunks generated before (e.g. for an earlier revision of the same document)
+    chunk_store = get_chunk_store() if should_chunk and request_data.get('incremental', True) else None
+    
+    # Pack the requirement into token budgets; user stories are never split. For
+    # incremental requests every section gets its own chunks, so an edited section
+    # does not move the boundaries of the sections after it
+    text_chunks = chunk_text(requirement, chunk_tokens, section_boundaries=chunk_store is not None) if should_chunk else []
+    
+    # If chunking is enabled and requirement is large, process in chunks
+    if len(text_chunks) > 1:
+        chunks = [chunk.text for chunk in text_chunks]
+        print(f"Split large input ({len(requirement)} chars) into {len(chunks)} chunks of up to {chunk_tokens} tokens")
         
-        # Check if input should be chunked
-        should_chunk = request_data.get('chunkInput', False)
-        chunk_size = request_data.get('chunkSize', 4000)
-        requirement = request_data.get('requirement', '')
+        # Look up chunks whose results are already stored
+        chunk_keys = []
+        stored = {}
+        revision = None
+        if chunk_store is not None:
+            chunk_keys = [make_chunk_key(chunk, request_data) for chunk in chunks]
+            if not request_data.get('bypassCache'):
+                stored = chunk_store.get_many(chunk_keys)
+            document = request_data.get('featureName') or request_data.get('sourceFile')
+            if document:
+                revision = chunk_store.diff_revision(document, chunk_keys)
+        pending = [index for index in range(len(chunks)) if not chunk_keys or chunk_keys[index] not in stored]
         
-        # If chunking is enabled and requirement is large, process in chunks
-        if should_chunk and len(requirement) > chunk_size:
-            print(f"Chunking large input ({len(requirement)} chars) into sections")
-            chunks = chunk_text_by_sections(requirement, chunk_size)
-            print(f"Split into {len(chunks)} chunks")
-            
-            # Process each chunk and aggregate results
-            all_content = []
-            token_debug_info = {
-                'chunks': [],
-                'total_input_tokens': 0,
-                'total_output_tokens': 0,
-                'any_input_truncated': False,
-                'any_output_truncated': False
+        # Process chunks concurrently and aggregate results in original order
+        max_in_flight = request_data.get('maxConcurrentChunks') or CHUNK_MAX_IN_FLIGHT
+        deadline = request_data.get('requestTimeout') or deadline
+        progress = {'done': len(chunks) - len(pending), 'failed': 0, 'total': len(chunks)}
+        report_progress(progress)
+        
+        def on_chunk_done(chunk_result):
+            progress['done'] += 1
+            if chunk_result['status'] != 'success':
+                progress['failed'] += 1
+            report_progress(progress)
+        
+        chunk_results = [None] * len(chunks)
+        for index, key in enumerate(chunk_keys):
+            if key in stored:
+                chunk_results[index] = {'chunk': index + 1, 'status': 'success', 'message': '',
+                                        'response': stored[key], 'seconds': 0.0, 'reused': True}
+        
+        if pending:
+            generated = await process_chunks(
+                [chunks[index] for index in pending],
+                request_data,
+                agent_router.aroute_request if ASYNC_AGENTS else agent_router.route_request,
+                max_in_flight=max_in_flight,
+                chunk_timeout=CHUNK_TIMEOUT_SECONDS,
+                deadline=deadline,
+                on_chunk_done=on_chunk_done,
+                chunk_numbers=[index + 1 for index in pending],
+                total_chunks=len(chunks)
+            )
+            for index, chunk_result in zip(pending, generated):
+                chunk_results[index] = chunk_result
+                # Fallback output of a degraded chunk is regenerated next time instead of reused
+                if (chunk_store is not None and chunk_result['status'] == 'success'
+                        and not chunk_result['response'].get('degraded')):
+                    chunk_store.put(chunk_keys[index], chunk_result['response'], request_data.get('agentType', ''))
+        
+        if chunk_store is not None:
+            metrics.increment('chunks_reused', len(chunks) - len(pending))
+            metrics.increment('chunks_generated', len(pending))
+            if revision is not None:
+                chunk_store.save_revision(revision.document, chunk_keys)
+        
+        all_content = []
+        token_debug_info = {
+            'chunks': [],
+            'chunk_token_budget': chunk_tokens,
+            'total_input_tokens': 0,
+            'total_output_tokens': 0,
+            'any_input_truncated': False,
+            'any_output_truncated': False,
+            'failed_chunks': 0
+        }
+        if chunk_store is not None:
+            token_debug_info['incremental'] = {
+                'reused_chunks': len(chunks) - len(pending),
+                'generated_chunks': len(pending),
+                **(revision.to_dict() if revision is not None else {})
+            }
+        
+        degraded_models = {}
+        for chunk_result in chunk_results:
+            chunk_debug = {
+                'chunk': chunk_result['chunk'],
+                'status': chunk_result['status'],
+                'seconds': chunk_result['seconds'],
+                'requirement_tokens': text_chunks[chunk_result['chunk'] - 1].tokens,
+                'oversized': text_chunks[chunk_result['chunk'] - 1].oversized
             }
+            if chunk_result.get('reused'):
+                chunk_debug['reused'] = True
+            if chunk_result.get('response') and chunk_result['response'].get('degraded'):
+                chunk_debug['degraded'] = True
+                degraded_models.update(chunk_result['response']['degraded_models'])
             
-            for i, chunk in enumerate(chunks):
-                print(f"Processing chunk {i+1}/{len(chunks)} ({len(chunk)} chars)")
-                
-                # Create a copy of the request data with just this chunk
-                chunk_request = request_data.copy()
-                chunk_request['requirement'] = chunk
-                
-                # Add chunk info to the request
-                chunk_request['chunkInfo'] = {
-                    'isChunk': True,
-                    'chunkNumber': i+1,
-                    'totalChunks': len(chunks)
-                }
-                
-                try:
-                    # Call the appropriate agent with timeout for this chunk
-                    chunk_response = await asyncio.wait_for(
-                        asyncio.to_thread(agent_router.route_request, chunk_request),
-                        timeout=60.0
-                    )
-                    
-                    # Skip failed chunks but continue processing
-                    if chunk_response.get('status') != 'success':
-                        print(f"Chunk {i+1} processing failed: {chunk_response.get('message')}")
-                        continue
-                    
-                    # Collect content from this chunk
-                    chunk_content = chunk_response.get('content', '')
-                    all_content.append(chunk_content)
-                    
-                    # Collect token debug info if available
-                    if 'token_debug' in chunk_response:
-                        token_debug = chunk_response['token_debug']
-                        token_debug_info['chunks'].append({
-                            'chunk': i+1,
-                            'input_tokens': token_debug.get('input_tokens', 0),
-                            'output_tokens': token_debug.get('output_tokens', 0),
-                            'input_truncated': token_debug.get('input_truncated', False),
-                            'output_truncated': token_debug.get('output_truncated', False)
-                        })
-                        
-                        # Update aggregated stats
-                        token_debug_info['total_input_tokens'] += token_debug.get('input_tokens', 0)
-                        token_debug_info['total_output_tokens'] += token_debug.get('output_tokens', 0)
-                        token_debug_info['any_input_truncated'] = token_debug_info['any_input_truncated'] or token_debug.get('input_truncated', False)
-                        token_debug_info['any_output_truncated'] = token_debug_info['any_output_truncated'] or token_debug.get('output_truncated', False)
-                        
-                except TimeoutError:
-                    print(f"Chunk {i+1} processing timed out")
-                    continue
-                except Exception as e:
-                    print(f"Error processing chunk {i+1}: {str(e)}")
-                    continue
+            # Report failed chunks instead of silently dropping them
+            if chunk_result['status'] != 'success':
+                chunk_debug['message'] = chunk_result['message']
+                token_debug_info['chunks'].append(chunk_debug)
+                token_debug_info['failed_chunks'] += 1
+                continue
             
-            # If no chunks were processed successfully
-            if not all_content:
-                return JSONResponse(
-                    status_code=500,
-                    content={
-                        'status': 'error',
-                        'message': 'Failed to process any chunks of the input'
-                    }
-                )
+            # Collect content from this chunk
+            chunk_response = chunk_result['response']
+            all_content.append(chunk_response.get('content', ''))
             
-            # Combine all content
-            combined_content = "\n\n".join(all_content)
+            # Collect token debug info if available
+            token_debug = chunk_response.get('token_debug', {})
+            chunk_debug.update({
+                'input_tokens': token_debug.get('input_tokens', 0),
+                'output_tokens': token_debug.get('output_tokens', 0),
+                'input_truncated': token_debug.get('input_truncated', False),
+                'output_truncated': token_debug.get('output_truncated', False)
+            })
+            token_debug_info['chunks'].append(chunk_debug)
             
-            # Save the combined content to a file
-            feature_name = request_data.get('featureName')
-            if not feature_name:
-                feature_name = f"feature_{int(time.time())}.feature"
-            elif not feature_name.endswith('.feature'):
-                feature_name += '.feature'
-                
-            os.makedirs('features', exist_ok=True)
-            feature_file = os.path.join('features', feature_name)
-            with open(feature_file, 'w') as f:
-                f.write(combined_content)
+            # Update aggregated stats
+            token_debug_info['total_input_tokens'] += token_debug.get('input_tokens', 0)
+            token_debug_info['total_output_tokens'] += token_debug.get('output_tokens', 0)
+            token_debug_info['any_input_truncated'] = token_debug_info['any_input_truncated'] or token_debug.get('input_truncated', False)
+            token_debug_info['any_output_truncated'] = token_debug_info['any_output_truncated'] or token_debug.get('output_truncated', False)
+        
+        # If no chunks were processed successfully
+        if not all_content:
+            return 500, {
+                'status': 'error',
+                'message': 'Failed to process any chunks of the input',
+                'token_debug': token_debug_info
+            }
+        
+        # Combine all content
+        if AGENT_TYPES.get((request_data.get('agentType') or '').lower()) == 'test_generator':
+            combined_content = await merge_gherkin_chunks(all_content, request_data, token_debug_info)
+        else:
+            combined_content = "\n\n".join(all_content)
+        
+        # Save the combined content to a file
+        feature_name = request_data.get('featureName')
+        if not feature_name:
+            feature_name = f"feature_{int(time.time())}.feature"
+        elif not feature_name.endswith('.feature'):
+            feature_name += '.feature'
             
-            # Return combined results
-            return JSONResponse(
-                status_code=200,
-                content={
-                    'status': 'success',
-                    'content': combined_content,
-                    'feature_file': feature_file,
-                    'filename': feature_name,
-                    'message': f'Generated from {len(chunks)} chunks of input',
-                    'token_debug': token_debug_info
-                }
-            )
+        os.makedirs('features', exist_ok=True)
+        feature_file = os.path.join('features', feature_name)
+        with open(feature_file, 'w') as f:
+            f.write(combined_content)
         
-        # Process normally if not chunking
-        try:
-            # Call the appropriate agent with timeout
-            response = await asyncio.wait_for(
-                asyncio.to_thread(agent_router.route_request, request_data),
-                timeout=60.0
-            )
-        except TimeoutError:
-            return JSONResponse(
-                status_code=408,
-                content={
-                    'status': 'error',
-                    'message': 'Taking too long to generate. Please try with a simpler request or fewer scenarios.'
-                }
-            )
-        except Exception as e:
-            return JSONResponse(
-                status_code=500,
-                content={
-                    'status': 'error',
-                    'message': f'Unexpected error: {str(e)}'
-                }
-            )
+        # Return combined results
+        return 200, mark_degraded_result({
+            'status': 'success',
+            'content': combined_content,
+            'feature_file': feature_file,
+            'filename': feature_name,
+            'message': f'Generated from {len(all_content)} of {len(chunks)} chunks of input',
+            'token_debug': token_debug_info
+        }, degraded_models)
+    
+    # Process normally if not chunking
+    report_progress({'done': 0, 'failed': 0, 'total': 1})
+    try:
+        # Call the appropriate agent with timeout; model calls waiting for rate
+        # limit budget give up when they could not start before it
+        deadline_at = time.monotonic() + timeout if timeout else None
+        with request_scope(deadline=deadline_at):
+            if ASYNC_AGENTS:
+                routed = agent_router.aroute_request(request_data)
+            else:
+                routed = asyncio.to_thread(agent_router.route_request, request_data)
+            response = await asyncio.wait_for(routed, timeout=timeout)
+    except TimeoutError:
+        current_token().cancel('request timed out')
+        return 408, {
+            'status': 'error',
+            'message': 'Taking too long to generate. Please try with a simpler request or fewer scenarios.'
+        }
+    except Exception as e:
+        return 500, {
+            'status': 'error',
+            'message': f'Unexpected error: {str(e)}'
+        }
 
-        # Handle error from agent
-        if response.get('status') == 'error':
-            return JSONResponse(
-                status_code=400,
-                content={
-                    'status': 'error',
-                    'message': response.get('message', 'Agent returned an error')
-                }
-            )
+    report_progress({'done': 1, 'failed': int(response.get('status') != 'success'), 'total': 1})
+    
+    # Handle error from agent
+    if response.get('status') == 'error':
+        if response.get('too_large'):
+            return 413, {
+                'status': 'error',
+                'message': f"{response.get('message', 'Request too large for the model')}. "
+                           f"Send it with chunkInput: true to split it into chunks that fit."
+            }
+        if response.get('rate_limited'):
+            return 429, {
+                'status': 'error',
+                'message': response.get('message', 'Model rate limit reached'),
+                'retry_after': response.get('retry_after')
+            }
+        if response.get('circuit_open'):
+            return 503, mark_degraded_result({
+                'status': 'error',
+                'message': response.get('message', 'Model temporarily unavailable'),
+                'retry_after': response.get('retry_after')
+            }, response.get('degraded_models'))
+        return 400, {
+            'status': 'error',
+            'message': response.get('message', 'Agent returned an error')
+        }
 
-        # Handle successful response
-        content = response.get('content', '')
-        filename = response.get('filename', '')
-        feature_file = response.get('feature_file', '')
-        message = response.get('message', 'Generated successfully')
+    # Handle successful response
+    content = response.get('content', '')
+    filename = response.get('filename', '')
+    feature_file = response.get('feature_file', '')
+    message = response.get('message', 'Generated successfully')
 
-        # Always return a JSON response with content
-        response_data = {
-            'status': 'success',
-            'content': content,
-            'message': message
-        }
+    # Always return a JSON response with content
+    response_data = {
+        'status': 'success',
+        'content': content,
+        'message': message
+    }
+    
+    # Add filename if a feature file was created
+    if feature_file and os.path.exists(feature_file) and filename:
+        response_data['filename'] = filename
         
-        # Add filename if a feature file was created
-        if feature_file and os.path.exists(feature_file) and filename:
-            response_data['filename'] = filename
-            
-        # Add token debug info if available
-        if 'token_debug' in response:
-            response_data['token_debug'] = response['token_debug']
-            
-        return JSONResponse(
-            status_code=200,
-            content=response_data
-        )
+    # Add token debug info if available
+    if 'token_debug' in response:
+        response_data['token_debug'] = response['token_debug']
+    
+    # Flag output produced while a model was failing or its circuit breaker was open
+    mark_degraded_result(response_data, response.get('degraded_models'))
+        
+    return 200, response_data
+
+async def run_while_connected(http_request: Optional[Request], work: Awaitable[Tuple[int, dict]]) -> Tuple[int, dict]:
+    """
+    Await a generation, cancelling it when the client disconnects first
+    
+    Returns:
+        The generation's (HTTP status code, payload), or 499 if the client went away
+    """
+    task = asyncio.ensure_future(work)
+    if http_request is None:
+        return await task
+    
+    async def watch():
+        while not task.done():
+            if await http_request.is_disconnected():
+                print("Client disconnected, cancelling its generation")
+                metrics.increment('client_disconnects')
+                task.cancel()
+                return
+            await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+    
+    watcher = asyncio.create_task(watch())
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if not watcher.done() or not task.cancelled():
+            raise
+        # Nobody reads this response; 499 is what proxies log for a client that closed the request
+        return 499, {'status': 'error', 'message': 'Client disconnected', 'cancelled': True}
+    finally:
+        watcher.cancel()
+
+@app.post("/generate")
+async def generate(request: GenerateRequest, http_request: Request = None):
+    try:
+        print(f"Received request: {request}")
+        request_data = request.dict()
+        agent = admission_agent(request_data)
+        if agent is not None:
+            try:
+                await admission.acquire(agent)
+            except AdmissionRejected as e:
+                return rejected_response(e)
+        try:
+            status_code, payload = await run_while_connected(http_request, run_generation(request_data))
+        finally:
+            if agent is not None:
+                admission.release(agent)
+        headers = None
+        if status_code in (429, 503) and payload.get('retry_after'):
+            headers = {'Retry-After': str(int(payload['retry_after']) + 1)}
+        return JSONResponse(status_code=status_code, content=payload, headers=headers)
 
     except Exception as e:
         print(f"Exception in generate endpoint: {str(e)}")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail="Internal server error")
 
+def format_sse(event: str, data: dict) -> str:
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/generate/stream")
+async def generate_stream(request: GenerateRequest):
+    """Stream Gherkin, Selenium or manual test case generation as Server-Sent Events"""
+    print(f"Received streaming request: {request}")
+    request_data = request.dict()
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    # Cancelled when the client disconnects, which stops the agent at its next event
+    cancel_token = CancellationToken()
+    agent = admission_agent(request_data)
+    if agent is not None:
+        try:
+            await admission.acquire(agent)
+        except AdmissionRejected as e:
+            return rejected_response(e)
+    
+    def produce():
+        # The agents stream synchronously, so run them on a dedicated thread
+        # and hand each event over to the event loop
+        try:
+            for event, data in agent_router.stream_request(request_data, cancel_token=cancel_token):
+                loop.call_soon_threadsafe(events.put_nowait, (event, data))
+        except Exception as e:
+            traceback.print_exc()
+            loop.call_soon_threadsafe(events.put_nowait, ('error', {'message': f'Unexpected error: {str(e)}'}))
+        finally:
+            loop.call_soon_threadsafe(events.put_nowait, None)
+            # The slot is held while the agent works, until it has stopped after a disconnect
+            if agent is not None:
+                loop.call_soon_threadsafe(admission.release, agent)
+    
+    # Started right away so the admission slot is given back even if the response is never sent
+    threading.Thread(target=produce, daemon=True).start()
+    
+    async def event_stream():
+        finished = False
+        try:
+            while True:
+                item = await events.get()
+                if item is None:
+                    finished = True
+                    break
+                yield format_sse(*item)
+        finally:
+            if not finished:
+                print("Client disconnected, cancelling its stream")
+                metrics.increment('client_disconnects')
+                cancel_token.cancel('client disconnected')
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.on_event("startup")
+async def configure_thread_pool():
+    # Replace the default executor with one that reports its saturation in /metrics
+    executor = InstrumentedThreadPoolExecutor(max_workers=THREAD_POOL_WORKERS, thread_name_prefix='agent')
+    asyncio.get_running_loop().set_default_executor(executor)
+    metrics.register_collector('thread_pool', executor.get_stats)
+
+@app.on_event("startup")
+async def prewarm_agents():
+    if AGENT_PREWARM:
+        # Build the agents off the event loop; the server starts accepting requests once they are ready
+        loaded = await asyncio.to_thread(agent_router.prewarm, AGENT_PREWARM)
+        print(f"Prewarmed agents: {', '.join(loaded) or 'none'}")
+
 @app.get("/")
 async def root():
     return {"message": "QA Test Generation API is running 🚀"}
 
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
+
+def build_file_request(file: UploadFile, form: dict) -> Tuple[Optional[dict], Optional[JSONResponse]]:
+    """
+    Save an uploaded file and build the generation request from its text
+    
+    Args:
+        file: The uploaded requirements file
+        form: The other form fields of the request
+        
+    Returns:
+        Tuple of (request data, None) on success or (None, error response)
+    """
+    print(f"Received file upload: {file.filename}")
+    
+    # Create uploads directory if it doesn't exist
+    os.makedirs("uploads", exist_ok=True)
+    
+    # Save the uploaded file
+    file_path = os.path.join("uploads", file.filename)
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+    
+    # Extract text from the file
+    try:
+        file_text = extract_text_from_file(file_path)
+        if not file_text:
+            return None, JSONResponse(
+                status_code=400,
+                content={
+                    'status': 'error',
+                    'message': f'Could not extract text from file: {file.filename}. Please check the file format.'
+                }
+            )
+            
+        print(f"Extracted {len(file_text)} characters from file")
+    except Exception as e:
+        return None, JSONResponse(
+            status_code=400,
+            content={
+                'status': 'error',
+                'message': f'Error extracting text from file: {str(e)}'
+            }
+        )
+        
+    # Combine file text with any additional requirement text
+    requirement = form.get('requirement')
+    if requirement:
+        combined_requirement = f"{requirement}\n\nFile Content:\n{file_text}"
+    else:
+        # If no additional requirement, just use the file content as the requirement
+        combined_requirement = f"GENERATE GHERKIN FEATURE FILE BASED ON THESE USER STORIES:\n{file_text}"
+    
+    # Validate the combined request the same way as /generate
+    request_data = GenerateRequest(**{**form, 'requirement': combined_requirement, 'sourceFile': file.filename}).dict()
+    return request_data, None
+
 @app.post("/generate-with-file")
 async def generate_with_file(
+    http_request: Request,
     file: UploadFile = File(...),
     agentType: str = Form(...),
     requirement: Optional[str] = Form(None),
@@ -306,70 +657,160 @@ async def generate_with_file(
     language: Optional[str] = Form(None),
     iterations: Optional[int] = Form(2),
     chunkInput: Optional[bool] = Form(True),  # Default to True for file uploads
-    chunkSize: Optional[int] = Form(4000)    # Default chunk size
+    chunkSize: Optional[int] = Form(4000),   # Default chunk size
+    bypassCache: Optional[bool] = Form(False),
+    incremental: Optional[bool] = Form(True),
+    structuredOutput: Optional[bool] = Form(None)
 ):
     try:
-        print(f"Received file upload: {file.filename}")
-        
-        # Create uploads directory if it doesn't exist
-        os.makedirs("uploads", exist_ok=True)
-        
-        # Save the uploaded file
-        file_path = os.path.join("uploads", file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Extract text from the file
-        try:
-            file_text = extract_text_from_file(file_path)
-            if not file_text:
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        'status': 'error',
-                        'message': f'Could not extract text from file: {file.filename}. Please check the file format.'
-                    }
-                )
-                
-            print(f"Extracted {len(file_text)} characters from file")
-        except Exception as e:
-            return JSONResponse(
-                status_code=400,
-                content={
-                    'status': 'error',
-                    'message': f'Error extracting text from file: {str(e)}'
-                }
-            )
-            
-        # Combine file text with any additional requirement text
-        combined_requirement = ""
-        if requirement:
-            combined_requirement = f"{requirement}\n\nFile Content:\n{file_text}"
-        else:
-            # If no additional requirement, just use the file content as the requirement
-            combined_requirement = f"GENERATE GHERKIN FEATURE FILE BASED ON THESE USER STORIES:\n{cleaned_text}"
-        
-        # Prepare request data
-        request_data = {
-            "requirement": combined_requirement,
+        request_data, error_response = build_file_request(file, {
             "agentType": agentType,
+            "requirement": requirement,
             "featureName": featureName,
             "testName": testName,
             "language": language,
             "iterations": iterations,
             "chunkInput": chunkInput,
-            "chunkSize": chunkSize
-        }
+            "chunkSize": chunkSize,
+            "bypassCache": bypassCache,
+            "incremental": incremental,
+            "structuredOutput": structuredOutput
+        })
+        if error_response:
+            return error_response
         
         # Use the same generate endpoint logic to handle chunking
-        generate_request = GenerateRequest(**request_data)
-        return await generate(generate_request)
+        return await generate(GenerateRequest(**request_data), http_request)
 
     except Exception as e:
         print(f"Exception in generate_with_file endpoint: {str(e)}")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail="Internal server error")
 
+async def run_job(request_data: dict, on_progress: Callable[[dict], None]) -> Tuple[int, dict]:
+    """Run one queued generation request with the longer job deadline"""
+    # Jobs wait for rate limit budget behind interactive requests
+    with request_scope(priority='background'):
+        return await run_generation(
+            request_data,
+            timeout=JOB_TIMEOUT_SECONDS,
+            deadline=JOB_TIMEOUT_SECONDS,
+            on_progress=on_progress
+        )
+
+job_manager = JobManager(
+    run_job,
+    workers=JOB_WORKERS,
+    max_queued=JOB_MAX_QUEUED,
+    retention=JOB_RETENTION
+)
+
+def submit_job(request_data: dict) -> JSONResponse:
+    """Queue a generation request and return its job id"""
+    try:
+        job = job_manager.submit(request_data)
+    except JobQueueFullError as e:
+        return JSONResponse(
+            status_code=503,
+            content={'status': 'error', 'message': str(e)}
+        )
+    
+    print(f"Queued job {job.id} for agent type {request_data.get('agentType')}")
+    return JSONResponse(
+        status_code=202,
+        content={
+            'status': 'success',
+            'message': 'Job queued',
+            'job_id': job.id,
+            'job_status': job.status
+        }
+    )
+
+def get_job_or_404(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+@app.post("/jobs")
+async def create_job(request: GenerateRequest):
+    """Queue a generation request and return immediately with a job id"""
+    print(f"Received job request: {request}")
+    return submit_job(request.dict())
+
+@app.post("/jobs/with-file")
+async def create_job_with_file(
+    file: UploadFile = File(...),
+    agentType: str = Form(...),
+    requirement: Optional[str] = Form(None),
+    featureName: Optional[str] = Form(None),
+    testName: Optional[str] = Form(None),
+    language: Optional[str] = Form(None),
+    iterations: Optional[int] = Form(2),
+    chunkInput: Optional[bool] = Form(True),
+    chunkSize: Optional[int] = Form(4000),
+    bypassCache: Optional[bool] = Form(False),
+    incremental: Optional[bool] = Form(True),
+    structuredOutput: Optional[bool] = Form(None)
+):
+    """Queue a generation request for an uploaded requirements file"""
+    try:
+        request_data, error_response = build_file_request(file, {
+            "agentType": agentType,
+            "requirement": requirement,
+            "featureName": featureName,
+            "testName": testName,
+            "language": language,
+            "iterations": iterations,
+            "chunkInput": chunkInput,
+            "chunkSize": chunkSize,
+            "bypassCache": bypassCache,
+            "incremental": incremental,
+            "structuredOutput": structuredOutput
+        })
+        if error_response:
+            return error_response
+        return submit_job(request_data)
+
+    except Exception as e:
+        print(f"Exception in create_job_with_file endpoint: {str(e)}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Return the state and progress of a job, including its result once finished"""
+    job = get_job_or_404(job_id)
+    return job.to_dict(include_result=job.status in FINISHED_STATES)
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Return the result of a finished job with the status code /generate would have used"""
+    job = get_job_or_404(job_id)
+    if job.status not in FINISHED_STATES:
+        return JSONResponse(
+            status_code=409,
+            content={'status': 'error', 'message': f'Job is {job.status}', 'job_status': job.status}
+        )
+    if job.result is None:
+        return JSONResponse(
+            status_code=410 if job.status == 'cancelled' else 500,
+            content={'status': 'error', 'message': job.error or f'Job {job.status}', 'job_status': job.status}
+        )
+    return JSONResponse(status_code=job.status_code, content=job.result)
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job"""
+    job = get_job_or_404(job_id)
+    if not job_manager.cancel(job_id):
+        return JSONResponse(
+            status_code=409,
+            content={'status': 'error', 'message': f'Job already {job.status}', 'job_status': job.status}
+        )
+    print(f"Cancelled job {job_id}")
+    return {'status': 'success', 'message': 'Job cancelled', 'job_id': job_id, 'job_status': job.status}
+
 @app.get("/download/{filename}")
 async def download_file(filename: str):
     # Check in features directory first
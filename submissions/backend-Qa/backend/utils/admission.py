@@ -0,0 +1,199 @@
+"""
+Admission control for generation requests, per agent.
+
+Each agent (Gherkin, Selenium, chat, manual test cases) generates at most
+max_in_flight requests at a time. Further requests wait in a bounded FIFO
+queue for a slot; once max_queued are waiting, or a request has waited
+queue_timeout seconds, it is rejected right away with AdmissionRejected
+instead of piling up until every request times out. The Retry-After of a
+rejection is the time the agent needs to drain the queue ahead of the
+caller, from the rate at which its requests finished recently.
+
+Slots are handed over on the server's event loop; acquire and release must
+be called from it.
+
+Environment:
+    ADMISSION_CONTROL_ENABLED: Set to 'false' to admit every request (default 'true')
+    ADMISSION_MAX_IN_FLIGHT: Requests per agent generating at the same time (default 32)
+    ADMISSION_MAX_QUEUED: Requests per agent waiting for a slot before new ones are rejected (default 64)
+    ADMISSION_QUEUE_TIMEOUT_SECONDS: Longest wait for a slot before the request is rejected (default 10)
+    ADMISSION_DRAIN_WINDOW_SECONDS: Window of finished requests the drain rate is measured over (default 60)
+    ADMISSION_LIMITS: JSON object of per-agent overrides, e.g.
+        {"test_generator": {"max_in_flight": 8, "max_queued": 16}}
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from utils.metrics import metrics
+
+# Bounds of the Retry-After of a rejection, in seconds
+MIN_RETRY_AFTER = 1.0
+MAX_RETRY_AFTER = 300.0
+
+
+class AdmissionRejected(Exception):
+    """A request was turned away because its agent is at capacity"""
+
+    def __init__(self, message: str, agent: str, retry_after: float):
+        super().__init__(message)
+        self.agent = agent
+        self.retry_after = retry_after
+
+
+class AgentGate:
+    """In-flight slots and wait queue of one agent"""
+
+    def __init__(self, agent: str, max_in_flight: int = 32, max_queued: int = 64, queue_timeout: float = 10,
+                 drain_window: float = 60):
+        self.agent = agent
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queued = max(0, max_queued)
+        self.queue_timeout = queue_timeout
+        self.drain_window = drain_window
+        self.in_flight = 0
+        self._waiters = deque()
+        self._finished = deque()  # monotonic times requests released their slot
+        self._started_at = time.monotonic()
+        self.stats = {'admitted': 0, 'queued': 0, 'rejected_queue_full': 0, 'rejected_timeout': 0,
+                      'max_queue_depth': 0}
+
+    async def acquire(self) -> None:
+        """
+        Take a slot, waiting in the queue if all slots are in use.
+
+        Raises:
+            AdmissionRejected: If the queue is full or no slot freed up within queue_timeout
+        """
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            self.stats['admitted'] += 1
+            return
+
+        if len(self._waiters) >= self.max_queued:
+            self.stats['rejected_queue_full'] += 1
+            self._reject(f"Too many {self.agent} requests in progress ({self.in_flight} running, "
+                         f"{len(self._waiters)} waiting)")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats['queued'] += 1
+        self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], len(self._waiters))
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait ended: pass it on
+                self.release(finished=False)
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats['rejected_timeout'] += 1
+                self._reject(f"No {self.agent} capacity freed up within {self.queue_timeout:g}s")
+            raise
+        self.stats['admitted'] += 1
+
+    def release(self, finished: bool = True) -> None:
+        """Give a slot back, handing it straight to the next waiting request"""
+        if finished:
+            self._finished.append(time.monotonic())
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def drain_rate(self) -> float:
+        """Requests finished per second over the drain window"""
+        now = time.monotonic()
+        while self._finished and now - self._finished[0] > self.drain_window:
+            self._finished.popleft()
+        span = min(self.drain_window, now - self._started_at)
+        return len(self._finished) / span if span > 0 else 0.0
+
+    def retry_after(self) -> float:
+        """Seconds until a request arriving now would likely get a slot"""
+        rate = self.drain_rate()
+        ahead = len(self._waiters) + 1
+        seconds = ahead / rate if rate > 0 else self.queue_timeout
+        return round(min(max(seconds, MIN_RETRY_AFTER), MAX_RETRY_AFTER), 1)
+
+    def _reject(self, message: str) -> None:
+        metrics.increment('admission_rejected')
+        raise AdmissionRejected(message, self.agent, self.retry_after())
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats.update({
+            'max_in_flight': self.max_in_flight,
+            'max_queued': self.max_queued,
+            'in_flight': self.in_flight,
+            'queue_depth': len(self._waiters),
+            'drain_rate_per_second': round(self.drain_rate(), 3),
+            'retry_after_seconds': self.retry_after()
+        })
+        return stats
+
+
+class AdmissionController:
+    """One AgentGate per agent, created on first use with the shared or per-agent limits"""
+
+    def __init__(self, max_in_flight: int = 32, max_queued: int = 64, queue_timeout: float = 10,
+                 drain_window: float = 60, limits: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.settings = {'max_in_flight': max_in_flight, 'max_queued': max_queued,
+                         'queue_timeout': queue_timeout, 'drain_window': drain_window}
+        self.limits = limits or {}
+        self._gates: Dict[str, AgentGate] = {}
+
+    def gate(self, agent: str) -> AgentGate:
+        if agent not in self._gates:
+            self._gates[agent] = AgentGate(agent, **{**self.settings, **self.limits.get(agent, {})})
+        return self._gates[agent]
+
+    async def acquire(self, agent: str) -> None:
+        """Take a slot of agent (see AgentGate.acquire)"""
+        await self.gate(agent).acquire()
+
+    def release(self, agent: str) -> None:
+        self.gate(agent).release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        gates = dict(self._gates)
+        return {agent: gate.get_stats() for agent, gate in gates.items()}
+
+
+_controller = None
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """
+    Return the shared admission controller, or None if admission control is disabled.
+
+    The controller is created from the environment on first use.
+    """
+    global _controller
+    if os.getenv('ADMISSION_CONTROL_ENABLED', 'true').lower() in ('0', 'false', 'no'):
+        return None
+
+    if _controller is None:
+        limits = {}
+        raw_limits = os.getenv('ADMISSION_LIMITS', '')
+        if raw_limits:
+            try:
+                limits = json.loads(raw_limits)
+            except json.JSONDecodeError as e:
+                print(f"Ignoring invalid ADMISSION_LIMITS: {str(e)}")
+        _controller = AdmissionController(
+            max_in_flight=int(os.getenv('ADMISSION_MAX_IN_FLIGHT', 32)),
+            max_queued=int(os.getenv('ADMISSION_MAX_QUEUED', 64)),
+            queue_timeout=float(os.getenv('ADMISSION_QUEUE_TIMEOUT_SECONDS', 10)),
+            drain_window=float(os.getenv('ADMISSION_DRAIN_WINDOW_SECONDS', 60)),
+            limits=limits
+        )
+        metrics.register_collector('admission', _controller.get_stats)
+    return _controller
@@ -0,0 +1,88 @@
+"""
+Cooperative cancellation of generation work nobody is waiting for any more.
+
+When a request times out, its client disconnects or its job is cancelled,
+the work behind it keeps going unless it is told to stop: a worker thread
+cannot be interrupted, and would otherwise finish its remaining model calls
+and write files nobody downloads. main.py gives every request a
+CancellationToken in its request scope (see utils.request_context) and
+cancels it when the work is abandoned. The model-call drivers in
+utils.model_calls check the token before every model call, so an abandoned
+request stops at the next stage boundary, and streams check it between
+events.
+
+The model calls kept from being made are counted in the cancelled_model_calls
+metric and their estimated tokens in cancelled_tokens_saved: prompt plus
+max_tokens, as the rate limiter estimates them, for calls that were skipped,
+and max_tokens for async calls that were interrupted mid-call.
+"""
+import threading
+from typing import Optional
+
+from utils.metrics import metrics
+from utils.request_context import get_request_option
+
+
+class Cancelled(Exception):
+    """Work was stopped because its request was abandoned"""
+
+
+class CancellationToken:
+    """
+    Flag shared by a request and the work done for it.
+
+    A token with a parent is also cancelled when the parent is, so a chunk
+    or stage can be abandoned on its own or together with its request.
+    """
+
+    def __init__(self, parent: Optional['CancellationToken'] = None):
+        self.parent = parent
+        self._event = threading.Event()
+        self._reason = None
+
+    def cancel(self, reason: str = 'cancelled') -> None:
+        """Ask the work to stop; the first reason given is kept"""
+        if not self._event.is_set():
+            self._reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    @property
+    def reason(self) -> Optional[str]:
+        if self._event.is_set():
+            return self._reason
+        return self.parent.reason if self.parent is not None else None
+
+    def raise_if_cancelled(self) -> None:
+        """
+        Raises:
+            Cancelled: If the token or its parent has been cancelled
+        """
+        if self.cancelled:
+            raise Cancelled(f"Generation abandoned: {self.reason}")
+
+
+def current_token() -> Optional[CancellationToken]:
+    """Return the cancellation token of the request being processed, if any"""
+    return get_request_option('cancel_token')
+
+
+def checkpoint() -> None:
+    """
+    Stop before doing more work for a request that has been abandoned, e.g. writing its files.
+
+    Raises:
+        Cancelled: If the cancellation token of the request being processed has been cancelled
+    """
+    token = current_token()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def record_saved(model_calls: int, tokens: int) -> None:
+    """Count model calls (and their estimated tokens) that cancellation kept from being made"""
+    metrics.increment('cancelled_model_calls', model_calls)
+    metrics.increment('cancelled_tokens_saved', tokens)
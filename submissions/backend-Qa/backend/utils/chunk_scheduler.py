@@ -0,0 +1,110 @@
+import asyncio
+import time
+from typing import Any, Callable, List, Optional
+
+from utils.cancellation import CancellationToken, current_token
+from utils.request_context import get_request_option, request_scope
+
+
+async def process_chunks(
+    chunks: List[str],
+    request_data: dict,
+    route_request: Callable[[dict], Any],
+    max_in_flight: int = 4,
+    chunk_timeout: float = 60.0,
+    deadline: Optional[float] = None,
+    on_chunk_done: Optional[Callable[[dict], None]] = None,
+    chunk_numbers: Optional[List[int]] = None,
+    total_chunks: Optional[int] = None
+) -> List[dict]:
+    """
+    Route every chunk of a large requirement through the agents with bounded concurrency.
+
+    Args:
+        chunks: Requirement chunks in document order
+        request_data: Original request; each chunk gets a copy with its own requirement
+        route_request: Router call, AgentRouter.aroute_request (awaited on the event loop)
+                       or AgentRouter.route_request (run on a worker thread)
+        max_in_flight: Maximum number of chunks being processed at the same time
+        chunk_timeout: Timeout in seconds for a single chunk
+        deadline: Overall budget in seconds for all chunks (None for no limit)
+        on_chunk_done: Optional callback invoked with each chunk result as it finishes
+        chunk_numbers: 1-based positions of the chunks in the document, when only
+                       some of its chunks are processed (defaults to 1..len(chunks))
+        total_chunks: Number of chunks in the whole document (defaults to len(chunks))
+
+    Returns:
+        One result per chunk, in original chunk order. Each result has:
+        - chunk: 1-based chunk number
+        - status: 'success', 'error', 'rate_limited', 'timeout' or 'deadline_exceeded'
+        - message: Failure reason (empty on success)
+        - response: Agent response dictionary (None if the agent never answered)
+        - seconds: Time spent on the chunk
+    """
+    total = total_chunks or len(chunks)
+    numbers = chunk_numbers or list(range(1, len(chunks) + 1))
+    semaphore = asyncio.Semaphore(max(1, max_in_flight))
+    deadline_at = time.monotonic() + deadline if deadline else None
+    chunk_priority = 'background' if get_request_option('priority') == 'background' else 'chunk'
+
+    async def run_chunk(index: int, chunk: str) -> dict:
+        number = numbers[index]
+        result = {'chunk': number, 'status': 'error', 'message': '', 'response': None, 'seconds': 0.0}
+
+        async with semaphore:
+            start_time = time.monotonic()
+            timeout = chunk_timeout
+            if deadline_at is not None:
+                timeout = min(timeout, deadline_at - start_time)
+
+            if timeout <= 0:
+                result['status'] = 'deadline_exceeded'
+                result['message'] = 'Request deadline reached before this chunk started'
+            else:
+                # Create a copy of the request data with just this chunk
+                chunk_request = request_data.copy()
+                chunk_request['requirement'] = chunk
+                chunk_request['chunkInfo'] = {
+                    'isChunk': True,
+                    'chunkNumber': number,
+                    'totalChunks': total
+                }
+
+                print(f"Processing chunk {number}/{total} ({len(chunk)} chars)")
+                # Stops the chunk's agent between model calls once the chunk is given up on
+                chunk_token = CancellationToken(parent=current_token())
+                try:
+                    # Model calls of the chunk queue behind single interactive requests
+                    # and give up waiting for rate limit budget when the chunk would time out
+                    with request_scope(priority=chunk_priority, deadline=start_time + timeout,
+                                       cancel_token=chunk_token):
+                        if asyncio.iscoroutinefunction(route_request):
+                            routed = route_request(chunk_request)
+                        else:
+                            routed = asyncio.to_thread(route_request, chunk_request)
+                        response = await asyncio.wait_for(routed, timeout=timeout)
+                    result['response'] = response
+                    if response.get('status') == 'success':
+                        result['status'] = 'success'
+                    else:
+                        if response.get('rate_limited'):
+                            result['status'] = 'rate_limited'
+                        result['message'] = response.get('message', 'Agent returned an error')
+                except asyncio.TimeoutError:
+                    chunk_token.cancel('chunk timed out')
+                    timed_out_by_deadline = deadline_at is not None and timeout < chunk_timeout
+                    result['status'] = 'deadline_exceeded' if timed_out_by_deadline else 'timeout'
+                    result['message'] = f'Chunk processing timed out after {timeout:.1f}s'
+                except Exception as e:
+                    result['message'] = str(e)
+
+            result['seconds'] = round(time.monotonic() - start_time, 3)
+
+        if result['status'] != 'success':
+            print(f"Chunk {number} failed ({result['status']}): {result['message']}")
+        if on_chunk_done:
+            on_chunk_done(result)
+        return result
+
+    # gather preserves the input order regardless of completion order
+    return await asyncio.gather(*(run_chunk(i, chunk) for i, chunk in enumerate(chunks)))
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+from utils.metrics import metrics
+
+DEFAULT_STORE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'chunk_results.sqlite3'
+)
+
+# Request fields besides the chunk text that change what an agent generates
+RESULT_OPTIONS = ('language', 'testName', 'structuredOutput', 'improveMerged')
+
+WHITESPACE = re.compile(r'[ \t\r\f\v]+')
+BLANK_LINES = re.compile(r'\n{2,}')
+
+
+def normalize_chunk(text: str) -> str:
+    """
+    Normalize a chunk so formatting-only edits between revisions keep its key.
+
+    Unicode is NFKC-normalized (so PDF and DOCX extraction of the same text
+    agree), runs of spaces and tabs become one space, lines are stripped and
+    runs of blank lines collapse to one.
+    """
+    text = unicodedata.normalize('NFKC', text)
+    lines = [WHITESPACE.sub(' ', line).strip() for line in text.split('\n')]
+    return BLANK_LINES.sub('\n\n', '\n'.join(lines)).strip()
+
+
+def _result_option(request_data: dict, name: str) -> Any:
+    """Value of a result option, with the flags resolved to the mode they select"""
+    value = request_data.get(name)
+    if name == 'improveMerged':
+        # Chunks of improveMerged requests skip their own improve pass
+        return bool(value)
+    if name == 'structuredOutput':
+        # Same resolution as ManualTestCaseGenerator: None means the environment's mode
+        if value is None:
+            return os.getenv('MANUAL_TESTCASE_STRUCTURED_OUTPUT', 'false').lower() in ('1', 'true', 'yes')
+        return bool(value)
+    return value
+
+
+def make_chunk_key(chunk: str, request_data: dict) -> str:
+    """
+    Build the key of a chunk's generated result.
+
+    Args:
+        chunk: Requirement text of the chunk
+        request_data: The request; its agent type and the options in RESULT_OPTIONS are part of the key
+
+    Returns:
+        SHA-256 hex digest of the normalized chunk, the agent type and the result options
+    """
+    payload = json.dumps(
+        {
+            'agent_type': (request_data.get('agentType') or '').lower(),
+            'options': {name: _result_option(request_data, name) for name in RESULT_OPTIONS},
+            'chunk': normalize_chunk(chunk)
+        },
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class RevisionDiff:
+    """How the chunks of a document changed since its previous revision"""
+
+    def __init__(self, document: str, previous_keys: Optional[List[str]], keys: List[str]):
+        self.document = document
+        self.has_previous = previous_keys is not None
+        previous = set(previous_keys or [])
+        current = set(keys)
+        self.unchanged = sum(1 for key in keys if key in previous)
+        self.changed_or_new = len(keys) - self.unchanged
+        self.removed = len(previous - current)
+
+    def to_dict(self) -> dict:
+        return {
+            'document': self.document,
+            'previous_revision': self.has_previous,
+            'unchanged_chunks': self.unchanged,
+            'changed_or_new_chunks': self.changed_or_new,
+            'removed_chunks': self.removed
+        }
+
+
+class ChunkResultStore:
+    """
+    Persistent store of per-chunk agent results and document revisions, backed by SQLite.
+
+    Results are content addressed (see make_chunk_key), so a section that did
+    not change between two uploads of a document is served from the store
+    instead of the model. For every document the chunk keys of its latest
+    revision are kept to report what changed on the next upload.
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH, max_entries: int = 20000,
+                 ttl_seconds: Optional[float] = 30 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'revisions': 0}
+
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS chunk_results (
+            key TEXT PRIMARY KEY,
+            agent_type TEXT,
+            response TEXT NOT NULL,
+            created REAL NOT NULL,
+            accessed REAL NOT NULL
+        )''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS chunk_results_accessed ON chunk_results (accessed)')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS revisions (
+            document TEXT PRIMARY KEY,
+            chunk_keys TEXT NOT NULL,
+            updated REAL NOT NULL
+        )''')
+
+    def get_many(self, keys: List[str]) -> Dict[str, dict]:
+        """Return the stored responses for the keys that have one"""
+        now = time.time()
+        found = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                row = self._conn.execute('SELECT response, created FROM chunk_results WHERE key = ?', (key,)).fetchone()
+                if row and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                    self._conn.execute('DELETE FROM chunk_results WHERE key = ?', (key,))
+                    self.stats['evictions'] += 1
+                    row = None
+                if row is None:
+                    self.stats['misses'] += 1
+                    continue
+                self._conn.execute('UPDATE chunk_results SET accessed = ? WHERE key = ?', (now, key))
+                found[key] = json.loads(row[0])
+                self.stats['hits'] += 1
+        return found
+
+    def put(self, key: str, response: dict, agent_type: str = '') -> None:
+        """Store a successful chunk response"""
+        now = time.time()
+        payload = json.dumps(response, ensure_ascii=False, default=str)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO chunk_results (key, agent_type, response, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, agent_type, payload, now, now)
+            )
+            self.stats['stores'] += 1
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        """Drop expired results, then the least recently used ones beyond max_entries"""
+        if self.ttl_seconds:
+            cursor = self._conn.execute('DELETE FROM chunk_results WHERE created < ?', (now - self.ttl_seconds,))
+            self.stats['evictions'] += max(cursor.rowcount, 0)
+
+        count = self._conn.execute('SELECT COUNT(*) FROM chunk_results').fetchone()[0]
+        if count > self.max_entries:
+            cursor = self._conn.execute(
+                'DELETE FROM chunk_results WHERE key IN (SELECT key FROM chunk_results ORDER BY accessed ASC LIMIT ?)',
+                (count - self.max_entries,)
+            )
+            self.stats['evictions'] += max(cursor.rowcount, 0)
+
+    def diff_revision(self, document: str, keys: List[str]) -> RevisionDiff:
+        """Compare the chunk keys of a new revision with the document's previous revision"""
+        with self._lock:
+            row = self._conn.execute('SELECT chunk_keys FROM revisions WHERE document = ?', (document,)).fetchone()
+        return RevisionDiff(document, json.loads(row[0]) if row else None, keys)
+
+    def save_revision(self, document: str, keys: List[str]) -> None:
+        """Record the chunk keys of the latest revision of a document"""
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO revisions (document, chunk_keys, updated) VALUES (?, ?, ?)',
+                (document, json.dumps(keys), time.time())
+            )
+            self.stats['revisions'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters together with the number of stored results and documents"""
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM chunk_results').fetchone()[0]
+            documents = self._conn.execute('SELECT COUNT(*) FROM revisions').fetchone()[0]
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'entries': entries,
+            'documents': documents,
+            'hit_rate': round(stats['hits'] / lookups, 3) if lookups else 0.0
+        })
+        return stats
+
+
+_chunk_store = None
+_chunk_store_lock = threading.Lock()
+
+
+def get_chunk_store() -> Optional[ChunkResultStore]:
+    """
+    Return the shared chunk result store, creating it from the environment on first use.
+
+    Environment:
+        INCREMENTAL_GENERATION: Set to 'false' to disable per-chunk result reuse (default 'true')
+        CHUNK_STORE_PATH: SQLite file for the store
+        CHUNK_STORE_MAX_ENTRIES: Maximum number of stored chunk results (default 20000)
+        CHUNK_STORE_TTL_SECONDS: Result lifetime in seconds, 0 for no expiry (default 30 days)
+    """
+    global _chunk_store
+    if os.getenv('INCREMENTAL_GENERATION', 'true').lower() in ('0', 'false', 'no'):
+        return None
+
+    with _chunk_store_lock:
+        if _chunk_store is None:
+            try:
+                _chunk_store = ChunkResultStore(
+                    path=os.getenv('CHUNK_STORE_PATH', DEFAULT_STORE_PATH),
+                    max_entries=int(os.getenv('CHUNK_STORE_MAX_ENTRIES', 20000)),
+                    ttl_seconds=float(os.getenv('CHUNK_STORE_TTL_SECONDS', 30 * 24 * 3600)) or None
+                )
+                metrics.register_collector('chunk_store', _chunk_store.get_stats)
+            except Exception as e:
+                print(f"Error initializing chunk result store: {str(e)}")
+                return None
+        return _chunk_store
@@ -0,0 +1,300 @@
+"""
+Circuit breakers per model id, so calls to a failing model fail fast.
+
+When a model is down or stalling, every call to it would otherwise wait out
+its request timeout before the agent falls back to its deterministic output.
+Each model's breaker watches the calls of the last CIRCUIT_WINDOW_SECONDS:
+once enough of them failed or were slow, it opens and calls are rejected
+right away with CircuitOpen, which the agents answer with their fallbacks
+(cached responses are still served, as the cache sits in front of the
+breaker). After CIRCUIT_OPEN_SECONDS the breaker lets a few probe calls
+through; if they succeed it closes again, otherwise it stays open.
+
+Model calls that failed or were rejected are recorded for the request, and
+the router flags its response as degraded.
+
+Environment:
+    CIRCUIT_BREAKER_ENABLED: Set to 'false' to never reject calls (default 'true')
+    CIRCUIT_WINDOW_SECONDS: Length of the sliding window of observed calls (default 60)
+    CIRCUIT_MIN_CALLS: Calls in the window before the breaker may open (default 5)
+    CIRCUIT_ERROR_RATE: Share of failed calls that opens the breaker (default 0.5)
+    CIRCUIT_SLOW_CALL_SECONDS: Calls (or streams until their first event) slower than this are slow (default 30)
+    CIRCUIT_SLOW_CALL_RATE: Share of slow calls that opens the breaker (default 0.5)
+    CIRCUIT_OPEN_SECONDS: Time an open breaker rejects calls before probing (default 30)
+    CIRCUIT_HALF_OPEN_PROBES: Successful probes needed to close the breaker (default 1)
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterator, Optional
+
+from utils.metrics import metrics
+from utils.rate_limiter import RateLimitExceeded
+from utils.request_context import get_request_option
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """A model call was rejected because the model's circuit breaker is open"""
+
+    def __init__(self, message: str, model_id: str, retry_after: float):
+        super().__init__(message)
+        self.model_id = model_id
+        self.retry_after = retry_after
+
+
+def mark_degraded(model_id: str, reason: str) -> None:
+    """Record for the current request that a call to model_id failed ('error') or was rejected ('circuit_open')"""
+    degraded_models = get_request_option('degraded_models')
+    if degraded_models is not None and degraded_models.get(model_id) != 'circuit_open':
+        degraded_models[model_id] = reason
+
+
+def mark_degraded_result(result: Any, degraded_models: Dict[str, str]) -> Any:
+    """Flag a response dictionary as degraded when model calls of its request failed or were rejected"""
+    if degraded_models and isinstance(result, dict):
+        result['degraded'] = True
+        result['degraded_models'] = dict(degraded_models)
+    return result
+
+
+class CircuitBreaker:
+    """Closed / open / half-open state of one model, driven by a sliding window of call outcomes"""
+
+    def __init__(self, model_id: str, window_seconds: float = 60, min_calls: int = 5, error_rate: float = 0.5,
+                 slow_call_seconds: float = 30, slow_call_rate: float = 0.5, open_seconds: float = 30,
+                 half_open_probes: int = 1):
+        self.model_id = model_id
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self._lock = threading.Lock()
+        self._calls = deque()  # (finished at, failed, slow)
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.stats = {'calls': 0, 'failures': 0, 'slow_calls': 0, 'rejected': 0, 'opened': 0}
+
+    def before_call(self) -> bool:
+        """
+        Admit a call or reject it.
+
+        Returns:
+            Whether the call is a half-open probe
+
+        Raises:
+            CircuitOpen: If the breaker is open, or half-open with all probes in flight
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+                self._probes_in_flight = 0
+                self._probe_successes = 0
+            if self.state == CLOSED:
+                return False
+            if self.state == HALF_OPEN and self._probes_in_flight + self._probe_successes < self.half_open_probes:
+                self._probes_in_flight += 1
+                return True
+            self.stats['rejected'] += 1
+            retry_after = max(0.0, self.open_seconds - (now - self._opened_at)) if self.state == OPEN else 1.0
+        metrics.increment('circuit_breaker_rejected')
+        raise CircuitOpen(f"Model {self.model_id} is unavailable (circuit breaker {self.state})",
+                          self.model_id, retry_after)
+
+    def after_call(self, probe: bool, failed: bool, seconds: float) -> None:
+        """Record the outcome of an admitted call and open or close the breaker accordingly"""
+        slow = seconds > self.slow_call_seconds
+        with self._lock:
+            now = time.monotonic()
+            self.stats['calls'] += 1
+            self.stats['failures'] += failed
+            self.stats['slow_calls'] += slow
+            if probe:
+                self._probes_in_flight -= 1
+                if self.state != HALF_OPEN:
+                    return
+                if failed or slow:
+                    self._open(now)
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self.state = CLOSED
+                    self._calls.clear()
+                return
+            # Calls admitted before the breaker opened say nothing about the model now
+            if self.state != CLOSED:
+                return
+
+            self._calls.append((now, failed, slow))
+            while self._calls and now - self._calls[0][0] > self.window_seconds:
+                self._calls.popleft()
+            count = len(self._calls)
+            if count >= self.min_calls:
+                failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+                slow_calls = sum(1 for _, _, call_slow in self._calls if call_slow)
+                if failures / count >= self.error_rate or slow_calls / count >= self.slow_call_rate:
+                    self._open(now)
+
+    def release(self, probe: bool) -> None:
+        """Forget an admitted call that never reached the model"""
+        if probe:
+            with self._lock:
+                self._probes_in_flight -= 1
+
+    def _open(self, now: float) -> None:
+        self.state = OPEN
+        self._opened_at = now
+        self._calls.clear()
+        self.stats['opened'] += 1
+        print(f"Circuit breaker for {self.model_id} opened for {self.open_seconds}s")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['state'] = self.state
+            stats['window_calls'] = len(self._calls)
+            if self.state == OPEN:
+                stats['open_for_seconds'] = round(max(0.0, self.open_seconds - (time.monotonic() - self._opened_at)), 1)
+        return stats
+
+
+class CircuitBreakerRegistry:
+    """One CircuitBreaker per model id, created on first use with the shared settings"""
+
+    def __init__(self, **settings):
+        self.settings = settings
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, model_id: str) -> CircuitBreaker:
+        with self._lock:
+            if model_id not in self._breakers:
+                self._breakers[model_id] = CircuitBreaker(model_id, **self.settings)
+            return self._breakers[model_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {model_id: breaker.get_stats() for model_id, breaker in breakers.items()}
+
+
+class CircuitBreakerAgent:
+    """
+    Agent whose calls go through the circuit breaker of its model.
+
+    Rate limit rejections are the scheduler's decision, not a model failure,
+    and are passed on without being recorded.
+    """
+
+    def __init__(self, agent, breaker: CircuitBreaker):
+        self.agent = agent
+        self.breaker = breaker
+
+    def __getattr__(self, name):
+        return getattr(self.agent, name)
+
+    def _admit(self) -> bool:
+        try:
+            return self.breaker.before_call()
+        except CircuitOpen:
+            mark_degraded(self.breaker.model_id, 'circuit_open')
+            raise
+
+    def _failed(self, probe: bool, start: float) -> None:
+        self.breaker.after_call(probe, True, time.perf_counter() - start)
+        mark_degraded(self.breaker.model_id, 'error')
+
+    def run(self, prompt, stream: bool = False, **kwargs):
+        probe = self._admit()
+        if stream:
+            return self._stream(prompt, probe, **kwargs)
+        start = time.perf_counter()
+        try:
+            response = self.agent.run(prompt, **kwargs)
+        except RateLimitExceeded:
+            self.breaker.release(probe)
+            raise
+        except Exception:
+            self._failed(probe, start)
+            raise
+        self.breaker.after_call(probe, False, time.perf_counter() - start)
+        return response
+
+    async def arun(self, prompt, **kwargs):
+        probe = self._admit()
+        start = time.perf_counter()
+        try:
+            response = await self.agent.arun(prompt, **kwargs)
+        except (RateLimitExceeded, asyncio.CancelledError):
+            self.breaker.release(probe)
+            raise
+        except Exception:
+            self._failed(probe, start)
+            raise
+        self.breaker.after_call(probe, False, time.perf_counter() - start)
+        return response
+
+    def _stream(self, prompt, probe: bool, **kwargs) -> Iterator[Any]:
+        start = time.perf_counter()
+        first_event = None
+        try:
+            for event in self.agent.run(prompt, stream=True, **kwargs):
+                if first_event is None:
+                    first_event = time.perf_counter() - start
+                yield event
+        except (RateLimitExceeded, GeneratorExit):
+            # Never reached the model, or the consumer stopped reading: no verdict on the model
+            self.breaker.release(probe)
+            raise
+        except Exception:
+            self._failed(probe, start)
+            raise
+        self.breaker.after_call(probe, False, first_event if first_event is not None else time.perf_counter() - start)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_circuit_breakers() -> Optional[CircuitBreakerRegistry]:
+    """
+    Return the shared circuit breaker registry, or None if circuit breaking is disabled.
+
+    The registry is created from the environment on first use.
+    """
+    global _registry
+    if os.getenv('CIRCUIT_BREAKER_ENABLED', 'true').lower() in ('0', 'false', 'no'):
+        return None
+
+    with _registry_lock:
+        if _registry is None:
+            _registry = CircuitBreakerRegistry(
+                window_seconds=float(os.getenv('CIRCUIT_WINDOW_SECONDS', 60)),
+                min_calls=int(os.getenv('CIRCUIT_MIN_CALLS', 5)),
+                error_rate=float(os.getenv('CIRCUIT_ERROR_RATE', 0.5)),
+                slow_call_seconds=float(os.getenv('CIRCUIT_SLOW_CALL_SECONDS', 30)),
+                slow_call_rate=float(os.getenv('CIRCUIT_SLOW_CALL_RATE', 0.5)),
+                open_seconds=float(os.getenv('CIRCUIT_OPEN_SECONDS', 30)),
+                half_open_probes=int(os.getenv('CIRCUIT_HALF_OPEN_PROBES', 1))
+            )
+            metrics.register_collector('circuit_breakers', _registry.get_stats)
+    return _registry
+
+
+def guard_agent(agent, model_id: str):
+    """Wrap agent in the circuit breaker of model_id when circuit breaking is enabled, else return it unchanged"""
+    registry = get_circuit_breakers()
+    if registry is None:
+        return agent
+    return CircuitBreakerAgent(agent, registry.breaker(model_id))
@@ -0,0 +1,158 @@
+import hashlib
+import re
+from typing import List, Optional
+
+from utils.gherkin_parser import Feature, Rule, Scenario, Step, format_feature, parse_gherkin
+
+# Punctuation and quoting that does not change what a step means
+STEP_NOISE = re.compile(r'["\'`.,;:!?]+')
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_step(keyword: str, text: str) -> str:
+    """Lower-case a step, drop punctuation and quotes and collapse whitespace"""
+    text = STEP_NOISE.sub(' ', text.lower())
+    return f"{keyword.lower()} {WHITESPACE.sub(' ', text).strip()}"
+
+
+def _normalize_row(row: List[str]) -> str:
+    return '| ' + ' | '.join(WHITESPACE.sub(' ', cell.lower()) for cell in row)
+
+
+def normalized_steps(steps: List[Step]) -> List[str]:
+    """Normalized steps with their tables and doc strings; And / But take the keyword before them"""
+    normalized = []
+    keyword = 'given'
+    for step in steps:
+        if step.keyword in ('Given', 'When', 'Then'):
+            keyword = step.keyword
+        normalized.append(normalize_step(keyword, step.text))
+        normalized.extend(_normalize_row(row) for row in step.table or [])
+        if step.doc_string is not None:
+            normalized.extend(f"doc {line.strip()}" for line in step.doc_string.lines)
+    return normalized
+
+
+def scenario_fingerprint(scenario: Scenario) -> str:
+    """Hash of a scenario's normalized steps and Examples rows; scenarios without steps hash their title"""
+    parts = normalized_steps(scenario.steps)
+    for examples in scenario.examples:
+        parts.extend(_normalize_row(row) for row in examples.rows)
+    if not parts:
+        parts = [f"title {WHITESPACE.sub(' ', scenario.name.lower())}"]
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+class MergeResult:
+    """Feature file merged from several chunk outputs, with what was collapsed"""
+
+    def __init__(self, content: str, documents: int, features: int, scenarios: int,
+                 duplicate_scenarios: int, background_steps_merged: int):
+        self.content = content
+        self.documents = documents
+        self.features = features
+        self.scenarios = scenarios
+        self.duplicate_scenarios = duplicate_scenarios
+        self.background_steps_merged = background_steps_merged
+
+    def to_dict(self) -> dict:
+        return {
+            'documents': self.documents,
+            'features': self.features,
+            'scenarios': self.scenarios,
+            'duplicate_scenarios': self.duplicate_scenarios,
+            'background_steps_merged': self.background_steps_merged
+        }
+
+
+class _Merger:
+    def __init__(self):
+        self.feature = Feature()
+        self.seen = set()
+        self.duplicates = 0
+        self.background_steps_merged = 0
+        self.rules = {}
+        # Feature-level scenarios come before every Rule: Gherkin has no way back to the feature level
+        self.feature_scenarios = 0
+
+    def merge_background(self, target, background: Optional[Scenario]) -> None:
+        """Merge Background steps into target's Background, keeping each distinct step once"""
+        if background is None:
+            return
+        if target.background is None:
+            target.background = background
+            return
+        known = set(normalized_steps(target.background.steps))
+        for step in background.steps:
+            key = normalized_steps([step])[0]
+            if key not in known:
+                known.add(key)
+                target.background.steps.append(step)
+                self.background_steps_merged += 1
+
+    def add_scenarios(self, target, scenarios: List[Scenario]) -> None:
+        for scenario in scenarios:
+            fingerprint = scenario_fingerprint(scenario)
+            if fingerprint in self.seen:
+                self.duplicates += 1
+                continue
+            self.seen.add(fingerprint)
+            if target is self.feature:
+                target.children.insert(self.feature_scenarios, scenario)
+                self.feature_scenarios += 1
+            else:
+                target.children.append(scenario)
+
+    def add_document(self, document: Feature) -> None:
+        if document.keyword and not self.feature.keyword:
+            for name in ('keyword', 'name', 'tags', 'comments', 'description'):
+                setattr(self.feature, name, getattr(document, name))
+        self.merge_background(self.feature, document.background)
+        for child in document.children:
+            if isinstance(child, Rule):
+                # Rules with the same name are merged into one
+                rule = self.rules.get(child.name)
+                if rule is None:
+                    rule = Rule(child.name, child.tags)
+                    rule.comments, rule.description = child.comments, child.description
+                    self.rules[child.name] = rule
+                    self.feature.children.append(rule)
+                self.merge_background(rule, child.background)
+                self.add_scenarios(rule, child.children)
+            else:
+                self.add_scenarios(self.feature, [child])
+
+
+def merge_feature_files(documents: List[str]) -> MergeResult:
+    """
+    Merge the feature files generated for the chunks of one requirement.
+
+    The first Feature header is kept and the others are dropped. Background
+    steps from every chunk are merged into one Background, keeping each
+    distinct step once, and Rules with the same name are merged. Scenarios
+    are kept in document order, except that scenarios outside a Rule are
+    placed before the first Rule, where Gherkin allows them; a scenario whose normalized steps (keyword,
+    lower-cased text without punctuation, tables, doc strings and Examples
+    rows) hash the same as an earlier one is a duplicate and is dropped, even
+    if its title or formatting differ.
+
+    Args:
+        documents: Gherkin content per chunk, in chunk order
+
+    Returns:
+        MergeResult with the merged content and the number of scenarios collapsed
+    """
+    parsed = [parse_gherkin(content) for content in documents if content and content.strip()]
+
+    merger = _Merger()
+    for document in parsed:
+        merger.add_document(document)
+
+    return MergeResult(
+        content=format_feature(merger.feature) + '\n',
+        documents=len(parsed),
+        features=sum(document.headers for document in parsed),
+        scenarios=len(merger.feature.scenarios()),
+        duplicate_scenarios=merger.duplicates,
+        background_steps_merged=merger.background_steps_merged
+    )
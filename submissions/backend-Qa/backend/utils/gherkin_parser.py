@@ -0,0 +1,427 @@
+import re
+from typing import List, Optional
+
+STEP_KEYWORDS = ('Given', 'When', 'Then', 'And', 'But', '*')
+STEP_KEYWORD_SET = frozenset(STEP_KEYWORDS)
+
+# Block keywords in the order they must be tried ('Examples' before 'Example', 'Scenarios' before 'Scenario')
+BLOCK_LINE = re.compile(
+    r'(Feature|Rule|Background|Scenario Outline|Scenario Template|Examples|Scenarios|Scenario|Example)\s*:\s*(.*)'
+)
+BLOCK_KINDS = {
+    'Feature': 'feature',
+    'Rule': 'rule',
+    'Background': 'background',
+    'Scenario Outline': 'scenario',
+    'Scenario Template': 'scenario',
+    'Scenario': 'scenario',
+    'Example': 'scenario',
+    'Examples': 'examples',
+    'Scenarios': 'examples'
+}
+BLOCK_INITIALS = frozenset(keyword[0] for keyword in BLOCK_KINDS)
+DOC_STRING_DELIMITERS = ('"""', '```')
+TABLE_CELL = re.compile(r'((?:[^|\\]|\\.)*)\|')
+
+INDENT = '  '
+
+
+class LineToken:
+    """One classified line of Gherkin"""
+
+    def __init__(self, kind: str, keyword: str = '', text: str = '', indent: int = 0):
+        # 'feature', 'rule', 'background', 'scenario', 'examples', 'step', 'table_row',
+        # 'doc_string', 'tag', 'comment', 'empty' or 'text'
+        self.kind = kind
+        self.keyword = keyword
+        self.text = text
+        self.indent = indent
+
+
+def classify_line(line: str) -> LineToken:
+    """Classify a line by its leading keyword or symbol, ignoring indentation"""
+    stripped = line.strip()
+    indent = len(line) - len(line.lstrip())
+    if not stripped:
+        return LineToken('empty', indent=indent)
+
+    # Steps are most lines of a feature, so they are checked first
+    word, _, rest = stripped.partition(' ')
+    if word in STEP_KEYWORD_SET:
+        return LineToken('step', keyword=word, text=rest.strip(), indent=indent)
+
+    first = stripped[0]
+    if first == '#':
+        return LineToken('comment', text=stripped, indent=indent)
+    if first == '@':
+        return LineToken('tag', text=stripped, indent=indent)
+    if first == '|':
+        return LineToken('table_row', text=stripped, indent=indent)
+    if stripped.startswith(DOC_STRING_DELIMITERS):
+        return LineToken('doc_string', keyword=stripped[:3], text=stripped[3:].strip(), indent=indent)
+
+    if first in BLOCK_INITIALS:
+        match = BLOCK_LINE.match(stripped)
+        if match:
+            return LineToken(BLOCK_KINDS[match.group(1)], keyword=match.group(1), text=match.group(2).strip(), indent=indent)
+    return LineToken('text', text=stripped, indent=indent)
+
+
+def parse_table_row(text: str) -> List[str]:
+    """Split a table row into its cells; escaped pipes (\\|) stay inside their cell"""
+    return [cell.strip() for cell in TABLE_CELL.findall(text.strip()[1:])]
+
+
+class DocString:
+    def __init__(self, delimiter: str = '"""', media_type: str = ''):
+        self.delimiter = delimiter
+        self.media_type = media_type
+        self.lines = []
+        self.indent = 0  # indentation of the opening delimiter, removed from the content
+
+
+class Step:
+    def __init__(self, keyword: str, text: str):
+        self.keyword = keyword
+        self.text = text
+        self.comments = []
+        self.table = None  # list of rows, each a list of cells
+        self.doc_string = None
+        # Free text following the step, kept where it was written
+        self.notes = []
+
+
+class Examples:
+    def __init__(self, keyword: str = 'Examples', name: str = '', tags: Optional[List[str]] = None):
+        self.keyword = keyword
+        self.name = name
+        self.tags = tags or []
+        self.comments = []
+        self.description = []
+        self.rows = []
+
+
+class Scenario:
+    """Scenario, Scenario Outline or Background; keyword '' marks steps written without a header"""
+
+    def __init__(self, keyword: str, name: str = '', tags: Optional[List[str]] = None):
+        self.keyword = keyword
+        self.name = name
+        self.tags = tags or []
+        self.comments = []
+        self.description = []
+        self.steps = []
+        self.examples = []
+
+    @property
+    def is_background(self) -> bool:
+        return self.keyword == 'Background'
+
+
+class Rule:
+    def __init__(self, name: str = '', tags: Optional[List[str]] = None):
+        self.keyword = 'Rule'
+        self.name = name
+        self.tags = tags or []
+        self.comments = []
+        self.description = []
+        self.background = None
+        self.children = []  # Scenario nodes in document order
+
+    def scenarios(self) -> List[Scenario]:
+        return list(self.children)
+
+
+class Feature:
+    """
+    Root of a parsed document.
+
+    keyword is '' when the text had no Feature line (e.g. a scenarios-only
+    stage output). headers counts the Feature lines seen; only the first one
+    is kept.
+    """
+
+    def __init__(self):
+        self.keyword = ''
+        self.name = ''
+        self.tags = []
+        self.comments = []
+        self.description = []
+        self.background = None
+        self.children = []  # Scenario and Rule nodes in document order
+        self.headers = 0
+        self.trailing_comments = []
+
+    def scenarios(self) -> List[Scenario]:
+        """All scenarios, including those inside rules, in document order"""
+        found = []
+        for child in self.children:
+            found.extend(child.scenarios() if isinstance(child, Rule) else [child])
+        return found
+
+
+class GherkinParser:
+    """
+    Incremental Gherkin parser.
+
+    Text can be fed in arbitrary pieces as it streams in (feed) or line by
+    line (feed_line); the tree is built as lines complete and close() returns
+    it. Parsing is lenient, as model output is not always valid Gherkin:
+    steps without a scenario header get a headerless scenario, free text
+    after a step stays attached to that step, text before the Feature line
+    is kept as a comment and a repeated Feature line is counted but
+    otherwise ignored.
+    """
+
+    def __init__(self):
+        self.feature = Feature()
+        self._buffer = ''
+        self._rule = None
+        self._node = self.feature  # Node receiving descriptions and steps
+        self._step = None
+        self._table_target = None  # Step or Examples receiving table rows
+        self._doc_string = None
+        self._tags = []
+        self._comments = []
+        self._skip_description = False
+
+    def feed(self, text: str) -> None:
+        """Add streamed text; complete lines are parsed right away"""
+        self._buffer += text
+        *complete, self._buffer = self._buffer.split('\n')
+        for line in complete:
+            self.feed_line(line)
+
+    def close(self) -> Feature:
+        """Parse the remaining text and return the document"""
+        if self._buffer:
+            self.feed_line(self._buffer)
+            self._buffer = ''
+        self._doc_string = None
+        # Tags or comments with nothing after them
+        self.feature.trailing_comments.extend(self._comments + self._tags)
+        self._comments, self._tags = [], []
+        return self.feature
+
+    def _take_pending(self, node) -> None:
+        node.comments, self._comments = self._comments, []
+        if hasattr(node, 'tags'):
+            node.tags.extend(self._tags)
+            self._tags = []
+
+    def _container(self):
+        return self._rule if self._rule is not None else self.feature
+
+    def _start_block(self, node) -> None:
+        self._take_pending(node)
+        self._node = node
+        self._step = None
+        self._table_target = None
+        self._skip_description = False
+
+    def feed_line(self, line: str) -> None:
+        line = line.rstrip('\r')
+        if self._doc_string is not None:
+            if line.strip().startswith(self._doc_string.delimiter):
+                self._doc_string = None
+            else:
+                self._doc_string.lines.append(line)
+            return
+
+        token = classify_line(line)
+        kind = token.kind
+
+        if kind == 'empty':
+            return
+        if kind == 'comment':
+            self._comments.append(token.text)
+            return
+        if kind == 'tag':
+            self._tags.extend(token.text.split())
+            return
+
+        if kind == 'feature':
+            self.feature.headers += 1
+            if self.feature.headers == 1:
+                self.feature.keyword = token.keyword
+                self.feature.name = token.text
+                self._rule = None
+                self._start_block(self.feature)
+            else:
+                # Later Feature lines (and their descriptions) are dropped; an open
+                # Rule stays open, as Gherkin has no way back to the feature level
+                self._comments, self._tags = [], []
+                self._node = self._container()
+                self._step = None
+                self._table_target = None
+                self._skip_description = True
+            return
+
+        if kind == 'rule':
+            rule = Rule(token.text)
+            self.feature.children.append(rule)
+            self._rule = rule
+            self._start_block(rule)
+            return
+
+        if kind == 'background':
+            container = self._container()
+            if container.background is None:
+                container.background = Scenario('Background', token.text)
+                self._start_block(container.background)
+            else:
+                # A second Background adds its steps to the first
+                self._start_block(container.background)
+            return
+
+        if kind == 'scenario':
+            scenario = Scenario(token.keyword, token.text)
+            self._container().children.append(scenario)
+            self._start_block(scenario)
+            return
+
+        if kind == 'examples' and isinstance(self._node, Scenario) and not self._node.is_background:
+            examples = Examples(token.keyword, token.text)
+            self._take_pending(examples)
+            self._node.examples.append(examples)
+            self._step = None
+            self._table_target = examples
+            return
+
+        if kind == 'step':
+            if not isinstance(self._node, Scenario) or self._node.examples:
+                # Steps outside a scenario (or after its Examples) get a headerless scenario
+                scenario = Scenario('')
+                self._container().children.append(scenario)
+                self._start_block(scenario)
+            step = Step(token.keyword, token.text)
+            step.comments, self._comments = self._comments, []
+            self._node.steps.append(step)
+            self._step = step
+            self._table_target = step
+            return
+
+        if kind == 'table_row' and self._table_target is not None:
+            row = parse_table_row(token.text)
+            if isinstance(self._table_target, Examples):
+                self._table_target.rows.append(row)
+            else:
+                if self._table_target.table is None:
+                    self._table_target.table = []
+                self._table_target.table.append(row)
+            return
+
+        if kind == 'doc_string' and self._step is not None and self._step.doc_string is None:
+            self._doc_string = DocString(token.keyword, token.text)
+            self._doc_string.indent = token.indent
+            self._step.doc_string = self._doc_string
+            self._table_target = None
+            return
+
+        # Free text: a description before any steps, otherwise a note on the last step
+        if self._skip_description:
+            return
+        text = line.strip()
+        if self._node is self.feature and not self.feature.headers:
+            # Text before the Feature line is no description; keep it as a comment above it
+            self._comments.append(f"# {text}")
+            return
+        if self._step is not None:
+            self._step.notes.append(text)
+        elif isinstance(self._table_target, Examples):
+            self._table_target.description.append(text)
+        else:
+            self._node.description.append(text)
+
+
+def parse_gherkin(text: str) -> Feature:
+    """Parse a complete Gherkin document"""
+    parser = GherkinParser()
+    parser.feed(text)
+    return parser.close()
+
+
+def format_table(rows: List[List[str]], indent: str) -> List[str]:
+    """Format table rows with every column padded to its widest cell"""
+    if not rows:
+        return []
+    columns = max(len(row) for row in rows)
+    widths = [max((len(row[i]) for row in rows if i < len(row)), default=0) for i in range(columns)]
+    lines = []
+    for row in rows:
+        cells = [(row[i] if i < len(row) else '').ljust(widths[i]) for i in range(columns)]
+        lines.append(f"{indent}| {' | '.join(cells)} |")
+    return lines
+
+
+def _header_lines(node, indent: str) -> List[str]:
+    lines = [indent + comment for comment in node.comments]
+    if node.tags:
+        lines.append(indent + ' '.join(node.tags))
+    if node.keyword:
+        lines.append(f"{indent}{node.keyword}: {node.name}".rstrip())
+    return lines
+
+
+def _format_steps(steps: List[Step], indent: str) -> List[str]:
+    lines = []
+    for step in steps:
+        lines.extend(indent + comment for comment in step.comments)
+        lines.append(f"{indent}{step.keyword} {step.text}".rstrip())
+        if step.table:
+            lines.extend(format_table(step.table, indent + INDENT))
+        if step.doc_string is not None:
+            doc = step.doc_string
+            inner = indent + INDENT
+            lines.append(f"{inner}{doc.delimiter}{doc.media_type}")
+            for doc_line in doc.lines:
+                # Keep the content's indentation relative to its opening delimiter
+                content = doc_line[doc.indent:] if doc_line[:doc.indent].strip() == '' else doc_line.lstrip()
+                lines.append((inner + content).rstrip() if content.strip() else '')
+            lines.append(f"{inner}{doc.delimiter}")
+        lines.extend(indent + note for note in step.notes)
+    return lines
+
+
+def _format_scenario(scenario: Scenario, indent: str) -> List[str]:
+    lines = _header_lines(scenario, indent)
+    body_indent = indent + INDENT
+    lines.extend(body_indent + text for text in scenario.description)
+    lines.extend(_format_steps(scenario.steps, body_indent))
+    for examples in scenario.examples:
+        lines.extend(_header_lines(examples, body_indent))
+        lines.extend(body_indent + INDENT + text for text in examples.description)
+        lines.extend(format_table(examples.rows, body_indent + INDENT))
+    return lines
+
+
+def format_feature(feature: Feature) -> str:
+    """
+    Serialize a document with canonical formatting.
+
+    Feature line and description at column 0 (the user story lines stay
+    flush left), Background, Scenario and Rule blocks indented by two
+    spaces with one blank line between blocks, steps and Examples by four,
+    tables and doc strings by six, and table columns aligned. Blocks inside
+    a Rule are indented one more level.
+    """
+    blocks = []
+    header = _header_lines(feature, '') + feature.description
+    if header:
+        blocks.append(header)
+
+    def add_children(container, indent: str) -> None:
+        if container.background is not None:
+            blocks.append(_format_scenario(container.background, indent))
+        for child in container.children:
+            if isinstance(child, Rule):
+                rule_lines = _header_lines(child, indent) + [indent + INDENT + text for text in child.description]
+                blocks.append(rule_lines)
+                add_children(child, indent + INDENT)
+            else:
+                blocks.append(_format_scenario(child, indent))
+
+    add_children(feature, INDENT)
+    if feature.trailing_comments:
+        blocks.append(list(feature.trailing_comments))
+    return '\n\n'.join('\n'.join(block) for block in blocks if block)
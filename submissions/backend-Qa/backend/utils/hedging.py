@@ -0,0 +1,333 @@
+"""
+Hedged model calls: a duplicate call for calls that are slower than usual.
+
+Most calls to a model return within a few seconds, but now and then one
+stalls for far longer, and a pipeline of several calls is as slow as its
+slowest one. A hedged call waits up to a percentile of the latencies seen
+for its model; if it has not returned by then, the same prompt is sent
+again on a second agent and whichever answer arrives first is used.
+
+In the threaded path the loser cannot be cancelled and its tokens are spent
+(async calls cancel it, but its prompt is still paid), so hedges are paid
+for from a budget: the tokens of all hedges may not exceed a percentage of
+the tokens of all regular calls. Streamed calls are never hedged.
+
+Environment:
+    HEDGING_ENABLED: Set to 'true' to hedge non-streamed model calls (default 'false')
+    HEDGE_PERCENTILE: Latency percentile of the model after which a hedge is sent (default 95)
+    HEDGE_MIN_SAMPLES: Calls of a model observed before its calls are hedged (default 20)
+    HEDGE_WINDOW: Latest calls per model the percentile is computed over (default 200)
+    HEDGE_MIN_DELAY_SECONDS: Never hedge a call earlier than this (default 1.0)
+    HEDGE_MAX_EXTRA_TOKEN_PCT: Hedge tokens as a percentage of regular tokens at most (default 10)
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+from utils.metrics import metrics
+from utils.rate_limiter import DEFAULT_OUTPUT_TOKENS
+from utils.token_counter import get_token_counter
+
+
+class HedgePolicy:
+    """Per-model latency history, the hedge delay derived from it and the extra-token budget"""
+
+    def __init__(self, percentile: float = 95, min_samples: int = 20, window: int = 200,
+                 min_delay_seconds: float = 1.0, max_extra_token_pct: float = 10):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.min_delay_seconds = min_delay_seconds
+        self.max_extra_token_pct = max_extra_token_pct
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, deque] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._regular_tokens = 0
+        self._hedge_tokens = 0
+
+    def _model_stats(self, model_id: str) -> Dict[str, float]:
+        if model_id not in self._stats:
+            self._stats[model_id] = {'calls': 0, 'hedged': 0, 'hedge_wins': 0, 'budget_denied': 0,
+                                     'regular_tokens': 0, 'hedge_tokens': 0}
+        return self._stats[model_id]
+
+    def record_latency(self, model_id: str, seconds: float) -> None:
+        """Add the duration of a successful call, hedge or not, to the model's history"""
+        with self._lock:
+            if model_id not in self._latencies:
+                self._latencies[model_id] = deque(maxlen=self.window)
+            self._latencies[model_id].append(seconds)
+
+    def hedge_delay(self, model_id: str) -> Optional[float]:
+        """Seconds to wait before hedging a call to model_id, or None while there is too little history"""
+        with self._lock:
+            latencies = sorted(self._latencies.get(model_id, ()))
+        if len(latencies) < max(self.min_samples, 1):
+            return None
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))
+        return max(latencies[index], self.min_delay_seconds)
+
+    def record_call(self, model_id: str, tokens: int) -> None:
+        """Count a regular call and its tokens, which the hedge budget is a percentage of"""
+        with self._lock:
+            stats = self._model_stats(model_id)
+            stats['calls'] += 1
+            stats['regular_tokens'] += tokens
+            self._regular_tokens += tokens
+
+    def reserve_hedge(self, model_id: str, tokens: int) -> bool:
+        """
+        Take the estimated tokens of a hedge from the budget.
+
+        Returns:
+            Whether the hedge fits in the budget; when it does, it is counted as sent
+        """
+        with self._lock:
+            stats = self._model_stats(model_id)
+            if self._hedge_tokens + tokens > self._regular_tokens * self.max_extra_token_pct / 100:
+                stats['budget_denied'] += 1
+                return False
+            stats['hedged'] += 1
+            stats['hedge_tokens'] += tokens
+            self._hedge_tokens += tokens
+            return True
+
+    def settle_hedge(self, model_id: str, estimated: int, actual: int) -> None:
+        """Replace the estimate of a finished hedge with the tokens it actually used"""
+        with self._lock:
+            self._model_stats(model_id)['hedge_tokens'] += actual - estimated
+            self._hedge_tokens += actual - estimated
+
+    def record_win(self, model_id: str) -> None:
+        with self._lock:
+            self._model_stats(model_id)['hedge_wins'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return hedge rate, win rate and token overhead overall and per model"""
+        with self._lock:
+            models = {model_id: dict(stats) for model_id, stats in self._stats.items()}
+            regular_tokens = self._regular_tokens
+            hedge_tokens = self._hedge_tokens
+        for model_id, stats in models.items():
+            stats['hedge_rate'] = round(stats['hedged'] / stats['calls'], 3) if stats['calls'] else 0.0
+            stats['win_rate'] = round(stats['hedge_wins'] / stats['hedged'], 3) if stats['hedged'] else 0.0
+            delay = self.hedge_delay(model_id)
+            stats['hedge_delay_seconds'] = round(delay, 3) if delay is not None else None
+        return {
+            'percentile': self.percentile,
+            'max_extra_token_pct': self.max_extra_token_pct,
+            'extra_token_pct': round(100 * hedge_tokens / regular_tokens, 2) if regular_tokens else 0.0,
+            'models': models
+        }
+
+
+class HedgedAgent:
+    """
+    Agent whose non-streamed calls are hedged according to a HedgePolicy.
+
+    Hedging needs two calls of the same agent in flight, and a losing call
+    keeps running after its caller moved on, so calls check out an idle
+    agent from a pool; create_duplicate builds another one when all are busy.
+    """
+
+    def __init__(self, agent, create_duplicate: Callable[[], Any], policy: HedgePolicy,
+                 executor: ThreadPoolExecutor):
+        self.agent = agent
+        self.create_duplicate = create_duplicate
+        self.policy = policy
+        self.executor = executor
+        self._idle = [agent]
+        self._pool_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.agent, name)
+
+    def _checkout(self):
+        with self._pool_lock:
+            if self._idle:
+                return self._idle.pop()
+        return self.create_duplicate()
+
+    def _call(self, prompt, kwargs: dict):
+        """Run one call on an idle agent and record its latency if it succeeded"""
+        agent = self._checkout()
+        try:
+            start = time.perf_counter()
+            response = agent.run(prompt, **kwargs)
+            self.policy.record_latency(self.agent.model.id, time.perf_counter() - start)
+            return response
+        finally:
+            with self._pool_lock:
+                self._idle.append(agent)
+
+    def _count_tokens(self, prompt, response=None) -> int:
+        counter = get_token_counter()
+        instructions = self.agent.instructions if isinstance(self.agent.instructions, str) else ''
+        tokens = sum(counter.count_many([instructions, prompt if isinstance(prompt, str) else str(prompt)]))
+        content = getattr(response, 'content', None)
+        if isinstance(content, str):
+            tokens += counter.count(content)
+        return tokens
+
+    def _future_tokens(self, prompt, future) -> int:
+        """Tokens of a finished call: prompt only if it failed or was cancelled"""
+        failed = future.cancelled() or future.exception() is not None
+        return self._count_tokens(prompt, None if failed else future.result())
+
+    def run(self, prompt, stream: bool = False, **kwargs):
+        if stream:
+            return self._stream(prompt, kwargs)
+
+        model_id = self.agent.model.id
+        delay = self.policy.hedge_delay(model_id)
+        if delay is None:
+            response = self._call(prompt, kwargs)
+            self.policy.record_call(model_id, self._count_tokens(prompt, response))
+            return response
+
+        primary = self.executor.submit(contextvars.copy_context().run, self._call, prompt, kwargs)
+        done, _ = wait([primary], timeout=delay)
+        hedge = None
+        if not done:
+            estimate = self._count_tokens(prompt) + (getattr(self.agent.model, 'max_tokens', None) or DEFAULT_OUTPUT_TOKENS)
+            if self.policy.reserve_hedge(model_id, estimate):
+                hedge = self.executor.submit(contextvars.copy_context().run, self._call, prompt, kwargs)
+                hedge.add_done_callback(lambda future: self.policy.settle_hedge(
+                    model_id, estimate, self._future_tokens(prompt, future)))
+
+        pending = {primary} if hedge is None else {primary, hedge}
+        winner = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # Prefer the primary when both finished at once; a failed call waits for the other one
+            winner = next((future for future in sorted(done, key=lambda future: future is not primary)
+                           if not future.exception()), None)
+
+        if winner is None:
+            self.policy.record_call(model_id, self._count_tokens(prompt))
+            raise primary.exception()
+
+        response = winner.result()
+        if winner is hedge:
+            self.policy.record_win(model_id)
+            # The primary may still be running; it is counted once it has finished
+            primary.add_done_callback(lambda future: self.policy.record_call(
+                model_id, self._future_tokens(prompt, future)))
+        else:
+            self.policy.record_call(model_id, self._count_tokens(prompt, response))
+        return response
+
+    async def _acall(self, prompt, kwargs: dict):
+        """Async counterpart of _call"""
+        agent = self._checkout()
+        try:
+            start = time.perf_counter()
+            response = await agent.arun(prompt, **kwargs)
+            self.policy.record_latency(self.agent.model.id, time.perf_counter() - start)
+            return response
+        finally:
+            with self._pool_lock:
+                self._idle.append(agent)
+
+    async def arun(self, prompt, **kwargs):
+        """
+        Async counterpart of run.
+
+        Unlike a thread, the losing task can be cancelled, so it stops as soon
+        as the other call has answered; its prompt tokens are still counted.
+        """
+        model_id = self.agent.model.id
+        delay = self.policy.hedge_delay(model_id)
+        if delay is None:
+            response = await self._acall(prompt, kwargs)
+            self.policy.record_call(model_id, self._count_tokens(prompt, response))
+            return response
+
+        primary = asyncio.ensure_future(self._acall(prompt, kwargs))
+        pending = {primary}
+        hedge = None
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                estimate = self._count_tokens(prompt) + (getattr(self.agent.model, 'max_tokens', None) or DEFAULT_OUTPUT_TOKENS)
+                if self.policy.reserve_hedge(model_id, estimate):
+                    hedge = asyncio.ensure_future(self._acall(prompt, kwargs))
+                    hedge.add_done_callback(lambda future: self.policy.settle_hedge(
+                        model_id, estimate, self._future_tokens(prompt, future)))
+                    pending.add(hedge)
+
+            winner = None
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((future for future in sorted(done, key=lambda future: future is not primary)
+                               if future.exception() is None), None)
+        finally:
+            # The loser (or both calls, if the caller was cancelled) stops here
+            for future in pending:
+                future.cancel()
+
+        primary.add_done_callback(lambda future: self.policy.record_call(model_id, self._future_tokens(prompt, future)))
+        if winner is None:
+            raise primary.exception()
+        if winner is hedge:
+            self.policy.record_win(model_id)
+        return winner.result()
+
+    def _stream(self, prompt, kwargs: dict):
+        """Stream a call on an idle agent without hedging it"""
+        agent = self._checkout()
+        pieces = []
+        try:
+            for event in agent.run(prompt, stream=True, **kwargs):
+                delta = getattr(event, 'content', None)
+                if isinstance(delta, str):
+                    pieces.append(delta)
+                yield event
+        finally:
+            with self._pool_lock:
+                self._idle.append(agent)
+            self.policy.record_call(self.agent.model.id,
+                                    self._count_tokens(prompt) + get_token_counter().count(''.join(pieces)))
+
+
+_policy = None
+_executor = None
+_hedging_lock = threading.Lock()
+
+
+def get_hedge_policy() -> Optional[HedgePolicy]:
+    """
+    Return the shared hedge policy if hedging is enabled, else None.
+
+    The policy is created from the environment on first use.
+    """
+    global _policy, _executor
+    if os.getenv('HEDGING_ENABLED', 'false').lower() not in ('1', 'true', 'yes'):
+        return None
+
+    with _hedging_lock:
+        if _policy is None:
+            _policy = HedgePolicy(
+                percentile=float(os.getenv('HEDGE_PERCENTILE', 95)),
+                min_samples=int(os.getenv('HEDGE_MIN_SAMPLES', 20)),
+                window=int(os.getenv('HEDGE_WINDOW', 200)),
+                min_delay_seconds=float(os.getenv('HEDGE_MIN_DELAY_SECONDS', 1.0)),
+                max_extra_token_pct=float(os.getenv('HEDGE_MAX_EXTRA_TOKEN_PCT', 10))
+            )
+            # Hedged calls and their hedges run here while the caller waits for the first answer
+            _executor = ThreadPoolExecutor(max_workers=int(os.getenv('HEDGE_WORKERS', 64)), thread_name_prefix='hedge')
+            metrics.register_collector('hedging', _policy.get_stats)
+    return _policy
+
+
+def hedge_agent(agent, create_duplicate: Callable[[], Any]):
+    """Wrap agent in a HedgedAgent when hedging is enabled, else return it unchanged"""
+    policy = get_hedge_policy()
+    if policy is None:
+        return agent
+    return HedgedAgent(agent, create_duplicate, policy, _executor)
@@ -0,0 +1,183 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from utils.metrics import metrics
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobQueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+
+class Job:
+    """A generation request executed in the background by the JobManager"""
+
+    def __init__(self, request_data: dict):
+        self.id = uuid.uuid4().hex
+        self.request_data = request_data
+        self.status = QUEUED
+        self.progress = {'done': 0, 'failed': 0, 'total': 0}
+        self.status_code = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.task = None
+
+    def update_progress(self, progress: dict) -> None:
+        self.progress = dict(progress)
+
+    def to_dict(self, include_result: bool = False) -> dict:
+        """Return the job status (and optionally its result) as a JSON-serializable dictionary"""
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'agentType': self.request_data.get('agentType'),
+            'progress': dict(self.progress),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+        if self.error:
+            data['error'] = self.error
+        if include_result and self.result is not None:
+            data['result'] = self.result
+        return data
+
+
+class JobManager:
+    """
+    Runs generation requests in the background with a fixed pool of worker tasks.
+
+    The runner is the coroutine that does the actual work for one request. It
+    receives the request data and a progress callback and returns a
+    (status code, payload) tuple, like main.run_generation.
+    """
+
+    def __init__(self, runner: Callable[[dict, Callable[[dict], None]], Awaitable[Tuple[int, dict]]],
+                 workers: int = 2, max_queued: int = 100, retention: int = 500):
+        self.runner = runner
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.retention = retention
+
+        self.jobs: Dict[str, Job] = OrderedDict()
+        self._queue = None
+        self._worker_tasks = []
+
+        metrics.register_collector('jobs', self.get_stats)
+
+    def _ensure_workers(self) -> None:
+        """Start the worker tasks on the running event loop the first time they are needed"""
+        if self._worker_tasks and not all(task.done() for task in self._worker_tasks):
+            return
+        self._queue = asyncio.Queue()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        # Re-queue anything left waiting from a previous loop
+        for job in self.jobs.values():
+            if job.status == QUEUED:
+                self._queue.put_nowait(job)
+
+    def submit(self, request_data: dict) -> Job:
+        """
+        Queue a generation request
+
+        Raises:
+            JobQueueFullError: If max_queued jobs are already waiting
+        """
+        self._ensure_workers()
+        if self._queue.qsize() >= self.max_queued:
+            raise JobQueueFullError(f'Job queue is full ({self.max_queued} jobs waiting)')
+
+        job = Job(request_data)
+        self.jobs[job.id] = job
+        self._queue.put_nowait(job)
+        self._prune()
+        metrics.increment('jobs_submitted')
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel a queued or running job
+
+        Returns:
+            True if the job was cancelled, False if it had already finished
+        """
+        job = self.jobs[job_id]
+        if job.status in FINISHED_STATES:
+            return False
+
+        if job.task is not None:
+            job.task.cancel()
+        self._finish(job, CANCELLED)
+        job.error = 'Cancelled by client'
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                # Cancelled while it was waiting in the queue
+                if job.status != QUEUED:
+                    continue
+
+                job.status = RUNNING
+                job.started_at = time.time()
+                job.task = asyncio.create_task(self.runner(job.request_data, job.update_progress))
+                try:
+                    status_code, payload = await job.task
+                    job.status_code = status_code
+                    job.result = payload
+                    if status_code == 200:
+                        self._finish(job, SUCCEEDED)
+                    else:
+                        job.error = payload.get('message', 'Generation failed')
+                        self._finish(job, FAILED)
+                except asyncio.CancelledError:
+                    # Only the job was cancelled, the worker keeps going
+                    if job.status not in FINISHED_STATES:
+                        self._finish(job, CANCELLED)
+                except Exception as e:
+                    print(f"Error running job {job.id}: {str(e)}")
+                    job.error = str(e)
+                    self._finish(job, FAILED)
+            finally:
+                job.task = None
+                self._queue.task_done()
+
+    def _finish(self, job: Job, status: str) -> None:
+        if job.status in FINISHED_STATES:
+            return
+        job.status = status
+        job.finished_at = time.time()
+        metrics.increment(f'jobs_{status}')
+
+    def _prune(self) -> None:
+        """Forget the oldest finished jobs beyond the retention limit"""
+        excess = len(self.jobs) - self.retention
+        if excess <= 0:
+            return
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.status in FINISHED_STATES][:excess]:
+            del self.jobs[job_id]
+
+    def get_stats(self) -> dict:
+        counts = {state: 0 for state in (QUEUED, RUNNING) + FINISHED_STATES}
+        for job in self.jobs.values():
+            counts[job.status] += 1
+        counts['workers'] = self.workers
+        return counts
@@ -0,0 +1,307 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from utils.metrics import metrics
+from utils.request_context import get_request_option
+
+# Sampling and output format parameters that change the model output and therefore the cache key
+MODEL_PARAM_NAMES = ('temperature', 'max_tokens', 'top_p', 'presence_penalty', 'frequency_penalty',
+                     'response_format')
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'llm_responses.sqlite3'
+)
+
+
+def make_cache_key(model_id: str, params: Dict[str, Any], instructions: Any, prompt: str) -> str:
+    """
+    Build a content-addressed key for a model call.
+
+    Args:
+        model_id: Model identifier
+        params: Sampling parameters of the call
+        instructions: System instructions given to the model
+        prompt: User prompt
+
+    Returns:
+        SHA-256 hex digest of the canonical JSON encoding of all inputs
+    """
+    payload = json.dumps(
+        {'model': model_id, 'params': params, 'instructions': instructions, 'prompt': prompt},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Persistent on-disk cache of model responses backed by SQLite.
+
+    Entries expire after ttl_seconds. When the cache holds more than
+    max_entries entries or max_bytes of response text, the least recently
+    used entries are evicted.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 5000,
+                 max_bytes: int = 200 * 1024 * 1024, ttl_seconds: Optional[float] = 7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'bypassed': 0}
+
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            model TEXT,
+            response TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created REAL NOT NULL,
+            accessed REAL NOT NULL
+        )''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT response, created FROM responses WHERE key = ?', (key,)).fetchone()
+            if row and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.stats['evictions'] += 1
+                row = None
+
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+
+            self._conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self.stats['hits'] += 1
+            return row[0]
+
+    def put(self, key: str, response: str, model: str = '') -> None:
+        """Store a response and evict entries beyond the configured limits"""
+        if not response:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, model, response, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, model, response, len(response.encode('utf-8')), now, now)
+            )
+            self.stats['stores'] += 1
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries, then least recently used ones until within limits"""
+        if self.ttl_seconds:
+            cursor = self._conn.execute('DELETE FROM responses WHERE created < ?', (now - self.ttl_seconds,))
+            self.stats['evictions'] += max(cursor.rowcount, 0)
+
+        count, total_bytes = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        if count <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+
+        stale_keys = []
+        for key, size in self._conn.execute('SELECT key, size FROM responses ORDER BY accessed ASC'):
+            if count <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            stale_keys.append((key,))
+            count -= 1
+            total_bytes -= size
+
+        self._conn.executemany('DELETE FROM responses WHERE key = ?', stale_keys)
+        self.stats['evictions'] += len(stale_keys)
+
+    def lookup(self, model_id: str, params: Dict[str, Any], instructions: Any, prompt: str):
+        """
+        Look up a model call in the cache.
+
+        The lookup is skipped when the current request set bypass_cache.
+
+        Returns:
+            Tuple of (key, cached response or None). Pass the key to put()
+            to store a freshly computed response.
+        """
+        key = make_cache_key(model_id, params, instructions, prompt)
+        if get_request_option('bypass_cache', False):
+            with self._lock:
+                self.stats['bypassed'] += 1
+            return key, None
+        return key, self.get(key)
+
+    def get_or_compute(self, model_id: str, params: Dict[str, Any], instructions: Any,
+                       prompt: str, compute: Callable[[], str]) -> str:
+        """
+        Return the cached response for a model call, computing and storing it on a miss.
+
+        When the current request set bypass_cache the lookup is skipped, but the
+        fresh response is still stored so later requests see it.
+        """
+        key, cached = self.lookup(model_id, params, instructions, prompt)
+        if cached is not None:
+            return cached
+
+        response = compute()
+        self.put(key, response, model_id)
+        return response
+
+    def clear(self) -> None:
+        """Remove every cached response"""
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters together with the current cache size"""
+        with self._lock:
+            count, total_bytes = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'entries': count,
+            'bytes': total_bytes,
+            'hit_rate': round(stats['hits'] / lookups, 3) if lookups else 0.0
+        })
+        return stats
+
+
+class CachedResponse:
+    """Response object returned on a cache hit, mirroring the agno run response"""
+
+    def __init__(self, content: str):
+        self.content = content
+        self.cached = True
+
+
+class CachedAgent:
+    """
+    Wrap an agno Agent so that run() is served from the response cache when possible.
+
+    Attributes not defined here are forwarded to the wrapped agent. Responses
+    are cached per provider, so the offline provider never serves a real
+    model's cached answers or the other way around.
+    """
+
+    def __init__(self, agent, cache: Optional['LLMResponseCache'] = None, provider: Optional[str] = None):
+        self.agent = agent
+        self.cache = cache
+        self.provider = provider
+
+    def __getattr__(self, name):
+        return getattr(self.agent, name)
+
+    def _cache_key_parts(self):
+        model = self.agent.model
+        params = {name: getattr(model, name, None) for name in MODEL_PARAM_NAMES}
+        if params['response_format'] is None:
+            # Keep the keys of entries cached before response_format was part of them
+            del params['response_format']
+        model_id = getattr(model, 'id', '')
+        if self.provider:
+            model_id = f'{self.provider}:{model_id}'
+        return model_id, params, self.agent.instructions
+
+    def run(self, prompt, **kwargs):
+        cache = self.cache or get_response_cache()
+        if cache is None or not isinstance(prompt, str):
+            return self.agent.run(prompt, **kwargs)
+
+        model_id, params, instructions = self._cache_key_parts()
+        responses = []
+
+        def compute():
+            response = self.agent.run(prompt, **kwargs)
+            responses.append(response)
+            return response.content if response else ''
+
+        content = cache.get_or_compute(model_id, params, instructions, prompt, compute)
+        # Return the real run response on a miss so callers keep its metadata
+        return responses[0] if responses else CachedResponse(content)
+
+    async def arun(self, prompt, **kwargs):
+        """Async counterpart of run; the cache itself is local SQLite and is queried inline"""
+        cache = self.cache or get_response_cache()
+        if cache is None or not isinstance(prompt, str):
+            return await self.agent.arun(prompt, **kwargs)
+
+        model_id, params, instructions = self._cache_key_parts()
+        key, cached = cache.lookup(model_id, params, instructions, prompt)
+        if cached is not None:
+            return CachedResponse(cached)
+        response = await self.agent.arun(prompt, **kwargs)
+        cache.put(key, response.content if response else '', model_id)
+        return response
+
+    def stream(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        Yield the response text as it is generated.
+
+        A cached response is yielded as a single piece. A streamed response is
+        stored in the cache once the stream completes.
+        """
+        cache = self.cache or get_response_cache()
+        key = None
+        if cache is not None:
+            model_id, params, instructions = self._cache_key_parts()
+            key, cached = cache.lookup(model_id, params, instructions, prompt)
+            if cached is not None:
+                yield cached
+                return
+
+        pieces = []
+        for event in self.agent.run(prompt, stream=True, **kwargs):
+            # Streams can contain lifecycle events without text
+            delta = getattr(event, 'content', None)
+            if isinstance(delta, str) and delta:
+                pieces.append(delta)
+                yield delta
+
+        if cache is not None:
+            cache.put(key, ''.join(pieces), model_id)
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[LLMResponseCache]:
+    """
+    Return the shared response cache, creating it from the environment on first use.
+
+    Environment:
+        LLM_CACHE_ENABLED: Set to 'false' to disable caching (default 'true')
+        LLM_CACHE_PATH: SQLite file for the cache
+        LLM_CACHE_MAX_ENTRIES: Maximum number of cached responses (default 5000)
+        LLM_CACHE_MAX_MB: Maximum total size of cached responses in MB (default 200)
+        LLM_CACHE_TTL_SECONDS: Entry lifetime in seconds, 0 for no expiry (default 7 days)
+    """
+    global _response_cache
+    if os.getenv('LLM_CACHE_ENABLED', 'true').lower() in ('0', 'false', 'no'):
+        return None
+
+    with _response_cache_lock:
+        if _response_cache is None:
+            try:
+                _response_cache = LLMResponseCache(
+                    path=os.getenv('LLM_CACHE_PATH', DEFAULT_CACHE_PATH),
+                    max_entries=int(os.getenv('LLM_CACHE_MAX_ENTRIES', 5000)),
+                    max_bytes=int(float(os.getenv('LLM_CACHE_MAX_MB', 200)) * 1024 * 1024),
+                    ttl_seconds=float(os.getenv('LLM_CACHE_TTL_SECONDS', 7 * 24 * 3600)) or None
+                )
+                metrics.register_collector('llm_cache', _response_cache.get_stats)
+            except Exception as e:
+                print(f"Error initializing LLM response cache: {str(e)}")
+                return None
+        return _response_cache
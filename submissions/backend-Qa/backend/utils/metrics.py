@@ -0,0 +1,53 @@
+import threading
+from typing import Callable, Dict, Any
+
+
+class MetricsRegistry:
+    """
+    Minimal in-process metrics registry.
+
+    Counters and gauges are plain numbers keyed by name. Components that
+    already keep their own statistics register a collector instead, which is
+    called whenever a snapshot is taken.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def increment(self, name: str, value: float = 1) -> None:
+        """Add value to the named counter"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        """Set the named gauge to value"""
+        with self._lock:
+            self._gauges[name] = value
+
+    def register_collector(self, name: str, collector: Callable[[], Dict[str, Any]]) -> None:
+        """Register a callable returning a dictionary of statistics under name"""
+        with self._lock:
+            self._collectors[name] = collector
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current value of every counter, gauge and collector"""
+        with self._lock:
+            snapshot = {
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges)
+            }
+            collectors = dict(self._collectors)
+
+        for name, collector in collectors.items():
+            try:
+                snapshot[name] = collector()
+            except Exception as e:
+                snapshot[name] = {'error': str(e)}
+        return snapshot
+
+
+# Shared registry used by the whole backend
+metrics = MetricsRegistry()
@@ -0,0 +1,208 @@
+"""
+Agent pipelines written once and run either on threads or on the event loop.
+
+A pipeline is a generator that yields the model calls it needs instead of
+making them: a ModelCall is answered with the run response (or has the
+call's exception thrown in at the yield), ConcurrentCalls with a dictionary
+of CallResult by name. Anything else a pipeline yields, such as streaming
+events, is passed through by run_events and ignored by the other drivers.
+The generator's return value is the pipeline's result.
+
+    def _pipeline(self, prompt):
+        response = yield ModelCall(self.agent, prompt)
+        return response.content
+
+run_pipeline(pipeline) makes the calls with agent.run on the current
+thread (concurrent calls on a thread pool); await arun_pipeline(pipeline)
+makes them with agent.arun, so a request waiting for a model holds no thread.
+
+Both drivers check the request's cancellation token (see utils.cancellation)
+before every model call and stop the pipeline with Cancelled, instead of
+making the call, once its request has been abandoned.
+"""
+import asyncio
+import time
+from typing import Any, Dict, Generator, Optional
+
+from utils.cancellation import current_token, record_saved
+from utils.rate_limiter import DEFAULT_OUTPUT_TOKENS
+from utils.stage_executor import run_stages_concurrently
+from utils.token_counter import get_token_counter
+
+
+class ModelCall:
+    """One model call a pipeline needs: agent.run(prompt, **kwargs)"""
+
+    def __init__(self, agent, prompt, **kwargs):
+        self.agent = agent
+        self.prompt = prompt
+        self.kwargs = kwargs
+
+
+class ConcurrentCalls:
+    """Independent model calls, keyed by name, to run side by side"""
+
+    def __init__(self, calls: Dict[str, ModelCall], max_parallel: Optional[int] = None):
+        self.calls = calls
+        self.max_parallel = max_parallel
+
+
+class CallResult:
+    """Outcome of one of ConcurrentCalls: exactly one of response and error is set"""
+
+    def __init__(self, response: Any = None, error: Optional[BaseException] = None, seconds: float = 0.0):
+        self.response = response
+        self.error = error
+        self.seconds = seconds
+
+
+def _timed_run(call: ModelCall) -> CallResult:
+    start = time.perf_counter()
+    response = call.agent.run(call.prompt, **call.kwargs)
+    return CallResult(response, seconds=round(time.perf_counter() - start, 3))
+
+
+def _run_call(item):
+    """Make the calls of a ModelCall or ConcurrentCalls on threads"""
+    if isinstance(item, ModelCall):
+        return item.agent.run(item.prompt, **item.kwargs)
+    results = run_stages_concurrently(
+        {name: (lambda call=call: _timed_run(call)) for name, call in item.calls.items()},
+        max_workers=item.max_parallel
+    )
+    return {name: result if error is None else CallResult(error=error) for name, (result, error) in results.items()}
+
+
+async def _arun_call(item):
+    """Make the calls of a ModelCall or ConcurrentCalls on the event loop"""
+    if isinstance(item, ModelCall):
+        return await item.agent.arun(item.prompt, **item.kwargs)
+
+    semaphore = asyncio.Semaphore(max(1, item.max_parallel or len(item.calls)))
+
+    async def timed(call: ModelCall) -> CallResult:
+        async with semaphore:
+            start = time.perf_counter()
+            response = await call.agent.arun(call.prompt, **call.kwargs)
+            return CallResult(response, seconds=round(time.perf_counter() - start, 3))
+
+    names = list(item.calls)
+    outcomes = await asyncio.gather(*(timed(item.calls[name]) for name in names), return_exceptions=True)
+    results = {}
+    for name, outcome in zip(names, outcomes):
+        if isinstance(outcome, asyncio.CancelledError):
+            raise outcome
+        results[name] = outcome if isinstance(outcome, CallResult) else CallResult(error=outcome)
+    return results
+
+
+def _is_call(item) -> bool:
+    return isinstance(item, (ModelCall, ConcurrentCalls))
+
+
+def _calls(item) -> list:
+    return [item] if isinstance(item, ModelCall) else list(item.calls.values())
+
+
+def _output_tokens(call: ModelCall) -> int:
+    model = getattr(call.agent, 'model', None)
+    return getattr(model, 'max_tokens', None) or DEFAULT_OUTPUT_TOKENS
+
+
+def _estimated_tokens(call: ModelCall) -> int:
+    """Tokens of a call as the rate limiter estimates them: instructions, prompt and max_tokens"""
+    instructions = getattr(call.agent, 'instructions', None)
+    texts = [instructions if isinstance(instructions, str) else '',
+             call.prompt if isinstance(call.prompt, str) else str(call.prompt)]
+    return sum(get_token_counter().count_many(texts)) + _output_tokens(call)
+
+
+def _checkpoint(item) -> None:
+    """
+    Stop the pipeline if its request was abandoned.
+
+    Args:
+        item: The ModelCall or ConcurrentCalls about to be made, counted as saved
+
+    Raises:
+        Cancelled: If the request's cancellation token is cancelled
+    """
+    token = current_token()
+    if token is None or not token.cancelled:
+        return
+    calls = _calls(item)
+    record_saved(len(calls), sum(_estimated_tokens(call) for call in calls))
+    print(f"Stopping abandoned generation: {token.reason}")
+    token.raise_if_cancelled()
+
+
+def run_events(pipeline: Generator):
+    """
+    Make a pipeline's model calls on the current thread, yielding its other items.
+
+    Use with yield from inside streaming generators.
+
+    Returns:
+        The pipeline's return value
+    """
+    value = None
+    error = None
+    try:
+        while True:
+            try:
+                item = pipeline.throw(error) if error is not None else pipeline.send(value)
+            except StopIteration as stop:
+                return stop.value
+            value = error = None
+            if _is_call(item):
+                _checkpoint(item)
+                try:
+                    value = _run_call(item)
+                except Exception as e:
+                    error = e
+            else:
+                yield item
+    finally:
+        # Unwind the pipeline (and its request scope) here when it is abandoned
+        pipeline.close()
+
+
+def run_pipeline(pipeline: Generator) -> Any:
+    """Run a pipeline to completion on the current thread and return its result"""
+    return _drain(run_events(pipeline))
+
+
+def _drain(events: Generator) -> Any:
+    """Exhaust a generator, discarding what it yields, and return its return value"""
+    while True:
+        try:
+            next(events)
+        except StopIteration as stop:
+            return stop.value
+
+
+async def arun_pipeline(pipeline: Generator) -> Any:
+    """Run a pipeline to completion on the event loop and return its result"""
+    value = None
+    error = None
+    try:
+        while True:
+            try:
+                item = pipeline.throw(error) if error is not None else pipeline.send(value)
+            except StopIteration as stop:
+                return stop.value
+            value = error = None
+            if _is_call(item):
+                _checkpoint(item)
+                try:
+                    value = await _arun_call(item)
+                except asyncio.CancelledError:
+                    # Interrupted mid-call: the prompt was sent, the rest of the output is saved
+                    calls = _calls(item)
+                    record_saved(len(calls), sum(_output_tokens(call) for call in calls))
+                    raise
+                except Exception as e:
+                    error = e
+    finally:
+        # A cancelled task unwinds the pipeline (and its request scope) in its own context
+        pipeline.close()
@@ -0,0 +1,218 @@
+import os
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+from utils.circuit_breaker import guard_agent
+from utils.hedging import hedge_agent
+from utils.llm_cache import CachedAgent
+from utils.rate_limiter import RateLimitedAgent, get_rate_scheduler
+
+# Sampling and output format parameters accepted by create_agent and passed on to the provider
+MODEL_PARAMS = ('temperature', 'max_tokens', 'top_p', 'presence_penalty', 'frequency_penalty',
+                'response_format')
+
+
+class ModelConfig:
+    """Model id and sampling parameters of an agent, shaped like an agno model"""
+
+    def __init__(self, model_id: str, provider: str, **params):
+        self.id = model_id
+        self.provider = provider
+        for name in MODEL_PARAMS:
+            setattr(self, name, params.get(name))
+
+    def params(self) -> Dict[str, Any]:
+        """Return the sampling parameters that were set"""
+        return {name: getattr(self, name) for name in MODEL_PARAMS if getattr(self, name) is not None}
+
+
+class ModelResponse:
+    """Run response (or streamed chunk) returned by the non-agno agents, mirroring agno's"""
+
+    def __init__(self, content: str):
+        self.content = content
+
+
+class ModelProvider:
+    """
+    Base class for model providers.
+
+    A provider turns a model id, instructions and sampling parameters into an
+    agent object with the interface the agents rely on: run(prompt) returning
+    a response with .content, run(prompt, stream=True) yielding chunks with
+    .content, the coroutine arun(prompt) returning a response, plus .model
+    and .instructions.
+    """
+
+    name = ''
+
+    def create_agent(self, model_id: str, instructions: str, markdown: bool = False, **params):
+        raise NotImplementedError
+
+
+class GroqProvider(ModelProvider):
+    """Groq-hosted models through agno"""
+
+    name = 'groq'
+
+    def create_agent(self, model_id: str, instructions: str, markdown: bool = False, **params):
+        # agno is imported here so processes using another provider never load it
+        from agno.agent import Agent
+        from agno.models.groq import Groq
+
+        return Agent(
+            model=Groq(id=model_id, **params),
+            instructions=instructions,
+            markdown=markdown
+        )
+
+
+class OpenAIChatAgent:
+    """Minimal agent running prompts against the OpenAI chat completions API"""
+
+    def __init__(self, client, model: ModelConfig, instructions: str, async_client=None):
+        self.client = client
+        self.async_client = async_client
+        self.model = model
+        self.instructions = instructions
+
+    def _messages(self, prompt: str) -> list:
+        messages = []
+        if self.instructions:
+            messages.append({"role": "system", "content": self.instructions})
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    def run(self, prompt: str, stream: bool = False, **kwargs):
+        if stream:
+            return self._stream(prompt)
+
+        response = self.client.chat.completions.create(
+            model=self.model.id,
+            messages=self._messages(prompt),
+            **self.model.params()
+        )
+        return ModelResponse(response.choices[0].message.content or '')
+
+    async def arun(self, prompt: str, **kwargs) -> ModelResponse:
+        response = await self.async_client.chat.completions.create(
+            model=self.model.id,
+            messages=self._messages(prompt),
+            **self.model.params()
+        )
+        return ModelResponse(response.choices[0].message.content or '')
+
+    def _stream(self, prompt: str) -> Iterator[ModelResponse]:
+        for chunk in self.client.chat.completions.create(
+            model=self.model.id,
+            messages=self._messages(prompt),
+            stream=True,
+            **self.model.params()
+        ):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield ModelResponse(chunk.choices[0].delta.content)
+
+
+class OpenAIProvider(ModelProvider):
+    """OpenAI chat models through the openai client"""
+
+    name = 'openai'
+
+    def __init__(self):
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    def _get_clients(self):
+        """Return the shared sync and async clients, which keep their connection pools between agents"""
+        with self._lock:
+            if self._client is None:
+                import openai
+
+                api_key = os.getenv("OPENAI_API_KEY")
+                if not api_key:
+                    print("Warning: OPENAI_API_KEY not found in environment variables")
+                    api_key = "dummy_key"  # Placeholder for testing
+                self._client = openai.OpenAI(api_key=api_key)
+                self._async_client = openai.AsyncOpenAI(api_key=api_key)
+            return self._client, self._async_client
+
+    def create_agent(self, model_id: str, instructions: str, markdown: bool = False, **params):
+        client, async_client = self._get_clients()
+        return OpenAIChatAgent(client, ModelConfig(model_id, self.name, **params), instructions, async_client)
+
+
+class OfflineProvider(ModelProvider):
+    """Deterministic local stand-in for the hosted models, for load tests and benchmarks"""
+
+    name = 'offline'
+
+    def create_agent(self, model_id: str, instructions: str, markdown: bool = False, **params):
+        from utils.offline_model import OfflineAgent
+
+        return OfflineAgent(ModelConfig(model_id, self.name, **params), instructions)
+
+
+PROVIDERS = {
+    GroqProvider.name: GroqProvider,
+    OpenAIProvider.name: OpenAIProvider,
+    OfflineProvider.name: OfflineProvider
+}
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(name: Optional[str] = None) -> ModelProvider:
+    """
+    Return the shared provider instance for name.
+
+    The MODEL_PROVIDER environment variable, when set, overrides the provider
+    requested by every agent, e.g. MODEL_PROVIDER=offline runs the whole
+    service without network access.
+    """
+    name = (os.getenv('MODEL_PROVIDER') or name or GroqProvider.name).lower()
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown model provider: {name}. Available: {', '.join(PROVIDERS)}")
+
+    with _providers_lock:
+        if name not in _providers:
+            _providers[name] = PROVIDERS[name]()
+        return _providers[name]
+
+
+def create_agent(model_id: str, instructions: str, provider: Optional[str] = None,
+                 markdown: bool = False, **params) -> CachedAgent:
+    """
+    Build an agent for a model through the configured provider.
+
+    Args:
+        model_id: Model identifier, e.g. "llama-3.3-70b-versatile"
+        instructions: System instructions for the agent
+        provider: Provider the agent is meant for (default 'groq'); MODEL_PROVIDER overrides it
+        markdown: Whether the agent should format output as markdown
+        **params: Sampling parameters (temperature, max_tokens, top_p, ...) and response_format
+
+    Returns:
+        The agent wrapped in the rate scheduler (for rate limited providers), hedging (when
+        enabled), the model's circuit breaker and the LLM response cache
+    """
+    unknown = set(params) - set(MODEL_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown model parameters: {', '.join(sorted(unknown))}")
+
+    model_provider = get_provider(provider)
+    scheduler = get_rate_scheduler(model_provider.name)
+
+    def build_agent():
+        agent = model_provider.create_agent(model_id, instructions, markdown=markdown, **params)
+        # Cache hits never reach the rate limiter; only calls going to the provider use budget
+        if scheduler is not None:
+            agent = RateLimitedAgent(agent, scheduler)
+        return agent
+
+    # A hedge runs on a duplicate of the agent, which takes rate limit budget like any call
+    agent = hedge_agent(build_agent(), build_agent)
+    # Cached responses are still served while the model's circuit breaker is open
+    agent = guard_agent(agent, model_id)
+    return CachedAgent(agent, provider=model_provider.name)
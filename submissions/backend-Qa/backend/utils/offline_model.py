@@ -0,0 +1,367 @@
+"""
+Offline stand-in for the hosted models.
+
+OfflineAgent answers prompts locally with deterministic, realistically sized
+Gherkin features, manual test cases, Selenium scripts or chat replies. The
+same model, instructions and prompt always produce the same text. Latency is
+simulated as time to first token plus output tokens divided by throughput,
+both drawn from configurable distributions, so the service can be load tested
+and benchmarked on an isolated machine.
+
+Environment:
+    OFFLINE_MODEL_LATENCY_MS: Mean time to first token in ms (default 300)
+    OFFLINE_MODEL_TOKENS_PER_SECOND: Mean output throughput (default 200)
+    OFFLINE_MODEL_OUTPUT_TOKENS: Mean response length in tokens, capped by max_tokens (default 500)
+    OFFLINE_MODEL_DISTRIBUTION: 'fixed', 'uniform' or 'lognormal' (default 'lognormal')
+    OFFLINE_MODEL_SPREAD: Relative spread of the distributions (default 0.25)
+    OFFLINE_MODEL_SEED: Seed for generated text and latency sequence (default 0)
+    OFFLINE_MODEL_PROFILES: JSON object of per-model overrides, e.g.
+        {"llama-3.3-70b-versatile": {"tokens_per_second": 400}}
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Iterator, List
+
+from utils.model_provider import ModelConfig, ModelResponse
+
+# Rough characters per token of English text and code
+CHARS_PER_TOKEN = 4
+
+# Tokens per streamed chunk
+STREAM_CHUNK_TOKENS = 8
+
+DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal')
+
+STOPWORDS = {
+    'about', 'after', 'also', 'and', 'based', 'before', 'between', 'both', 'create', 'does', 'each',
+    'following', 'for', 'from', 'generate', 'have', 'include', 'into', 'only', 'should', 'that',
+    'their', 'them', 'then', 'there', 'these', 'they', 'this', 'those', 'want', 'were', 'what',
+    'when', 'where', 'which', 'will', 'with', 'would', 'your', 'given', 'scenario', 'scenarios',
+    'feature', 'gherkin', 'test', 'tests', 'user', 'story', 'stories', 'able', 'must', 'need'
+}
+
+ACTIONS = ('submits', 'opens', 'updates', 'searches for', 'deletes', 'uploads', 'saves', 'cancels')
+OUTCOMES = ('a confirmation message is shown', 'the change is persisted', 'the list is refreshed',
+            'an audit entry is recorded', 'the user is redirected to the overview page')
+ERRORS = ('an empty required field', 'a value above the maximum length', 'an expired session',
+          'a duplicate entry', 'a script injection payload', 'a network timeout')
+DATA_VALUES = ('Email: jane.doe@example.com, Password: Str0ngP@ss!', 'Name: O\'Brien-Smith, Age: 42',
+               'Amount: 0.01 (minimum allowed)', 'Amount: 1000000 (above limit)',
+               'Search term: \'café@123_テスト\'', 'Date: 31/02/2024 (invalid date)',
+               'Username: (empty), Password: (empty)', 'Comment: <script>alert(1)</script>')
+
+
+def _sample(rng: random.Random, mean: float, distribution: str, spread: float) -> float:
+    """Draw a positive value with the given mean from the named distribution"""
+    if mean <= 0 or distribution == 'fixed' or spread <= 0:
+        return max(mean, 0.0)
+    if distribution == 'uniform':
+        return rng.uniform(mean * max(1 - spread, 0.0), mean * (1 + spread))
+    # Lognormal with the requested mean, i.e. a long tail of slow calls
+    return mean * rng.lognormvariate(-spread ** 2 / 2, spread)
+
+
+class OfflineModelProfile:
+    """Latency and response-length distribution of one offline model"""
+
+    def __init__(self, latency_ms: float = 300, tokens_per_second: float = 200, output_tokens: int = 500,
+                 distribution: str = 'lognormal', spread: float = 0.25):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown distribution: {distribution}. Available: {', '.join(DISTRIBUTIONS)}")
+        self.latency_ms = float(latency_ms)
+        self.tokens_per_second = float(tokens_per_second)
+        self.output_tokens = int(output_tokens)
+        self.distribution = distribution
+        self.spread = float(spread)
+
+    @classmethod
+    def from_env(cls, model_id: str = '') -> 'OfflineModelProfile':
+        """Build the profile of model_id from the OFFLINE_MODEL_* environment variables"""
+        settings = {
+            'latency_ms': float(os.getenv('OFFLINE_MODEL_LATENCY_MS', 300)),
+            'tokens_per_second': float(os.getenv('OFFLINE_MODEL_TOKENS_PER_SECOND', 200)),
+            'output_tokens': int(os.getenv('OFFLINE_MODEL_OUTPUT_TOKENS', 500)),
+            'distribution': os.getenv('OFFLINE_MODEL_DISTRIBUTION', 'lognormal').lower(),
+            'spread': float(os.getenv('OFFLINE_MODEL_SPREAD', 0.25))
+        }
+        overrides = os.getenv('OFFLINE_MODEL_PROFILES')
+        if overrides:
+            try:
+                settings.update(json.loads(overrides).get(model_id, {}))
+            except (ValueError, AttributeError) as e:
+                print(f"Error parsing OFFLINE_MODEL_PROFILES: {str(e)}")
+        return cls(**settings)
+
+    def sample_first_token_seconds(self, rng: random.Random) -> float:
+        return _sample(rng, self.latency_ms, self.distribution, self.spread) / 1000
+
+    def sample_tokens_per_second(self, rng: random.Random) -> float:
+        return max(_sample(rng, self.tokens_per_second, self.distribution, self.spread), 1.0)
+
+    def sample_output_tokens(self, rng: random.Random, max_tokens=None) -> int:
+        tokens = max(int(_sample(rng, self.output_tokens, self.distribution, self.spread)), 16)
+        return min(tokens, max_tokens) if max_tokens else tokens
+
+
+# Latency draws come from one seeded sequence so a benchmark run is reproducible
+_latency_rng = random.Random(os.getenv('OFFLINE_MODEL_SEED', '0'))
+_latency_lock = threading.Lock()
+
+
+class OfflineAgent:
+    """Agent answering prompts with synthetic text, with the same interface as an agno Agent"""
+
+    def __init__(self, model: ModelConfig, instructions: str, profile: OfflineModelProfile = None):
+        self.model = model
+        self.instructions = instructions or ''
+        self.profile = profile or OfflineModelProfile.from_env(model.id)
+
+    def run(self, prompt: str, stream: bool = False, **kwargs):
+        content = self.generate(prompt)
+        with _latency_lock:
+            first_token = self.profile.sample_first_token_seconds(_latency_rng)
+            tokens_per_second = self.profile.sample_tokens_per_second(_latency_rng)
+
+        if stream:
+            return self._stream(content, first_token, tokens_per_second)
+
+        time.sleep(first_token + len(content) / CHARS_PER_TOKEN / tokens_per_second)
+        return ModelResponse(content)
+
+    async def arun(self, prompt: str, **kwargs) -> ModelResponse:
+        """Async counterpart of run: the simulated latency is spent on the event loop"""
+        content = self.generate(prompt)
+        with _latency_lock:
+            first_token = self.profile.sample_first_token_seconds(_latency_rng)
+            tokens_per_second = self.profile.sample_tokens_per_second(_latency_rng)
+        await asyncio.sleep(first_token + len(content) / CHARS_PER_TOKEN / tokens_per_second)
+        return ModelResponse(content)
+
+    def _stream(self, content: str, first_token: float, tokens_per_second: float) -> Iterator[ModelResponse]:
+        time.sleep(first_token)
+        chunk_chars = STREAM_CHUNK_TOKENS * CHARS_PER_TOKEN
+        for start in range(0, len(content), chunk_chars):
+            if start:
+                time.sleep(STREAM_CHUNK_TOKENS / tokens_per_second)
+            yield ModelResponse(content[start:start + chunk_chars])
+
+    def generate(self, prompt: str) -> str:
+        """Return the deterministic response text for prompt, without simulated latency"""
+        seed_text = '\n'.join([self.model.id, self.instructions, prompt, os.getenv('OFFLINE_MODEL_SEED', '0')])
+        rng = random.Random(int(hashlib.sha256(seed_text.encode('utf-8')).hexdigest()[:16], 16))
+        target_tokens = self.profile.sample_output_tokens(rng, self.model.max_tokens)
+        topic = _topic_words(prompt, rng)
+
+        kind = _detect_kind(self.instructions, prompt)
+        if kind == 'selenium':
+            content = _selenium_script(topic, rng, target_tokens)
+        elif kind == 'manual' and self.model.response_format:
+            content = _manual_test_cases_json(prompt, topic, rng, target_tokens)
+        elif kind == 'manual':
+            content = _manual_test_cases(prompt, topic, rng, target_tokens)
+        elif kind == 'gherkin':
+            content = _gherkin(prompt, topic, rng, target_tokens)
+        else:
+            content = _chat_reply(topic, rng, target_tokens)
+
+        # Respect max_tokens like a real model would, cutting the text off
+        if self.model.max_tokens:
+            content = content[:self.model.max_tokens * CHARS_PER_TOKEN]
+        return content
+
+
+def _detect_kind(instructions: str, prompt: str) -> str:
+    """Guess which kind of output the caller expects from its instructions and prompt"""
+    for text in (instructions.lower(), prompt.lower()):
+        if 'selenium' in text:
+            return 'selenium'
+        if 'manual test case' in text or 'test case id' in text:
+            return 'manual'
+        if 'gherkin' in text or 'feature file' in text:
+            return 'gherkin'
+    return 'chat'
+
+
+def _topic_words(prompt: str, rng: random.Random) -> List[str]:
+    """Pick the words the response should be about from the prompt"""
+    # Prefer the requirement embedded in the prompt templates
+    match = re.search(r'(?:for|scenario|requirement):\s*(.+)', prompt, re.IGNORECASE)
+    text = match.group(1) if match else prompt
+    words = []
+    for word in re.findall(r'[A-Za-z]{4,}', text):
+        word = word.lower()
+        if word not in STOPWORDS and word not in words:
+            words.append(word)
+        if len(words) == 6:
+            break
+    return words[:3] if words else rng.choice([['account', 'settings'], ['order', 'checkout'], ['profile', 'page']])
+
+
+def _estimate_tokens(lines: List[str]) -> int:
+    return sum(len(line) + 1 for line in lines) // CHARS_PER_TOKEN
+
+
+def _gherkin_scenario(topic: List[str], rng: random.Random, number: int, negative: bool) -> List[str]:
+    subject = ' '.join(topic)
+    if negative:
+        error = rng.choice(ERRORS)
+        return [
+            f"  @negative @{topic[0]}",
+            f"  Scenario: Reject {subject} with {error} ({number})",
+            f"    Given the user is on the {topic[0]} page",
+            f"    When the user {rng.choice(ACTIONS)} the {subject} with {error}",
+            f"    Then an error message explaining {error} is displayed",
+            f"    And the {subject} is not changed",
+            ""
+        ]
+    return [
+        f"  @happy_path @{topic[0]}",
+        f"  Scenario: User {rng.choice(ACTIONS)} the {subject} ({number})",
+        f"    Given the user is logged in",
+        f"    And the user is on the {topic[0]} page",
+        f"    When the user {rng.choice(ACTIONS)} the {subject}",
+        f"    Then {rng.choice(OUTCOMES)}",
+        ""
+    ]
+
+
+def _gherkin(prompt: str, topic: List[str], rng: random.Random, target_tokens: int) -> str:
+    title = ' '.join(word.capitalize() for word in topic)
+    header = [
+        f"Feature: {title}",
+        f"  As a registered user",
+        f"  I want to manage the {' '.join(topic)}",
+        f"  So that my data stays accurate",
+        "",
+        "  Background:",
+        f"    Given the {topic[0]} service is available",
+        ""
+    ]
+    if 'ONLY the Feature header' in prompt:
+        return '\n'.join(header).rstrip()
+
+    lines = []
+    if 'Do NOT include the Feature header' not in prompt:
+        # Improve passes return the draft with extra scenarios appended
+        draft = re.search(r'Improve this Gherkin feature file:\n\n(.*?)\n\nIMPORTANT:', prompt, re.DOTALL)
+        lines = draft.group(1).rstrip().split('\n') + [""] if draft else header
+
+    negative = 'edge cases' in prompt
+    number = 1
+    while number == 1 or _estimate_tokens(lines) < target_tokens:
+        lines.extend(_gherkin_scenario(topic, rng, number, negative or number % 3 == 0))
+        number += 1
+    return '\n'.join(lines).rstrip()
+
+
+def _manual_test_case(topic: List[str], rng: random.Random, number: int) -> List[str]:
+    subject = ' '.join(topic)
+    data_sets = rng.sample(DATA_VALUES, 5)
+    return [
+        f"Test Case ID: TC_{number:03d}",
+        f"Description: Verify the user {rng.choice(ACTIONS)} the {subject}",
+        "Test Steps:",
+        f"1. Open the {topic[0]} page",
+        f"2. Enter the test data into the {subject} form",
+        "3. Submit the form",
+        "4. Observe the result",
+    ] + [f"Test Data Set {i}: {value}" for i, value in enumerate(data_sets, 1)] + [
+        f"Expected Result: For valid data {rng.choice(OUTCOMES)}; invalid data shows a validation error",
+        ""
+    ]
+
+
+def _manual_test_cases(prompt: str, topic: List[str], rng: random.Random, target_tokens: int) -> str:
+    # Improve passes return the existing cases, which already hold concrete values
+    draft = re.search(r'improve these test cases.*?:\n(.*?)\n\nRequired Improvements:', prompt, re.DOTALL)
+    if draft:
+        return draft.group(1).strip()
+
+    lines = []
+    number = 1
+    while number == 1 or _estimate_tokens(lines) < target_tokens:
+        lines.extend(_manual_test_case(topic, rng, number))
+        number += 1
+    return '\n'.join(lines).rstrip()
+
+
+def _manual_test_cases_json(prompt: str, topic: List[str], rng: random.Random, target_tokens: int) -> str:
+    """Manual test cases in structured output mode; repair requests get their cases back with concrete data"""
+    repair = re.search(r'<test_cases>\n(.*?)\n</test_cases>', prompt, re.DOTALL)
+    if repair:
+        cases = json.loads(repair.group(1))
+        for case in cases:
+            for number in range(1, 6):
+                value = case.get(f'Test Data Set {number}')
+                if not value or ':' not in value:
+                    case[f'Test Data Set {number}'] = rng.choice(DATA_VALUES)
+        return json.dumps({'test_cases': cases}, ensure_ascii=False)
+
+    cases = []
+    while not cases or _estimate_tokens([json.dumps(cases)]) < target_tokens:
+        lines = _manual_test_case(topic, rng, len(cases) + 1)
+        case = dict(line.split(': ', 1) for line in lines if ': ' in line and not line[0].isdigit())
+        case['Test Steps'] = [line.split('. ', 1)[1] for line in lines if line[:1].isdigit()]
+        # Like the hosted models, now and then describe a data set instead of giving values
+        if rng.random() < 0.2:
+            case[f'Test Data Set {rng.randint(1, 5)}'] = 'Invalid input data'
+        cases.append(case)
+    return json.dumps({'test_cases': cases}, ensure_ascii=False)
+
+
+def _selenium_script(topic: List[str], rng: random.Random, target_tokens: int) -> str:
+    name = '_'.join(topic)
+    lines = [
+        "```python",
+        "from selenium import webdriver",
+        "from selenium.webdriver.common.by import By",
+        "from selenium.webdriver.support.ui import WebDriverWait",
+        "from selenium.webdriver.support import expected_conditions as EC",
+        "import pytest",
+        "",
+        "",
+        "@pytest.fixture",
+        "def driver():",
+        "    driver = webdriver.Chrome()",
+        "    driver.implicitly_wait(5)",
+        "    yield driver",
+        "    driver.quit()",
+        ""
+    ]
+    number = 1
+    while number == 1 or _estimate_tokens(lines) < target_tokens:
+        element = rng.choice(('submit', 'save', 'search', 'confirm'))
+        lines.extend([
+            "",
+            f"def test_{name}_{number}(driver):",
+            f'    """Verify the user {rng.choice(ACTIONS)} the {" ".join(topic)}"""',
+            f'    driver.get("https://example.com/{topic[0]}")',
+            "    wait = WebDriverWait(driver, 10)",
+            f'    wait.until(EC.element_to_be_clickable((By.ID, "{element}"))).click()',
+            '    message = wait.until(EC.visibility_of_element_located((By.CSS_SELECTOR, ".message")))',
+            "    assert message.is_displayed()",
+            ""
+        ])
+        number += 1
+    lines.append("```")
+    return '\n'.join(lines)
+
+
+def _chat_reply(topic: List[str], rng: random.Random, target_tokens: int) -> str:
+    subject = ' '.join(topic)
+    sentences = [
+        f"To test the {subject}, start with the main user flow and confirm that {rng.choice(OUTCOMES)}.",
+        f"Then cover negative cases such as {rng.choice(ERRORS)} and {rng.choice(ERRORS)}.",
+        f"Automate the stable paths with Selenium or Playwright and keep exploratory sessions for the {topic[0]} edge cases.",
+        "Track each defect with clear reproduction steps and the exact test data used."
+    ]
+    lines = []
+    while not lines or _estimate_tokens(lines) < min(target_tokens, 200):
+        lines.append(sentences[len(lines) % len(sentences)])
+    return ' '.join(lines)
@@ -0,0 +1,239 @@
+"""
+Local quality scoring of generated drafts, used to skip improve passes.
+
+An improve pass re-sends the whole draft and has the model write it again,
+which makes it the most expensive call of a generation. The scorers here
+check a draft without calling a model; when every check meets its
+threshold the draft is kept as it is.
+
+Environment:
+    QUALITY_GATE_ENABLED: Set to 'false' to always run the improve passes (default 'true')
+    QUALITY_MIN_SCENARIOS: Gherkin scenarios a draft needs (default 4)
+    QUALITY_MIN_STEP_COMPLETENESS: Share of scenarios with Given, When and Then (default 0.9)
+    QUALITY_MIN_TAG_COVERAGE: Share of scenarios with a tag (default 0.8)
+    QUALITY_MIN_NEGATIVE: Negative or edge case scenarios / test cases a draft needs (default 1)
+    QUALITY_MIN_TEST_CASES: Manual test cases a draft needs (default 3)
+    QUALITY_MIN_CONCRETE_DATA: Share of test data sets that are not placeholders (default 1.0)
+"""
+import os
+import re
+from typing import Dict, List, Optional
+
+from utils.gherkin_parser import Scenario, parse_gherkin
+from utils.metrics import metrics
+from utils.test_case_parser import DATA_SET_COUNT
+from utils.test_case_schema import GENERIC_TEST_DATA
+
+# Words marking a scenario or test case as negative or edge case coverage
+NEGATIVE_MARKERS = re.compile(
+    r'\b(?:negative|edge|boundary|invalid|error|errors|fail|fails|failed|failure|reject|rejected|denied|'
+    r'unauthori[sz]ed|forbidden|expired|empty|missing|exceed|exceeds|exceeding|maximum|minimum|limit|'
+    r'duplicate|wrong|incorrect|malformed|timeout|injection|locked|not allowed|cannot|security)\b',
+    re.IGNORECASE
+)
+
+# Values left for someone to fill in: TBD, TODO, xxx, ..., [value]
+PLACEHOLDER = re.compile(r'\b(?:tbd|todo|xxx+|placeholder)\b|\.\.\.|\[[a-z _/-]+\]', re.IGNORECASE)
+OUTLINE_PARAMETER = re.compile(r'<[^<>]+>')
+PLACEHOLDER_DATA = re.compile(r'^(?:missing concrete test data|sample data|test data|n/?a$|none$|-$)', re.IGNORECASE)
+
+
+class QualityThresholds:
+    """Thresholds a draft has to meet for its improve pass to be skipped"""
+
+    def __init__(self, min_scenarios: int = 4, min_step_completeness: float = 0.9,
+                 min_tag_coverage: float = 0.8, min_negative: int = 1, min_test_cases: int = 3,
+                 min_concrete_data: float = 1.0):
+        self.min_scenarios = min_scenarios
+        self.min_step_completeness = min_step_completeness
+        self.min_tag_coverage = min_tag_coverage
+        self.min_negative = min_negative
+        self.min_test_cases = min_test_cases
+        self.min_concrete_data = min_concrete_data
+
+    @classmethod
+    def from_env(cls) -> 'QualityThresholds':
+        return cls(
+            min_scenarios=int(os.getenv('QUALITY_MIN_SCENARIOS', 4)),
+            min_step_completeness=float(os.getenv('QUALITY_MIN_STEP_COMPLETENESS', 0.9)),
+            min_tag_coverage=float(os.getenv('QUALITY_MIN_TAG_COVERAGE', 0.8)),
+            min_negative=int(os.getenv('QUALITY_MIN_NEGATIVE', 1)),
+            min_test_cases=int(os.getenv('QUALITY_MIN_TEST_CASES', 3)),
+            min_concrete_data=float(os.getenv('QUALITY_MIN_CONCRETE_DATA', 1.0))
+        )
+
+
+def _count_check(value: int, minimum: int) -> dict:
+    return {
+        'value': value,
+        'threshold': minimum,
+        'score': min(1.0, value / minimum) if minimum > 0 else 1.0,
+        'passed': value >= minimum
+    }
+
+
+def _share_check(matching: int, total: int, minimum: float) -> dict:
+    share = matching / total if total else 0.0
+    return {
+        'value': round(share, 3),
+        'threshold': minimum,
+        'score': share,
+        'passed': total > 0 and share >= minimum
+    }
+
+
+class QualityReport:
+    """Result of scoring one draft: the checks, an overall 0-100 score and whether all checks passed"""
+
+    def __init__(self, kind: str, checks: Dict[str, dict]):
+        self.kind = kind
+        self.checks = checks
+        self.score = round(100 * sum(check['score'] for check in checks.values()) / len(checks), 1)
+        self.passed = all(check['passed'] for check in checks.values())
+
+    def failed_checks(self) -> List[str]:
+        return [name for name, check in self.checks.items() if not check['passed']]
+
+    def to_dict(self) -> dict:
+        return {
+            'score': self.score,
+            'passed': self.passed,
+            'failed_checks': self.failed_checks(),
+            'checks': {
+                name: {key: round(value, 3) if isinstance(value, float) else value for key, value in check.items()}
+                for name, check in self.checks.items()
+            }
+        }
+
+
+def _step_kinds(scenario: Scenario) -> set:
+    """Given / When / Then present in a scenario; And and But count as the keyword before them"""
+    kinds = set()
+    keyword = None
+    for step in scenario.steps:
+        if step.keyword in ('Given', 'When', 'Then'):
+            keyword = step.keyword
+        if keyword:
+            kinds.add(keyword)
+    return kinds
+
+
+def _has_placeholder(text: str, scenario: Scenario) -> bool:
+    if PLACEHOLDER.search(text):
+        return True
+    # <name> is a parameter in a Scenario Outline with Examples, and unfilled text anywhere else
+    return not scenario.examples and bool(OUTLINE_PARAMETER.search(text))
+
+
+def score_gherkin(content: str, thresholds: Optional[QualityThresholds] = None) -> QualityReport:
+    """
+    Score a Gherkin draft.
+
+    Checks:
+        scenarios: number of scenarios
+        step_completeness: share of scenarios with Given, When and Then (Background steps count as Given)
+        tag_coverage: share of scenarios tagged themselves or through their Feature or Rule
+        negative_scenarios: scenarios about errors, invalid input or edge cases, by tags, title and steps
+        concrete_data: share of steps and Examples rows without placeholders such as TBD, ... or [value]
+    """
+    thresholds = thresholds or QualityThresholds.from_env()
+    feature = parse_gherkin(content or '')
+
+    scenarios = []  # (scenario, inherited tags, background gives a Given)
+    has_background = feature.background is not None and bool(feature.background.steps)
+    for child in feature.children:
+        if isinstance(child, Scenario):
+            scenarios.append((child, feature.tags, has_background))
+        else:
+            rule_background = has_background or (child.background is not None and bool(child.background.steps))
+            scenarios.extend((scenario, feature.tags + child.tags, rule_background) for scenario in child.children)
+
+    complete = 0
+    tagged = 0
+    negative = 0
+    data_lines = 0
+    placeholder_lines = 0
+    for scenario, inherited_tags, background in scenarios:
+        kinds = _step_kinds(scenario)
+        if background:
+            kinds.add('Given')
+        if kinds >= {'Given', 'When', 'Then'}:
+            complete += 1
+        if scenario.tags or inherited_tags:
+            tagged += 1
+
+        text = ' '.join(scenario.tags + [scenario.name] + [step.text for step in scenario.steps])
+        if NEGATIVE_MARKERS.search(text):
+            negative += 1
+
+        for step in scenario.steps:
+            data_lines += 1
+            if _has_placeholder(step.text, scenario) or any(
+                    PLACEHOLDER.search(cell) for row in step.table or [] for cell in row):
+                placeholder_lines += 1
+        for examples in scenario.examples:
+            for row in examples.rows[1:]:
+                data_lines += 1
+                if any(PLACEHOLDER.search(cell) or not cell.strip() for cell in row):
+                    placeholder_lines += 1
+
+    return QualityReport('gherkin', {
+        'scenarios': _count_check(len(scenarios), thresholds.min_scenarios),
+        'step_completeness': _share_check(complete, len(scenarios), thresholds.min_step_completeness),
+        'tag_coverage': _share_check(tagged, len(scenarios), thresholds.min_tag_coverage),
+        'negative_scenarios': _count_check(negative, thresholds.min_negative),
+        'concrete_data': _share_check(data_lines - placeholder_lines, data_lines, thresholds.min_concrete_data)
+    })
+
+
+def is_placeholder_data(value: str) -> bool:
+    """Whether a test data set describes or stands in for values instead of giving them"""
+    value = (value or '').strip()
+    return not value or bool(PLACEHOLDER_DATA.match(value) or GENERIC_TEST_DATA.match(value)
+                             or PLACEHOLDER.search(value))
+
+
+def score_test_cases(test_cases: List[Dict[str, str]], thresholds: Optional[QualityThresholds] = None) -> QualityReport:
+    """
+    Score a draft of manual test cases.
+
+    Checks:
+        test_cases: number of test cases
+        step_completeness: share of cases with a description, test steps and an expected result
+        negative_cases: cases about errors, invalid input or edge cases, by description, steps and expected result
+        concrete_data: share of test data sets that are not placeholders or descriptions
+    """
+    thresholds = thresholds or QualityThresholds.from_env()
+    complete = 0
+    negative = 0
+    concrete = 0
+    for case in test_cases:
+        if all((case.get(field) or '').strip() for field in ('Description', 'Test Steps', 'Expected Result')):
+            complete += 1
+        if NEGATIVE_MARKERS.search(' '.join(case.get(field) or '' for field in ('Description', 'Test Steps', 'Expected Result'))):
+            negative += 1
+        concrete += sum(
+            1 for number in range(1, DATA_SET_COUNT + 1)
+            if not is_placeholder_data(case.get(f'Test Data Set {number}', ''))
+        )
+
+    return QualityReport('manual', {
+        'test_cases': _count_check(len(test_cases), thresholds.min_test_cases),
+        'step_completeness': _share_check(complete, len(test_cases), thresholds.min_step_completeness),
+        'negative_cases': _count_check(negative, thresholds.min_negative),
+        'concrete_data': _share_check(concrete, len(test_cases) * DATA_SET_COUNT, thresholds.min_concrete_data)
+    })
+
+
+def quality_gate(report: QualityReport) -> dict:
+    """
+    Decide whether a draft needs its improve pass.
+
+    Returns:
+        token_debug entry with the score, the checks and the decision:
+        'skip_improve' when every check passed and the gate is enabled, 'improve' otherwise
+    """
+    enabled = os.getenv('QUALITY_GATE_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+    decision = 'skip_improve' if enabled and report.passed else 'improve'
+    metrics.increment(f'quality_gate_{report.kind}_{decision}')
+    return {**report.to_dict(), 'decision': decision, 'gate_enabled': enabled}
@@ -0,0 +1,428 @@
+"""
+Request and token budgets per model, shared by every agent of the process.
+
+Groq limits each model to a number of requests and tokens per minute. The
+scheduler keeps a pair of token buckets per model id and makes model calls
+wait for budget instead of failing with a rate limit error. Waiting calls
+are served by priority (interactive requests before background jobs), then
+in arrival order. A call that cannot get its budget before the deadline of
+its request is rejected right away with RateLimitExceeded instead of
+waiting for nothing. A call that needs more tokens than the model's
+per-minute limit can never run and is rejected with CallTooLarge.
+
+Environment:
+    RATE_LIMITER_ENABLED: Set to 'false' to call the models without budgets (default 'true')
+    RATE_LIMITED_PROVIDERS: Comma-separated providers whose calls are budgeted (default 'groq')
+    RATE_LIMITS: JSON object of per-model limits overriding the defaults, e.g.
+        {"llama-3.3-70b-versatile": {"rpm": 1000, "tpm": 300000}}
+    RATE_LIMIT_DEFAULT_RPM / RATE_LIMIT_DEFAULT_TPM: Limits of models without their own (default 30 / 6000)
+    RATE_LIMIT_MAX_WAIT_SECONDS: Longest wait for calls outside a request deadline (default 120)
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+from utils.metrics import metrics
+from utils.request_context import get_request_option
+from utils.token_counter import get_token_counter
+
+# Groq's published per-minute limits of the models the agents use
+DEFAULT_RATE_LIMITS = {
+    'deepseek-r1-distill-llama-70b': {'rpm': 30, 'tpm': 6000},
+    'llama-3.1-8b-instant': {'rpm': 30, 'tpm': 6000},
+    'llama-3.3-70b-versatile': {'rpm': 30, 'tpm': 12000},
+    'mixtral-8x7b-32768': {'rpm': 30, 'tpm': 5000}
+}
+
+# Request priority -> queue rank; lower ranks are served first
+PRIORITIES = {'interactive': 0, 'chunk': 1, 'background': 2}
+
+# Output tokens reserved for a call when the agent sets no max_tokens
+DEFAULT_OUTPUT_TOKENS = 1024
+
+# Longest sleep of an async call waiting for budget before it checks again
+ASYNC_POLL_SECONDS = 0.05
+
+
+class RateLimitExceeded(Exception):
+    """A model call could not get its request or token budget before its deadline"""
+
+    def __init__(self, message: str, model_id: str, retry_after: float):
+        super().__init__(message)
+        self.model_id = model_id
+        self.retry_after = retry_after
+
+
+class CallTooLarge(RateLimitExceeded):
+    """A model call needs more tokens than its model's per-minute limit, so retrying it cannot help"""
+
+    def __init__(self, message: str, model_id: str, tokens: int, limit: int):
+        super().__init__(message, model_id, retry_after=None)
+        self.tokens = tokens
+        self.limit = limit
+
+
+class TokenBucket:
+    """Budget refilled continuously at capacity per minute; the level may go negative after a correction"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until(self, amount: float) -> float:
+        """Seconds until the bucket holds amount, assuming nothing else is taken meanwhile"""
+        missing = amount - self.level
+        return max(0.0, missing / self.rate) if self.rate > 0 else float('inf')
+
+
+class _Waiter:
+    def __init__(self, rank: int, sequence: int, tokens: int):
+        self.rank = rank
+        self.sequence = sequence
+        self.tokens = tokens
+
+    def __lt__(self, other: '_Waiter') -> bool:
+        return (self.rank, self.sequence) < (other.rank, other.sequence)
+
+
+class Reservation:
+    """Budget taken for one model call; settle() corrects the token estimate once the call finished"""
+
+    def __init__(self, limiter: 'ModelRateLimiter', tokens: int, waited: float):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.waited = waited
+        self._settled = False
+
+    def settle(self, actual_tokens: int) -> None:
+        if not self._settled:
+            self._settled = True
+            self.limiter.adjust(self.tokens - actual_tokens)
+
+
+class ModelRateLimiter:
+    """Request and token buckets of one model with a priority queue of waiting calls"""
+
+    def __init__(self, model_id: str, rpm: float, tpm: float):
+        self.model_id = model_id
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._condition = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self.stats = {'calls': 0, 'waited': 0, 'rejected': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+
+    def _estimate_wait(self, waiter: _Waiter, now: float) -> float:
+        """Seconds until the budget of the waiter and of every call queued ahead of it has refilled"""
+        ahead = [other for other in self._queue if other < waiter]
+        requests = len(ahead) + 1
+        tokens = sum(other.tokens for other in ahead) + waiter.tokens
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        return max(self.requests.seconds_until(requests), self.tokens.seconds_until(tokens))
+
+    def acquire(self, tokens: int, priority: str = 'interactive', deadline: Optional[float] = None) -> Reservation:
+        """
+        Wait until one request and tokens fit in the budget, then take them.
+
+        Args:
+            tokens: Estimated tokens of the call (prompt plus expected output)
+            priority: Key of PRIORITIES; unknown priorities count as interactive
+            deadline: time.monotonic() by which the call has to have started
+
+        Returns:
+            Reservation to settle with the actual token count
+
+        Raises:
+            RateLimitExceeded: If the call cannot start before the deadline
+        """
+        start = time.monotonic()
+        with self._condition:
+            waiter = self._enqueue(tokens, priority, deadline, start)
+            try:
+                while True:
+                    timeout = self._try_take(waiter, deadline)
+                    if timeout == 0:
+                        break
+                    self._condition.wait(timeout=timeout)
+            finally:
+                self._dequeue(waiter)
+        return self._reservation(waiter, start)
+
+    async def aacquire(self, tokens: int, priority: str = 'interactive', deadline: Optional[float] = None) -> Reservation:
+        """
+        Async counterpart of acquire: waits on the event loop instead of blocking a thread.
+
+        Async waiters are not woken by the condition, so they re-check the
+        budget at least every ASYNC_POLL_SECONDS.
+        """
+        start = time.monotonic()
+        with self._condition:
+            waiter = self._enqueue(tokens, priority, deadline, start)
+        try:
+            while True:
+                with self._condition:
+                    timeout = self._try_take(waiter, deadline)
+                if timeout == 0:
+                    break
+                await asyncio.sleep(min(timeout, ASYNC_POLL_SECONDS) if timeout is not None else ASYNC_POLL_SECONDS)
+        finally:
+            with self._condition:
+                self._dequeue(waiter)
+        return self._reservation(waiter, start)
+
+    def _reject(self, message: str, retry_after: float) -> RateLimitExceeded:
+        self._count_rejection()
+        return RateLimitExceeded(message, self.model_id, retry_after)
+
+    def _count_rejection(self) -> None:
+        self.stats['rejected'] += 1
+        metrics.increment('rate_limiter_rejected')
+
+    def _enqueue(self, tokens: int, priority: str, deadline: Optional[float], start: float) -> _Waiter:
+        """Queue a call, or reject it if it can never fit or cannot start before the deadline (lock held)"""
+        tokens = max(1, int(tokens))
+        if tokens > self.tokens.capacity:
+            self._count_rejection()
+            raise CallTooLarge(
+                f"Call to {self.model_id} needs {tokens} tokens, more than its limit of "
+                f"{int(self.tokens.capacity)} tokens per minute", self.model_id, tokens, int(self.tokens.capacity))
+
+        waiter = _Waiter(PRIORITIES.get(priority, 0), next(self._sequence), tokens)
+        wait = self._estimate_wait(waiter, start)
+        if deadline is not None and start + wait > deadline:
+            raise self._reject(
+                f"Rate limit of {self.model_id}: the call would start in {wait:.1f}s, "
+                f"after the request deadline", round(wait, 1))
+        heapq.heappush(self._queue, waiter)
+        return waiter
+
+    def _try_take(self, waiter: _Waiter, deadline: Optional[float]) -> Optional[float]:
+        """
+        Take the budget of a queued call if it is its turn and the budget is there (lock held).
+
+        Returns:
+            0 once the budget was taken, else the seconds to wait before trying
+            again (None: until another call leaves the queue)
+
+        Raises:
+            RateLimitExceeded: If the deadline passed
+        """
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        if self._queue[0] is waiter and self.requests.level >= 1 and self.tokens.level >= waiter.tokens:
+            self.requests.level -= 1
+            self.tokens.level -= waiter.tokens
+            return 0
+        if deadline is not None and now >= deadline:
+            raise self._reject(f"Rate limit of {self.model_id}: no budget before the request deadline",
+                               round(self._estimate_wait(waiter, now), 1))
+        if self._queue[0] is waiter:
+            timeout = max(self.requests.seconds_until(1), self.tokens.seconds_until(waiter.tokens))
+        else:
+            timeout = None
+        if deadline is not None:
+            timeout = min(timeout if timeout is not None else deadline - now, deadline - now)
+        return max(timeout, 0.001) if timeout is not None else None
+
+    def _dequeue(self, waiter: _Waiter) -> None:
+        """Remove a call from the queue, whether it got its budget or gave up (lock held)"""
+        self._queue.remove(waiter)
+        heapq.heapify(self._queue)
+        # The next waiter may be able to go now
+        self._condition.notify_all()
+
+    def _reservation(self, waiter: _Waiter, start: float) -> Reservation:
+        waited = time.monotonic() - start
+        with self._condition:
+            self.stats['calls'] += 1
+            if waited > 0.001:
+                self.stats['waited'] += 1
+                self.stats['wait_seconds'] += waited
+                self.stats['max_wait_seconds'] = max(self.stats['max_wait_seconds'], waited)
+        if waited > 0.001:
+            metrics.increment('rate_limiter_wait_seconds', waited)
+        return Reservation(self, waiter.tokens, waited)
+
+    def adjust(self, tokens: int) -> None:
+        """Give back (or take, when negative) tokens after a call used fewer (or more) than reserved"""
+        with self._condition:
+            self.tokens.refill(time.monotonic())
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + tokens)
+            self._condition.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._condition:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            stats = dict(self.stats)
+            stats.update({
+                'rpm': self.requests.capacity,
+                'tpm': self.tokens.capacity,
+                'queue_depth': len(self._queue),
+                'requests_available': round(self.requests.level, 2),
+                'tokens_available': int(self.tokens.level)
+            })
+        stats['avg_wait_seconds'] = round(stats['wait_seconds'] / stats['calls'], 3) if stats['calls'] else 0.0
+        stats['wait_seconds'] = round(stats['wait_seconds'], 3)
+        stats['max_wait_seconds'] = round(stats['max_wait_seconds'], 3)
+        return stats
+
+
+class RateScheduler:
+    """Per-model rate limiters, created on first use from the configured limits"""
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, float]]] = None,
+                 default_rpm: float = 30, default_tpm: float = 6000, max_wait_seconds: float = 120):
+        self.limits = {**DEFAULT_RATE_LIMITS, **(limits or {})}
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.max_wait_seconds = max_wait_seconds
+        self._limiters: Dict[str, ModelRateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, model_id: str) -> ModelRateLimiter:
+        with self._lock:
+            limiter = self._limiters.get(model_id)
+            if limiter is None:
+                limits = self.limits.get(model_id, {})
+                limiter = self._limiters[model_id] = ModelRateLimiter(
+                    model_id, limits.get('rpm', self.default_rpm), limits.get('tpm', self.default_tpm))
+            return limiter
+
+    def acquire(self, model_id: str, tokens: int) -> Reservation:
+        """
+        Take budget for a call to model_id, waiting if needed.
+
+        The priority and deadline come from the request being processed (see
+        request_scope); calls outside a request wait at most max_wait_seconds.
+        """
+        priority = get_request_option('priority', 'interactive')
+        deadline = get_request_option('deadline')
+        if deadline is None:
+            deadline = time.monotonic() + self.max_wait_seconds
+        return self.limiter(model_id).acquire(tokens, priority=priority, deadline=deadline)
+
+    async def aacquire(self, model_id: str, tokens: int) -> Reservation:
+        """Async counterpart of acquire"""
+        priority = get_request_option('priority', 'interactive')
+        deadline = get_request_option('deadline')
+        if deadline is None:
+            deadline = time.monotonic() + self.max_wait_seconds
+        return await self.limiter(model_id).aacquire(tokens, priority=priority, deadline=deadline)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {model_id: limiter.get_stats() for model_id, limiter in limiters.items()}
+
+
+class RateLimitedAgent:
+    """
+    Provider agent whose calls take their budget from the rate scheduler first.
+
+    Tokens are estimated as instructions plus prompt plus max_tokens with the
+    shared tiktoken counter; once the call has finished the estimate is
+    corrected with the tokens of the actual response.
+    """
+
+    def __init__(self, agent, scheduler: RateScheduler):
+        self.agent = agent
+        self.scheduler = scheduler
+
+    def __getattr__(self, name):
+        return getattr(self.agent, name)
+
+    def _prompt_tokens(self, prompt: Any) -> int:
+        counter = get_token_counter()
+        instructions = self.agent.instructions if isinstance(self.agent.instructions, str) else ''
+        return sum(counter.count_many([instructions, prompt if isinstance(prompt, str) else str(prompt)]))
+
+    def run(self, prompt, stream: bool = False, **kwargs):
+        model = self.agent.model
+        prompt_tokens = self._prompt_tokens(prompt)
+        reservation = self.scheduler.acquire(
+            model.id, prompt_tokens + (getattr(model, 'max_tokens', None) or DEFAULT_OUTPUT_TOKENS))
+        if stream:
+            return self._stream(prompt, prompt_tokens, reservation, **kwargs)
+        try:
+            response = self.agent.run(prompt, **kwargs)
+        except Exception:
+            reservation.settle(prompt_tokens)
+            raise
+        content = getattr(response, 'content', None)
+        reservation.settle(prompt_tokens + (get_token_counter().count(content) if isinstance(content, str) else 0))
+        return response
+
+    async def arun(self, prompt, **kwargs):
+        model = self.agent.model
+        prompt_tokens = self._prompt_tokens(prompt)
+        reservation = await self.scheduler.aacquire(
+            model.id, prompt_tokens + (getattr(model, 'max_tokens', None) or DEFAULT_OUTPUT_TOKENS))
+        try:
+            response = await self.agent.arun(prompt, **kwargs)
+        except BaseException:
+            # Failed or cancelled: the prompt was (or may have been) sent
+            reservation.settle(prompt_tokens)
+            raise
+        content = getattr(response, 'content', None)
+        reservation.settle(prompt_tokens + (get_token_counter().count(content) if isinstance(content, str) else 0))
+        return response
+
+    def _stream(self, prompt, prompt_tokens: int, reservation: Reservation, **kwargs) -> Iterator[Any]:
+        pieces = []
+        try:
+            for event in self.agent.run(prompt, stream=True, **kwargs):
+                delta = getattr(event, 'content', None)
+                if isinstance(delta, str):
+                    pieces.append(delta)
+                yield event
+        finally:
+            reservation.settle(prompt_tokens + get_token_counter().count(''.join(pieces)))
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_rate_scheduler(provider: str) -> Optional[RateScheduler]:
+    """
+    Return the shared scheduler if calls through provider are rate limited, else None.
+
+    The scheduler is created from the environment on first use.
+    """
+    global _scheduler
+    if os.getenv('RATE_LIMITER_ENABLED', 'true').lower() in ('0', 'false', 'no'):
+        return None
+    providers = [name.strip().lower() for name in os.getenv('RATE_LIMITED_PROVIDERS', 'groq').split(',')]
+    if provider not in providers:
+        return None
+
+    with _scheduler_lock:
+        if _scheduler is None:
+            try:
+                limits = json.loads(os.getenv('RATE_LIMITS', '') or '{}')
+            except json.JSONDecodeError as e:
+                print(f"Ignoring invalid RATE_LIMITS: {str(e)}")
+                limits = {}
+            _scheduler = RateScheduler(
+                limits=limits,
+                default_rpm=float(os.getenv('RATE_LIMIT_DEFAULT_RPM', 30)),
+                default_tpm=float(os.getenv('RATE_LIMIT_DEFAULT_TPM', 6000)),
+                max_wait_seconds=float(os.getenv('RATE_LIMIT_MAX_WAIT_SECONDS', 120))
+            )
+            metrics.register_collector('rate_limiter', _scheduler.get_stats)
+        return _scheduler
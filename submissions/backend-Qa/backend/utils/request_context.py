@@ -0,0 +1,29 @@
+import contextvars
+from contextlib import contextmanager
+from typing import Any
+
+# Options that apply to the request currently being processed. Agents read
+# them without every method having to accept extra arguments.
+_request_options = contextvars.ContextVar('request_options', default={})
+
+
+@contextmanager
+def request_scope(**options):
+    """
+    Make options visible to everything called for the current request.
+
+    Nested scopes inherit the options of the enclosing scope.
+
+    Args:
+        **options: Request options, e.g. bypass_cache=True
+    """
+    token = _request_options.set({**_request_options.get(), **options})
+    try:
+        yield
+    finally:
+        _request_options.reset(token)
+
+
+def get_request_option(name: str, default: Any = None) -> Any:
+    """Return a request option set by the enclosing request_scope"""
+    return _request_options.get().get(name, default)
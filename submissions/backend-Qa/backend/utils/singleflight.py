@@ -0,0 +1,204 @@
+import asyncio
+import copy
+import hashlib
+import json
+import threading
+from typing import Any, Awaitable, Callable, Dict
+
+from utils.cancellation import Cancelled
+from utils.chunk_store import normalize_chunk
+
+# Request fields that only steer how main.py schedules a request, not what the agent generates
+SCHEDULING_FIELDS = ('chunkInput', 'chunkSize', 'chunkTokens', 'maxConcurrentChunks', 'requestTimeout',
+                     'incremental', 'sourceFile')
+
+
+def make_request_key(request_data: dict) -> str:
+    """
+    Build the coalescing key of a router request.
+
+    The requirement and text are normalized like chunk keys (Unicode and
+    whitespace), the agent type is lower-cased and every other field except
+    SCHEDULING_FIELDS is part of the key, so requests only share a result
+    when they would have generated the same thing. bypassCache stays in the
+    key: a request asking for a fresh result never joins one that may be
+    served from the cache.
+
+    Returns:
+        SHA-256 hex digest of the normalized request
+    """
+    normalized = {}
+    for name, value in request_data.items():
+        if name in SCHEDULING_FIELDS or value is None:
+            continue
+        if name in ('requirement', 'text') and isinstance(value, str):
+            value = normalize_chunk(value)
+        elif name == 'agentType' and isinstance(value, str):
+            value = value.lower()
+        normalized[name] = value
+    payload = json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _Flight:
+    """One in-flight execution and the callers waiting for it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self._lock = threading.Lock()
+        self._futures = []  # (event loop, future) of async waiters
+
+    def finish(self) -> None:
+        """Wake every waiter, blocked or async"""
+        with self._lock:
+            self.done.set()
+            futures, self._futures = self._futures, []
+        for loop, future in futures:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    async def wait_async(self) -> None:
+        """Wait for the execution without holding a thread"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self.done.is_set():
+                return
+            self._futures.append((loop, future))
+        await future
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait for it and receive a deep copy of its result (or its
+    exception) instead of running the function again. Nothing is kept once
+    the execution finishes, so this is not a cache: a call arriving later
+    runs again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self.stats = {'executions': 0, 'calls_saved': 0, 'max_waiters': 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        Run fn, or wait for the execution already running for key.
+
+        Args:
+            key: Coalescing key; calls with equal keys share one execution
+            fn: Function producing the result
+
+        Returns:
+            The result of fn (a copy of it for callers that joined an execution)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.stats['executions'] += 1
+            else:
+                flight.waiters += 1
+                self.stats['calls_saved'] += 1
+                self.stats['max_waiters'] = max(self.stats['max_waiters'], flight.waiters)
+
+        if not leader:
+            flight.done.wait()
+            if isinstance(flight.error, (asyncio.CancelledError, Cancelled)):
+                # The caller running it abandoned it, which says nothing about this call
+                return self.do(key, fn)
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        try:
+            result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            with self._lock:
+                del self._flights[key]
+            # Waiters copy a snapshot taken before the leader's caller can modify the result
+            if flight.waiters:
+                flight.result = copy.deepcopy(result)
+            return result
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.finish()
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Async counterpart of do: await fn(), or the execution already running for key.
+
+        Callers of do and ado share the same keys and statistics: an async
+        caller may join an execution run by do (and the other way round).
+        Cancelling a waiting caller does not cancel the execution it joined;
+        when the caller running the execution is cancelled (or abandons it,
+        see utils.cancellation), its waiters run it again.
+
+        Args:
+            key: Coalescing key; calls with equal keys share one execution
+            fn: Function returning the awaitable that produces the result
+
+        Returns:
+            The result of fn (a copy of it for callers that joined an execution)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.stats['executions'] += 1
+            else:
+                flight.waiters += 1
+                self.stats['calls_saved'] += 1
+                self.stats['max_waiters'] = max(self.stats['max_waiters'], flight.waiters)
+
+        if not leader:
+            await flight.wait_async()
+            if isinstance(flight.error, (asyncio.CancelledError, Cancelled)):
+                return await self.ado(key, fn)
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            with self._lock:
+                del self._flights[key]
+            if flight.waiters:
+                flight.result = copy.deepcopy(result)
+            return result
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.finish()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return execution and coalescing counters and the number of executions running"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['in_flight'] = len(self._flights)
+            stats['waiting'] = sum(flight.waiters for flight in self._flights.values())
+        calls = stats['executions'] + stats['calls_saved']
+        stats['calls_saved_rate'] = round(stats['calls_saved'] / calls, 3) if calls else 0.0
+        return stats
@@ -0,0 +1,49 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple, Any
+
+
+def run_stages_concurrently(stages: Dict[str, Callable[[], Any]], max_workers: Optional[int] = None) -> Dict[str, Tuple[Any, Optional[BaseException]]]:
+    """
+    Run independent pipeline stages in a bounded thread pool and wait for all of them.
+
+    Each stage runs inside a copy of the caller's context, so context variables
+    set for the current request remain visible to the stage.
+
+    Args:
+        stages: Ordered mapping of stage name to a zero-argument callable
+        max_workers: Maximum number of stages in flight (defaults to one per stage)
+
+    Returns:
+        Dictionary mapping each stage name, in input order, to a (result, error) tuple.
+        Exactly one of result or error is set for every stage.
+    """
+    if not stages:
+        return {}
+
+    workers = max(1, min(max_workers or len(stages), len(stages)))
+
+    # Run inline when no concurrency is requested, which keeps behaviour
+    # identical to a plain sequential loop
+    if workers == 1:
+        results = {}
+        for name, stage in stages.items():
+            try:
+                results[name] = (stage(), None)
+            except Exception as e:
+                results[name] = (None, e)
+        return results
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stage') as executor:
+        futures = {
+            name: executor.submit(contextvars.copy_context().run, stage)
+            for name, stage in stages.items()
+        }
+
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = (future.result(), None)
+            except Exception as e:
+                results[name] = (None, e)
+        return results
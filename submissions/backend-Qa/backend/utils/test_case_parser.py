@@ -0,0 +1,211 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Columns of the manual test case CSV
+TEST_CASE_FIELDS = [
+    'Test Case ID', 'Description', 'Test Steps',
+    'Test Data Set 1', 'Test Data Set 2', 'Test Data Set 3',
+    'Test Data Set 4', 'Test Data Set 5', 'Expected Result'
+]
+DATA_SET_COUNT = 5
+
+# A field header at the start of a line, optionally behind a bullet, heading or bold marker:
+# "Test Case ID: TC_001", "**Description:** ...", "- Test Data Set 2: ...", "Expected Results:"
+FIELD_HEADER = re.compile(
+    r'^[\s>#*\-]*(?:\*\*|__)?\s*'
+    r'(?:(?P<id>test\s*case\s*id|tc[\s_]*id|case\s*id)'
+    r'|(?P<case>test\s*case)\s*(?:#\s*)?(?P<case_number>\d+)'
+    r'|(?P<description>description)'
+    r'|(?P<steps>(?:test\s*)?steps)'
+    r'|test\s*data(?:\s*set)?\s*(?P<data_set>[1-5])'
+    r'|(?P<expected>expected\s*results?)(?:\s*(?:for\s*)?(?:data\s*)?(?:set\s*)?(?P<expected_set>[1-5]))?)'
+    r'\s*(?:\*\*|__)?\s*[:.\-]\s*(?:\*\*|__)?\s*(?P<value>.*)$',
+    re.IGNORECASE
+)
+THINK_START = '<think>'
+THINK_END = '</think>'
+CODE_FENCE = re.compile(r'^\s*```')
+
+
+def missing_data_set(number: int) -> str:
+    return f"Missing concrete test data set {number}"
+
+
+class TestCaseStreamParser:
+    """
+    State machine parsing manual test cases out of model output.
+
+    Text is fed as it streams in, in pieces of any size. The parser keeps
+    the test case and field being filled; a field header starts a field
+    wherever it appears, blank lines never end a test case, and a case is
+    complete once the next one starts (or the stream ends), at which point
+    feed() or close() returns it.
+
+    Recovery from malformed output is counted in stats:
+    - blank_lines_inside_cases: blank lines inside a case (which used to split it)
+    - implicit_case_starts: cases started by a field header other than the ID
+    - generated_ids: cases without an ID that were given one
+    - padded_data_sets: missing test data sets filled with a placeholder
+    - skipped_lines: text outside any test case (preamble, thinking, fences)
+    - dropped_cases: cases with an ID but no other content
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._case = None
+        self._field = None
+        self._blank_pending = False
+        self._in_think = False
+        self._number = 0
+        self.stats = {
+            'cases': 0,
+            'blank_lines_inside_cases': 0,
+            'implicit_case_starts': 0,
+            'generated_ids': 0,
+            'padded_data_sets': 0,
+            'skipped_lines': 0,
+            'dropped_cases': 0
+        }
+
+    def feed(self, text: str) -> List[Dict[str, str]]:
+        """Add streamed text and return the test cases completed by it"""
+        self._buffer += text
+        *complete, self._buffer = self._buffer.split('\n')
+        completed = []
+        for line in complete:
+            completed.extend(self._parse_line(line))
+        return completed
+
+    def close(self) -> List[Dict[str, str]]:
+        """Return the remaining test cases once the stream has ended"""
+        completed = self._parse_line(self._buffer) if self._buffer else []
+        self._buffer = ''
+        completed.extend(self._finish_case())
+        return completed
+
+    def _strip_thinking(self, line: str) -> str:
+        """Drop text inside <think> blocks, which may open and close on any line"""
+        kept = ''
+        while line:
+            if self._in_think:
+                end = line.find(THINK_END)
+                if end < 0:
+                    return kept
+                line = line[end + len(THINK_END):]
+                self._in_think = False
+            else:
+                start = line.find(THINK_START)
+                if start < 0:
+                    return kept + line
+                kept += line[:start]
+                line = line[start + len(THINK_START):]
+                self._in_think = True
+        return kept
+
+    def _parse_line(self, line: str) -> List[Dict[str, str]]:
+        was_thinking = self._in_think
+        line = self._strip_thinking(line).strip()
+        if not line or CODE_FENCE.match(line):
+            if was_thinking or line:
+                self.stats['skipped_lines'] += 1
+            elif self._case is not None:
+                self._blank_pending = True
+            return []
+
+        match = FIELD_HEADER.match(line)
+        if match is None:
+            if self._case is None or self._field is None:
+                self.stats['skipped_lines'] += 1
+                return []
+            self._append(self._field, line)
+            return []
+
+        completed = []
+        value = match.group('value').strip()
+        if match.group('id') or match.group('case'):
+            # An ID always starts a new case
+            completed.extend(self._finish_case())
+            self._start_case()
+            if match.group('case'):
+                # "Test Case 3: Login with valid data" carries the number and the description
+                self._case['Test Case ID'] = f"TC_{int(match.group('case_number')):03d}"
+                if value:
+                    self._case['Description'] = value
+            else:
+                self._case['Test Case ID'] = value
+            self._field = None
+            return completed
+
+        if match.group('description'):
+            field = 'Description'
+        elif match.group('steps'):
+            field = 'Test Steps'
+        elif match.group('data_set'):
+            field = f"Test Data Set {match.group('data_set')}"
+        else:
+            field = 'Expected Result'
+            if match.group('expected_set') and value:
+                value = f"Data Set {match.group('expected_set')}: {value}"
+
+        # A field that is already filled (other than a numbered expected result)
+        # means the model started the next case without its ID
+        repeated = self._case is not None and self._case[field] and not (
+            field == 'Expected Result' and match.group('expected_set'))
+        if self._case is None or repeated:
+            completed.extend(self._finish_case())
+            self._start_case()
+            self.stats['implicit_case_starts'] += 1
+        elif self._blank_pending:
+            self.stats['blank_lines_inside_cases'] += 1
+        self._blank_pending = False
+
+        self._field = field
+        if value:
+            self._append(field, value)
+        return completed
+
+    def _append(self, field: str, text: str) -> None:
+        if self._blank_pending:
+            self.stats['blank_lines_inside_cases'] += 1
+            self._blank_pending = False
+        current = self._case[field]
+        self._case[field] = f"{current}\n{text}" if current else text
+
+    def _start_case(self) -> None:
+        self._case = {field: '' for field in TEST_CASE_FIELDS}
+        self._field = None
+        self._blank_pending = False
+
+    def _finish_case(self) -> List[Dict[str, str]]:
+        case, self._case = self._case, None
+        self._field = None
+        self._blank_pending = False
+        if case is None:
+            return []
+        if not any(case[field] for field in TEST_CASE_FIELDS[1:]):
+            self.stats['dropped_cases'] += 1
+            return []
+
+        self._number += 1
+        if not case['Test Case ID']:
+            case['Test Case ID'] = f"TC_{self._number:03d}"
+            self.stats['generated_ids'] += 1
+        for number in range(1, DATA_SET_COUNT + 1):
+            if not case[f'Test Data Set {number}']:
+                case[f'Test Data Set {number}'] = missing_data_set(number)
+                self.stats['padded_data_sets'] += 1
+        self.stats['cases'] += 1
+        return [case]
+
+
+def parse_test_cases(content: Optional[str]) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+    """
+    Parse complete model output into test cases.
+
+    Returns:
+        Tuple of (test cases with every CSV column, parse recovery stats)
+    """
+    parser = TestCaseStreamParser()
+    cases = parser.feed(content or '')
+    cases.extend(parser.close())
+    return cases, dict(parser.stats)
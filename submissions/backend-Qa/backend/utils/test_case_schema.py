@@ -0,0 +1,205 @@
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+from utils.test_case_parser import DATA_SET_COUNT, TEST_CASE_FIELDS, missing_data_set
+
+THINK_BLOCK = re.compile(r'<think>.*?(?:</think>|$)', re.DOTALL)
+
+# Test data that only describes a value instead of giving one: "Valid credentials", "Special characters"
+GENERIC_TEST_DATA = re.compile(
+    r'^(?:valid|invalid|correct|incorrect|wrong|empty|blank|special|edge[\s-]*case|boundary|sample|'
+    r'random|generic|some|null|missing)\b[a-z\s/-]*$',
+    re.IGNORECASE
+)
+
+
+class ManualTestCase(BaseModel):
+    """One manual test case as returned in structured output mode, keyed by the CSV column names"""
+
+    model_config = ConfigDict(populate_by_name=True, str_strip_whitespace=True, extra='ignore')
+
+    test_case_id: str = Field(alias='Test Case ID', pattern=r'^TC_\d+$')
+    description: str = Field(alias='Description', min_length=1)
+    test_steps: str = Field(alias='Test Steps', min_length=1)
+    test_data_set_1: str = Field(alias='Test Data Set 1', min_length=1)
+    test_data_set_2: str = Field(alias='Test Data Set 2', min_length=1)
+    test_data_set_3: str = Field(alias='Test Data Set 3', min_length=1)
+    test_data_set_4: str = Field(alias='Test Data Set 4', min_length=1)
+    test_data_set_5: str = Field(alias='Test Data Set 5', min_length=1)
+    expected_result: str = Field(alias='Expected Result', min_length=1)
+
+    @field_validator('test_case_id', mode='before')
+    @classmethod
+    def normalize_id(cls, value: Any) -> Any:
+        """Accept 'TC-1', 'tc 001' or a plain number as TC_001 rather than re-requesting the case"""
+        match = re.fullmatch(r'\s*(?:tc[\s_-]*)?(\d+)\s*', str(value), re.IGNORECASE) if value is not None else None
+        return f"TC_{int(match.group(1)):03d}" if match else value
+
+    @field_validator('test_steps', 'expected_result', mode='before')
+    @classmethod
+    def join_lists(cls, value: Any) -> Any:
+        """Models often return steps as a list; store them as numbered lines like the text format"""
+        if isinstance(value, list):
+            lines = [str(item).strip() for item in value if str(item).strip()]
+            if all(re.match(r'^\d+[.)]', line) for line in lines):
+                return '\n'.join(lines)
+            return '\n'.join(f"{number}. {line}" for number, line in enumerate(lines, 1))
+        return value
+
+    @field_validator('test_data_set_1', 'test_data_set_2', 'test_data_set_3',
+                     'test_data_set_4', 'test_data_set_5')
+    @classmethod
+    def concrete_test_data(cls, value: str) -> str:
+        if GENERIC_TEST_DATA.match(value) or value.lower().startswith('missing concrete test data'):
+            raise ValueError('must contain concrete values, not a description such as "valid data"')
+        return value
+
+    def to_row(self) -> Dict[str, str]:
+        """Return the test case as a CSV row"""
+        return self.model_dump(by_alias=True)
+
+
+# JSON schema sent with the prompt, without the titles pydantic adds to every property
+TEST_CASES_JSON_SCHEMA = {
+    'type': 'object',
+    'required': ['test_cases'],
+    'properties': {
+        'test_cases': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'required': TEST_CASE_FIELDS,
+                'properties': {
+                    name: {key: value for key, value in schema.items() if key != 'title'}
+                    for name, schema in ManualTestCase.model_json_schema(by_alias=True)['properties'].items()
+                }
+            }
+        }
+    }
+}
+
+
+class InvalidTestCase:
+    """A test case from the model output that failed validation"""
+
+    def __init__(self, index: int, data: Any, errors: List[str]):
+        self.index = index
+        self.data = data
+        self.errors = errors
+
+
+class StructuredParseResult:
+    """Validated test cases of one structured response, by position in the response"""
+
+    def __init__(self, valid: Dict[int, Dict[str, str]], invalid: List[InvalidTestCase],
+                 error: Optional[str] = None):
+        self.valid = valid
+        self.invalid = invalid
+        self.error = error
+
+
+def extract_json(content: str) -> Any:
+    """
+    Return the first JSON value in model output.
+
+    Reasoning blocks, code fences and text around the JSON are skipped.
+
+    Raises:
+        ValueError: If the output contains no JSON object or array
+    """
+    content = THINK_BLOCK.sub('', content or '')
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r'[{\[]', content):
+        try:
+            value, _ = decoder.raw_decode(content, match.start())
+            return value
+        except json.JSONDecodeError:
+            continue
+    raise ValueError('response contains no JSON object')
+
+
+def _salvage_test_cases(content: str) -> List[Any]:
+    """Collect the complete test case objects of output cut off before its closing brackets"""
+    content = THINK_BLOCK.sub('', content or '')
+    decoder = json.JSONDecoder()
+    cases = []
+    position = 0
+    while True:
+        start = content.find('{', position)
+        if start < 0:
+            return cases
+        try:
+            value, position = decoder.raw_decode(content, start)
+        except json.JSONDecodeError:
+            position = start + 1
+            continue
+        if isinstance(value, dict) and 'Test Case ID' in value:
+            cases.append(value)
+
+
+def _format_errors(error: ValidationError) -> List[str]:
+    return [
+        f"{'.'.join(str(part) for part in item['loc']) or 'test case'}: {item['msg']}"
+        for item in error.errors()
+    ]
+
+
+def validate_test_cases(content: str) -> StructuredParseResult:
+    """
+    Validate structured model output against the test case schema.
+
+    Accepts {"test_cases": [...]}, a bare list of test cases or a single test
+    case object. Every case is validated on its own, so one malformed case
+    does not discard the others, and the complete cases of a response cut
+    off at max_tokens are kept.
+
+    Returns:
+        StructuredParseResult with the CSV rows of the valid cases and the
+        errors of the invalid ones; error is set when no JSON could be read
+    """
+    try:
+        data = extract_json(content)
+    except ValueError as e:
+        data = _salvage_test_cases(content)
+        if not data:
+            return StructuredParseResult({}, [], error=str(e))
+
+    if isinstance(data, dict):
+        data = data.get('test_cases', [data] if 'Test Case ID' in data else None)
+    if not isinstance(data, list):
+        return StructuredParseResult({}, [], error='response has no "test_cases" list')
+
+    valid = {}
+    invalid = []
+    for index, item in enumerate(data):
+        try:
+            valid[index] = ManualTestCase.model_validate(item).to_row()
+        except ValidationError as e:
+            invalid.append(InvalidTestCase(index, item, _format_errors(e)))
+    return StructuredParseResult(valid, invalid)
+
+
+def coerce_test_case(data: Any, number: int) -> Dict[str, str]:
+    """
+    Turn a test case that still fails validation into a CSV row.
+
+    Values that are present are kept, a missing ID is replaced with
+    TC_<number> and missing test data sets get the same placeholder as the
+    text parser uses.
+    """
+    data = data if isinstance(data, dict) else {}
+    row = {}
+    for field in TEST_CASE_FIELDS:
+        value = data.get(field)
+        if isinstance(value, list):
+            value = ManualTestCase.join_lists(value)
+        row[field] = str(value).strip() if value is not None else ''
+    if not row['Test Case ID']:
+        row['Test Case ID'] = f"TC_{number:03d}"
+    for set_number in range(1, DATA_SET_COUNT + 1):
+        if not row[f'Test Data Set {set_number}']:
+            row[f'Test Data Set {set_number}'] = missing_data_set(set_number)
+    return row
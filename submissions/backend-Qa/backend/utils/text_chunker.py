@@ -0,0 +1,236 @@
+import math
+import re
+import zlib
+from typing import List, Optional
+
+from utils.token_counter import TokenCounter, get_token_counter
+
+# Rough characters per token, used to turn the character based chunkSize into a token budget
+CHARS_PER_TOKEN = 4
+
+# Markdown headers (## Login) and numbered sections (1. Login, 2.3) Checkout)
+MARKDOWN_HEADER = re.compile(r'\s{0,3}#{1,6}\s+\S')
+HEADER_LINE = re.compile(r'\s{0,3}(?:#{1,6}\s+\S|\d+(?:\.\d+)*[.)]\s+\S)')
+
+# First line of a user story: "As a ...", optionally behind a bullet, bold marker or label ("Story 3: As an admin")
+STORY_START = re.compile(r'\s*(?:[-*+]\s+|\d+(?:\.\d+)*[.)]\s+)?(?:\*\*)?(?:[^:\n]{0,40}:\s*(?:\*\*)?\s*)?as an?\s', re.IGNORECASE)
+
+# Later parts of a story, which may follow on their own lines, even after a blank line
+STORY_CONTINUATION = re.compile(r'\s*(?:[-*+]\s+)?(?:\*\*)?(?:i want|i need|i would like|so that|in order to)\b', re.IGNORECASE)
+
+# Sentence ends used to split a paragraph that does not fit a chunk on its own
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+(?=\S)')
+
+
+class TextChunk:
+    """A chunk of a requirements document with its token count"""
+
+    def __init__(self, text: str, tokens: int, oversized: bool = False):
+        self.text = text
+        self.tokens = tokens
+        # A single user story larger than the budget is kept whole
+        self.oversized = oversized
+
+    def to_dict(self) -> dict:
+        return {'tokens': self.tokens, 'chars': len(self.text), 'oversized': self.oversized}
+
+
+class _Block:
+    """Consecutive lines that are kept together unless they do not fit a chunk"""
+
+    def __init__(self, kind: str):
+        self.kind = kind  # 'header', 'story' or 'text'
+        self.lines = []
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.lines)
+
+
+def _split_blocks(text: str) -> List[_Block]:
+    """
+    Split text into blocks in one pass over its lines.
+
+    A block is a header line, a user story (from its "As a" line through its
+    "I want" / "So that" lines and the rest of its paragraph) or a paragraph.
+    Blank lines stay at the end of the block before them, so every block
+    after the first starts with a non-blank line.
+    """
+    blocks = []
+    current = None
+    blank_run = False
+
+    for line in text.splitlines(keepends=True):
+        if not line.strip():
+            if current is None:
+                current = _Block('text')
+                blocks.append(current)
+            current.lines.append(line)
+            blank_run = True
+            continue
+
+        story_start = STORY_START.match(line)
+        in_story = current is not None and current.kind == 'story'
+        if in_story and not story_start and not MARKDOWN_HEADER.match(line) and (
+                not blank_run or STORY_CONTINUATION.match(line)):
+            # Acceptance criteria and numbered lists stay with their story, and
+            # "I want" / "So that" belong to it even after a blank line
+            current.lines.append(line)
+            blank_run = False
+            continue
+
+        if story_start:
+            kind = 'story'
+        elif HEADER_LINE.match(line):
+            kind = 'header'
+        elif current is not None and current.kind != 'header' and not blank_run:
+            # Continuation of the current paragraph
+            current.lines.append(line)
+            continue
+        else:
+            kind = 'text'
+
+        current = _Block(kind)
+        current.lines.append(line)
+        blocks.append(current)
+        blank_run = False
+
+    return blocks
+
+
+def _split_oversized(text: str, max_tokens: int, counter: TokenCounter) -> List[str]:
+    """Split a paragraph that exceeds the budget at line, then sentence, then word boundaries"""
+    for pattern in (re.compile(r'(?<=\n)(?=.)'), SENTENCE_END, re.compile(r'(?<=\s)(?=\S)')):
+        pieces = [piece for piece in pattern.split(text) if piece]
+        if len(pieces) > 1:
+            break
+    else:
+        return [text]
+
+    counts = counter.count_many(pieces)
+    parts = []
+    current, current_tokens = '', 0
+    for piece, tokens in zip(pieces, counts):
+        if current and current_tokens + tokens > max_tokens:
+            parts.append(current)
+            current, current_tokens = '', 0
+        if tokens > max_tokens:
+            # Still too large: split this piece at the next finer boundary
+            parts.extend(_split_oversized(piece, max_tokens, counter))
+            continue
+        current += piece
+        current_tokens += tokens
+    if current:
+        parts.append(current)
+    return parts
+
+
+def chunk_text(text: str, max_tokens: int, counter: Optional[TokenCounter] = None,
+               section_boundaries: bool = False) -> List[TextChunk]:
+    """
+    Pack a requirements document into chunks of at most max_tokens tokens.
+
+    The text is scanned once and split into blocks: headers, user stories and
+    paragraphs. The blocks are counted in one batch with the tokenizer the
+    agents use, then packed greedily in order:
+
+    - a user story is never split; a story larger than the budget becomes a
+      chunk of its own, flagged oversized
+    - a header is never left at the end of a chunk, it moves to the chunk
+      holding the section it introduces
+    - other paragraphs larger than the budget are split at line, sentence
+      and finally word boundaries, never mid-word
+
+    Chunk token counts are the sums of their block counts, which match the
+    tokenizer exactly for blocks starting at a non-blank line.
+
+    With section_boundaries chunk boundaries are content defined: whole
+    sections are packed together, and a header starts a new chunk when a hash
+    of its text selects it (about once per budget's worth of sections) or
+    when its section would not fit. An edit to one section then only changes
+    the chunks up to the next selected header instead of shifting every
+    later boundary, while small sections still share a chunk.
+
+    Args:
+        text: The requirements text
+        max_tokens: Token budget per chunk
+        counter: Token counter to use (defaults to the shared cl100k_base counter)
+        section_boundaries: End chunks at headers selected by their content, so they stay put across revisions
+
+    Returns:
+        List of TextChunk in document order; joining their texts gives back the input
+    """
+    if not text:
+        return []
+    counter = counter or get_token_counter()
+    max_tokens = max(int(max_tokens), 1)
+
+    blocks = _split_blocks(text)
+    counts = counter.count_many(block.text for block in blocks)
+
+    # Select about one header per chunk's worth of average sized sections; a power
+    # of two, so small changes in the average do not move the boundaries
+    boundary_every = 1
+    headers = sum(1 for block in blocks if block.kind == 'header')
+    if section_boundaries and headers:
+        sections_per_chunk = max_tokens / max(sum(counts) / headers, 1)
+        boundary_every = 1 << max(int(math.log2(max(sections_per_chunk, 1))), 0)
+
+    chunks = []
+    current, current_tokens = [], 0
+    pending_header, pending_tokens = '', 0
+
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            chunks.append(TextChunk(''.join(current), current_tokens))
+        current, current_tokens = [], 0
+
+    for block, tokens in zip(blocks, counts):
+        block_text = block.text
+        if block.kind == 'header':
+            if section_boundaries and not pending_header and (
+                    zlib.crc32(block_text.strip().encode('utf-8')) % boundary_every == 0):
+                flush()
+            # Hold headers until the block they introduce is placed
+            pending_header += block_text
+            pending_tokens += tokens
+            continue
+
+        if pending_header and pending_tokens + tokens > max_tokens:
+            # The headers do not fit together with their section: place them on their own
+            if current_tokens + pending_tokens > max_tokens:
+                flush()
+            current.append(pending_header)
+            current_tokens += pending_tokens
+            pending_header, pending_tokens = '', 0
+        elif pending_header:
+            block_text = pending_header + block_text
+            tokens += pending_tokens
+            pending_header, pending_tokens = '', 0
+
+        if current_tokens + tokens <= max_tokens:
+            current.append(block_text)
+            current_tokens += tokens
+            continue
+
+        flush()
+        if tokens <= max_tokens:
+            current, current_tokens = [block_text], tokens
+        elif block.kind == 'story':
+            chunks.append(TextChunk(block_text, tokens, oversized=True))
+        else:
+            for part in _split_oversized(block_text, max_tokens, counter):
+                part_tokens = counter.count(part)
+                if current_tokens + part_tokens > max_tokens:
+                    flush()
+                current.append(part)
+                current_tokens += part_tokens
+
+    if pending_header:
+        if current_tokens + pending_tokens > max_tokens:
+            flush()
+        current.append(pending_header)
+        current_tokens += pending_tokens
+    flush()
+    return chunks
@@ -0,0 +1,74 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+
+class InstrumentedThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor that keeps track of how busy it is.
+
+    Installed as the event loop's default executor, it shows how saturated
+    the pool behind asyncio.to_thread is: once every worker is busy, further
+    agent calls queue up instead of running.
+    """
+
+    def __init__(self, max_workers: int = None, thread_name_prefix: str = ''):
+        super().__init__(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._stats_lock = threading.Lock()
+        self._active = 0
+        self._pending = 0
+        self._peak_active = 0
+        self._peak_pending = 0
+        self._completed = 0
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._stats_lock:
+            self._pending += 1
+            self._peak_pending = max(self._peak_pending, self._pending)
+
+        def run():
+            with self._stats_lock:
+                self._pending -= 1
+                self._active += 1
+                self._peak_active = max(self._peak_active, self._active)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._stats_lock:
+                    self._active -= 1
+                    self._completed += 1
+
+        return super().submit(run)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return current and peak usage of the pool"""
+        with self._stats_lock:
+            return {
+                'max_workers': self._max_workers,
+                'active': self._active,
+                'queued': self._pending,
+                'peak_active': self._peak_active,
+                'peak_queued': self._peak_pending,
+                'completed': self._completed,
+                'saturation': round(self._active / self._max_workers, 3)
+            }
+
+
+def get_process_stats() -> Dict[str, Any]:
+    """Return resident memory and thread count of the current process"""
+    stats = {'threads': threading.active_count()}
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    stats['rss_mb'] = round(int(line.split()[1]) / 1024, 1)
+                    break
+    except OSError:
+        # Not on Linux: fall back to the peak resident size
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        stats['peak_rss_mb'] = round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    stats['pid'] = os.getpid()
+    return stats
@@ -0,0 +1,184 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from utils.metrics import metrics
+
+# Positions right after a newline that is followed by a non-whitespace character.
+# The pre-tokenizer of the GPT encodings (cl100k_base, o200k_base) always ends a
+# piece there, and BPE never merges across pieces, so the token count of a text
+# is exactly the sum of the counts of the segments between those positions.
+SEGMENT_BOUNDARY = re.compile(r'(?<=\n)(?=\S)')
+
+# Segments longer than this are cached under a digest instead of their text
+DIGEST_MIN_LENGTH = 256
+
+# Pieces the approximate encoding counts as one token each: a word (split every
+# 8 letters) or up to 3 digits or punctuation marks with their leading space,
+# or a run of whitespace. Like the GPT pre-tokenizer it never joins text across
+# a newline followed by a non-whitespace character, so counts stay additive.
+APPROXIMATE_PIECE = re.compile(r" ?[^\W\d_]{1,8}| ?\d{1,3}| ?[^\w\s]{1,3}|\s+|.", re.DOTALL)
+
+
+class ApproximateEncoding:
+    """
+    Stand-in for a tiktoken encoding that cannot be loaded.
+
+    tiktoken downloads the BPE file of an encoding the first time it is
+    used, which fails on machines without network access (e.g. load tests
+    on the offline model provider). Counts follow the shape of
+    cl100k_base (common words one token, long words several) closely
+    enough for the token debug output, chunk sizes and rate limit
+    estimates, but are not exact.
+    """
+
+    name = 'approximate'
+
+    def encode_ordinary(self, text: str) -> List[str]:
+        return APPROXIMATE_PIECE.findall(text)
+
+    def encode(self, text: str, **kwargs) -> List[str]:
+        return self.encode_ordinary(text)
+
+    def encode_ordinary_batch(self, texts: List[str], **kwargs) -> List[List[str]]:
+        return [self.encode_ordinary(text) for text in texts]
+
+
+def load_encoding(encoding_name: str = 'cl100k_base'):
+    """
+    Load a tiktoken encoding, or an ApproximateEncoding if it cannot be loaded.
+
+    Set TIKTOKEN_CACHE_DIR to a directory holding the downloaded BPE file to
+    count exactly without network access.
+    """
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        print(f"Could not load the {encoding_name} encoding ({str(e)}), using approximate token counts")
+        metrics.increment('token_counter_approximate')
+        return ApproximateEncoding()
+
+
+class TokenCounter:
+    """
+    Token counter that memoizes counts per text segment.
+
+    Prompts are built by embedding the same requirement (and the same
+    generated content) into several templates, so most lines of a prompt
+    were already counted for an earlier prompt of the same request, and the
+    static template lines were counted by an earlier request. A text counted
+    before is answered from the digest of its content. Other texts are split
+    into line segments, cached segments are looked up by content, and only
+    the remaining segments are encoded, in one batch.
+    """
+
+    def __init__(self, encoding, max_entries: int = 50000):
+        self.encoding = encoding
+        self.max_entries = max_entries
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'encoded_chars': 0, 'counted_chars': 0}
+
+    @staticmethod
+    def _key(segment: str):
+        if len(segment) < DIGEST_MIN_LENGTH:
+            return segment
+        return hashlib.blake2b(segment.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+    def count(self, text: str) -> int:
+        """Return the number of tokens in text"""
+        if not text:
+            return 0
+        return self.count_many([text])[0]
+
+    def count_many(self, texts: Iterable[str]) -> List[int]:
+        """Return the token counts of several texts, encoding the uncached segments in one batch"""
+        texts = list(texts)
+        totals = [0] * len(texts)
+        pending = {}
+        missing: Dict[object, str] = {}
+
+        with self._lock:
+            for index, text in enumerate(texts):
+                if not text:
+                    continue
+                # Texts counted before are answered from their digest alone
+                text_key = self._key(text)
+                cached = self._counts.get(text_key)
+                if cached is not None:
+                    self._counts.move_to_end(text_key)
+                    totals[index] = cached
+                    self.stats['hits'] += 1
+                    continue
+
+                segments = SEGMENT_BOUNDARY.split(text)
+                pending[index] = segments
+                for segment in segments:
+                    key = self._key(segment)
+                    cached = self._counts.get(key)
+                    if cached is None:
+                        missing.setdefault(key, segment)
+                        self.stats['misses'] += 1
+                    else:
+                        self._counts.move_to_end(key)
+                        totals[index] += cached
+                        self.stats['hits'] += 1
+                    self.stats['counted_chars'] += len(segment)
+
+        if not pending:
+            return totals
+
+        # Encode outside the lock; tiktoken releases the GIL for batches
+        counts = {}
+        if missing:
+            keys = list(missing)
+            encoded = self.encoding.encode_ordinary_batch([missing[key] for key in keys])
+            counts = {key: len(tokens) for key, tokens in zip(keys, encoded)}
+
+        # Add the newly encoded segments to the totals
+        for index, segments in pending.items():
+            totals[index] += sum(counts[key] for key in map(self._key, segments) if key in counts)
+
+        with self._lock:
+            counts.update((self._key(texts[index]), totals[index]) for index in pending)
+            for key, value in counts.items():
+                self._counts[key] = value
+                self._counts.move_to_end(key)
+            self.stats['encoded_chars'] += sum(len(segment) for segment in missing.values())
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return totals
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._counts)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
+
+
+_counters: Dict[str, TokenCounter] = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(encoding_name: str = 'cl100k_base', encoding: Optional[object] = None) -> TokenCounter:
+    """
+    Return the shared counter for an encoding, so all agents share one cache.
+
+    Args:
+        encoding_name: tiktoken encoding name
+        encoding: Already loaded encoding to use instead of loading it by name
+    """
+    with _counters_lock:
+        counter = _counters.get(encoding_name)
+        if counter is None:
+            if encoding is None:
+                encoding = load_encoding(encoding_name)
+            counter = TokenCounter(encoding)
+            _counters[encoding_name] = counter
+            metrics.register_collector(f'token_counter_{encoding_name}', counter.get_stats)
+        return counter